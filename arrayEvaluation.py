@@ -0,0 +1,247 @@
+"""
+Evaluation of the results of the calculators (derivatives, integrals) or of any other function over large arrays of
+inputs: NumPy arrays, memory-mapped .npy files or columns of CSV files. The inputs are read and evaluated in chunks, so
+memory use depends on the chunk size and not on the size of the input, and the results are streamed back (or written
+to a .npy/.csv file) chunk by chunk.
+
+    d, message = calculus.calculateDifferential("x**2*sin(x)", "x")
+    for values in evaluateChunks(d, ["x"], arrayChunks({"x": "inputs.npy"})):
+        ...
+    evaluateToFile(d, ["x"], csvChunks("inputs.csv", {"x": "time"}), "outputs.npy", workers=4)
+"""
+import collections
+import csv
+import os
+import tempfile
+import time
+
+import numpy as np
+from sympy import Basic, Integral, Symbol, lambdify, srepr, sympify
+
+import evaluation
+import expression
+import graphing
+
+DEFAULT_CHUNK_SIZE = 1 << 16     # Points per chunk
+
+# Maximum number of expressions kept compiled by compileForArrays (the least recently used are dropped first)
+MAX_COMPILED = 64
+
+# (srepr of the expression, variables, fallback) -> (numeric, precise), reused by every chunk. The most recently used
+# are at the end
+_compiled = collections.OrderedDict()
+
+
+def asExpression(result) -> Basic:
+    """
+    :param result: sympy expression (i.e. returned by calculus.calculateDifferential), CompiledExpression or string
+    """
+    if isinstance(result, expression.CompiledExpression):
+        return result.expr
+    if isinstance(result, str):
+        return expression.compileExpression(result).expr
+    return sympify(result, strict=True)     # Never parses strings that didn't go through compileExpression
+
+
+def compileForArrays(result, variables: list, fallback: bool = False) -> tuple:
+    """
+    Compiles an expression to be evaluated over arrays.
+    :param result: sympy expression, CompiledExpression or string
+    :param variables: names of the variables, in the order the arrays will be given
+    :param fallback: True to evaluate the points where NumPy fails again with mpmath (see graphing.evaluateFunction),
+    which is slow if there are many of them
+    :return: a tuple (numeric, precise) as expected by graphing.evaluateFunction (precise is None without fallback)
+    :raises ValueError: if the expression has variables that weren't given, or it still contains integrals
+    """
+    expr = asExpression(result)
+    key = (srepr(expr), tuple(variables), fallback)
+    if key in _compiled:
+        _compiled.move_to_end(key)
+    else:
+        if expr.has(Integral):
+            raise ValueError("the expression contains integrals that could not be calculated")
+        unknown = {str(symbol) for symbol in expr.free_symbols} - set(variables)
+        if unknown:
+            raise ValueError(f"unknown variables {', '.join(sorted(unknown))}")
+
+        symbols = [Symbol(v) for v in variables]
+        _compiled[key] = (lambdify(symbols, expr, modules="numpy"),
+                          lambdify(symbols, expr, modules="mpmath") if fallback else None)
+        while len(_compiled) > MAX_COMPILED:
+            _compiled.popitem(last=False)
+    return _compiled[key]
+
+
+def clearCompiled() -> None:
+    _compiled.clear()
+
+
+def arrayChunks(arrays: dict, chunkSize: int = DEFAULT_CHUNK_SIZE):
+    """
+    Splits arrays into chunks. Paths of .npy files are memory-mapped, so only the chunk being evaluated is read.
+    :param arrays: dictionary of variable -> 1D array (or anything NumPy can turn into one) or path of a .npy file, all
+    of them of the same length
+    :param chunkSize: number of points per chunk
+    :return: a generator of dictionaries of variable -> chunk of its array (views, not copies)
+    """
+    opened = {name: np.load(values, mmap_mode="r") if isinstance(values, (str, os.PathLike)) else np.asarray(values)
+              for name, values in arrays.items()}
+    lengths = {len(values) for values in opened.values()}
+    if len(lengths) > 1:
+        raise ValueError(f"the arrays have different lengths: {sorted(lengths)}")
+
+    length = lengths.pop() if lengths else 0
+    for start in range(0, length, chunkSize):
+        yield {name: values[start:start + chunkSize] for name, values in opened.items()}
+
+
+def csvChunks(path: str, columns: dict, chunkSize: int = DEFAULT_CHUNK_SIZE, delimiter: str = ","):
+    """
+    Reads columns of a CSV file (with a header row) in chunks, without loading the whole file.
+    :param path: path of the file
+    :param columns: dictionary of variable -> name of the column with its values
+    :param chunkSize: number of rows per chunk
+    :param delimiter: character that separates the columns
+    :return: a generator of dictionaries of variable -> array with the values of a chunk of rows (NaN where a value
+    is not a number)
+    """
+    with open(path, newline="", encoding="utf-8") as file:
+        reader = csv.DictReader(file, delimiter=delimiter)
+        missing = set(columns.values()) - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError(f"the file has no columns {', '.join(sorted(missing))}")
+
+        rows = {name: [] for name in columns}
+        for row in reader:
+            for name, column in columns.items():
+                rows[name].append(row[column])
+            if len(rows[next(iter(columns))]) == chunkSize:
+                yield {name: _toFloats(values) for name, values in rows.items()}
+                rows = {name: [] for name in columns}
+
+        if rows and rows[next(iter(columns))]:
+            yield {name: _toFloats(values) for name, values in rows.items()}
+
+
+def _toFloats(values: list) -> np.ndarray:
+    try:
+        return np.array(values, dtype=float)
+    except ValueError:  # Some of them aren't numbers, they are converted one by one
+        converted = np.full(len(values), np.nan)
+        for index, value in enumerate(values):
+            try:
+                converted[index] = float(value)
+            except ValueError:
+                pass
+        return converted
+
+
+def evaluateChunk(result, variables: list, chunk: dict, fallback: bool = False) -> np.ndarray:
+    """
+    Evaluates an expression over a chunk of inputs in a single vectorized call.
+    :param result: sympy expression, CompiledExpression or string
+    :param variables: names of the variables of the expression
+    :param chunk: dictionary of variable -> array (as generated by arrayChunks or csvChunks)
+    :param fallback: see compileForArrays
+    :return: the values (NaN where the expression is not defined or not real)
+    """
+    numeric, precise = compileForArrays(result, variables, fallback)
+    arrays = [np.asarray(chunk[variable], dtype=float) for variable in variables]
+    if not arrays:      # A constant, the length of the chunk is taken from any of its arrays
+        arrays = [np.zeros(len(next(iter(chunk.values()))))]
+        numeric, precise = (lambda _, f=numeric: f()), (None if precise is None else lambda _, f=precise: f())
+    return graphing.evaluateFunction(numeric, precise, *arrays)[0]
+
+
+def evaluateChunks(result, variables: list, chunks, workers: int = 1, fallback: bool = False, stats: dict = None):
+    """
+    Evaluates an expression over every chunk of inputs, yielding the values of each chunk as soon as they are ready
+    (in the same order as the chunks). Only a few chunks are in memory at any time, whatever the size of the input.
+    :param result: sympy expression (i.e. returned by calculus.calculateDifferential), CompiledExpression or string
+    :param variables: names of the variables of the expression
+    :param chunks: iterable of dictionaries of variable -> array (see arrayChunks and csvChunks)
+    :param workers: number of processes the chunks are evaluated in (1 evaluates them in this process)
+    :param fallback: see compileForArrays
+    :param stats: optional dictionary where the number of 'points' and 'chunks' and the 'seconds' spent are stored
+    :return: a generator of arrays with the values
+    """
+    expr = asExpression(result)
+    compileForArrays(expr, variables, fallback)     # Fails here (and not in a worker) if it can't be evaluated
+    stats = {} if stats is None else stats
+    stats.update(points=0, chunks=0, seconds=0.0)
+    start = time.perf_counter()
+
+    def count(values: np.ndarray) -> np.ndarray:
+        stats["points"] += len(values)
+        stats["chunks"] += 1
+        stats["seconds"] = time.perf_counter() - start
+        return values
+
+    if workers <= 1:
+        for chunk in chunks:
+            yield count(evaluateChunk(expr, variables, chunk, fallback))
+        return
+
+    pool = evaluation.WorkerPool(size=workers, preload=("arrayEvaluation",), name="array")
+    chunks = iter(chunks)
+    inFlight = {}       # pool job id -> position of the chunk
+    finished = {}       # position -> values, held until the previous chunks are yielded
+    submitted = nextPosition = 0
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(inFlight) < 2 * workers:
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    exhausted = True
+                    break
+                inFlight[pool.submit(evaluateChunk, (expr, variables, dict(chunk), fallback))] = submitted
+                submitted += 1
+
+            if exhausted and not inFlight and not finished:
+                return
+
+            pool.waitForResults()
+            for outcome in pool.poll():
+                position = inFlight.pop(outcome.jobId)
+                if not outcome.ok:
+                    raise RuntimeError(f"chunk {position} could not be evaluated: {outcome.message}")
+                finished[position] = outcome.value
+            while nextPosition in finished:
+                yield count(finished.pop(nextPosition))
+                nextPosition += 1
+    finally:
+        pool.shutdown()
+
+
+def evaluateToFile(result, variables: list, chunks, path: str, workers: int = 1, fallback: bool = False) -> dict:
+    """
+    Evaluates an expression over every chunk of inputs (see evaluateChunks), writing the values to a file as they are
+    calculated.
+    :param path: path of the file, a .npy file (1D array of floats) or a text file with a value per line otherwise
+    :return: dictionary with the number of 'points' and 'chunks' evaluated and the 'seconds' it took
+    """
+    stats = {}
+    values = evaluateChunks(result, variables, chunks, workers=workers, fallback=fallback, stats=stats)
+
+    if not path.lower().endswith(".npy"):
+        with open(path, "w", encoding="utf-8") as file:
+            for chunk in values:
+                np.savetxt(file, chunk, fmt="%.17g")
+        return stats
+
+    # The header of a .npy file needs the length, which isn't known until the end, so the values go to a raw file first
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.TemporaryFile(dir=directory) as raw:
+        for chunk in values:
+            raw.write(np.ascontiguousarray(chunk, dtype=np.float64).tobytes())
+
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=np.float64, shape=(stats["points"],))
+        raw.seek(0)
+        for start in range(0, stats["points"], DEFAULT_CHUNK_SIZE):
+            block = np.frombuffer(raw.read(DEFAULT_CHUNK_SIZE * 8), dtype=np.float64)
+            out[start:start + len(block)] = block
+        out.flush()
+        del out
+    return stats
@@ -0,0 +1,305 @@
+"""
+Headless access to the calculus and graphing modules, for scripts and pipelines (tkinter is never imported).
+
+Jobs are dictionaries (one JSON object per line, or one CSV row) with an 'op' and its parameters:
+    differentiate: func, var ("x"), order (1), partial (false)
+    integrate:     func, var ("x"), lower ("-∞"), upper ("+∞"), numeric (true, falls back to numeric quadrature)
+    plot:          func, var ("x"), lower ("-5"), upper ("5"), color, adaptive (true), output (image path, optional),
+                   format (png or svg, taken from the output's extension)
+    plot3d:        func, var ("x"), var2 ("y"), lower/upper ("-10"/"10"), lower2/upper2 ("-10"/"10"),
+                   resolution, output, format
+Images are rendered through the render cache (see rendering.py), so plots that were already rendered are just copied.
+An optional 'id' is copied to the result (the job's position in the input is used otherwise).
+Lines that aren't JSON objects are reported as failed jobs, and the rest still run.
+
+Usage:
+    python -m batch jobs.jsonl -o results.jsonl --workers 4 --timeout 10 --metrics batch.prom
+"""
+import argparse
+import csv
+import json
+import keyword
+import os
+import sys
+import time
+
+# Plots are only ever saved to files here, this has to be set before matplotlib is imported
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import calculus
+import evaluation
+import graphing
+import metrics
+import rendering
+
+OPERATIONS = ("differentiate", "integrate", "plot", "plot3d")
+TRUE_VALUES = ("1", "true", "yes", "y")
+
+# Fields of a job that name a variable
+VARIABLE_FIELDS = ("var", "var2")
+
+
+def _flag(value, default: bool) -> bool:
+    if value is None or value == "":
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() in TRUE_VALUES
+    return bool(value)
+
+
+def _text(value, default: str) -> str:
+    return default if value is None or value == "" else str(value)
+
+
+def _differentiate(job: dict) -> (object, str):
+    d, message = calculus.calculateDifferential(job["func"], inTermsOf=_text(job.get("var"), "x"),
+                                                nth=int(_text(job.get("order"), "1")),
+                                                partial=_flag(job.get("partial"), False))
+    return (None if d is None else str(d)), message
+
+
+def _integrate(job: dict) -> (object, str):
+    func, var = job["func"], _text(job.get("var"), "x")
+    upper, lower = _text(job.get("upper"), "+∞"), _text(job.get("lower"), "-∞")
+
+    fallback = _flag(job.get("numeric"), True) and calculus.numericBounds(upper, lower)[0] is not None
+    # Sympy gets less time when the integral can fall back to numeric quadrature, as in the calculator
+    seconds = evaluation.BUDGETS["integral-symbolic"].seconds if fallback else None
+    r, message = calculus.calculateIntegral(func, inTermsOf=var, uBound=upper, lBound=lower, seconds=seconds)
+    if r is not None and calculus.isUnevaluated(r) and fallback:
+        numeric, numericMessage = calculus.calculateNumericIntegral(func, var, upper, lower)
+        if numeric is not None:
+            return {"value": str(numeric["value"]), "error": numeric["error"], "method": numeric["method"],
+                    "tier": "numeric"}, numericMessage
+    return (None if r is None else str(r)), message
+
+
+def _plot(job: dict) -> (object, str):
+    var = _text(job.get("var"), "x")
+    visionRange = (_text(job.get("lower"), "-5"), _text(job.get("upper"), "5"))
+    color, adaptive = _text(job.get("color"), "#0000ff"), _flag(job.get("adaptive"), True)
+    if job.get("output"):
+        rendered, message = rendering.renderGraph2d(job["func"], var, visionRange, color, fmt=_format(job),
+                                                    output=job["output"], adaptive=adaptive)
+        return _renderResult(rendered), message
+
+    p, message = graphing.makeGraph2d(job["func"], var, visionRange, color, adaptive=adaptive)
+    return (None if p is None else _statsResult(p.samplingStats)), message
+
+
+def _plot3d(job: dict) -> (object, str):
+    args = (job["func"], _text(job.get("var"), "x"), _text(job.get("var2"), "y"),
+            (_text(job.get("lower"), "-10"), _text(job.get("upper"), "10")),
+            (_text(job.get("lower2"), "-10"), _text(job.get("upper2"), "10")))
+    resolution = int(_text(job.get("resolution"), str(graphing.DEFAULT_RESOLUTION_3D)))
+    if job.get("output"):
+        rendered, message = rendering.renderGraph3d(*args, resolution=resolution, fmt=_format(job),
+                                                    output=job["output"])
+        return _renderResult(rendered), message
+
+    p, message = graphing.makeGraph3d(*args, resolution=resolution)
+    return (None if p is None else _statsResult(p.samplingStats)), message
+
+
+def _format(job: dict) -> str:
+    # Taken from the extension of the output unless it is given
+    return _text(job.get("format"), os.path.splitext(job["output"])[1].lstrip(".").lower() or "png")
+
+
+def _statsResult(stats: dict) -> dict:
+    return {key: (list(value) if isinstance(value, tuple) else value) for key, value in stats.items()}
+
+
+def _renderResult(rendered: dict | None) -> dict | None:
+    # Graphs served from the render cache weren't sampled again, so they have no sampling stats
+    if rendered is None:
+        return None
+    result = _statsResult(rendered["samplingStats"] or {})
+    result.update(output=rendered["path"], cached=rendered["cached"])
+    return result
+
+
+HANDLERS = {"differentiate": _differentiate, "integrate": _integrate, "plot": _plot, "plot3d": _plot3d}
+
+
+def invalidVariable(job: dict) -> str | None:
+    """
+    :return: the first variable of the job (see VARIABLE_FIELDS) that isn't a valid name, or None if they all are.
+    Like the rest of the expression, names can't reach python's internals (see tokenizer.normalize)
+    """
+    for field in VARIABLE_FIELDS:
+        name = _text(job.get(field), "x").strip()
+        if not name.isidentifier() or keyword.iskeyword(name) or "__" in name:
+            return name
+    return None
+
+
+def runJob(job: dict) -> dict:
+    """
+    Runs a single job in this process.
+    :param job: dictionary with the 'op' and its parameters (see the module's docstring)
+    :return: dictionary with the job's 'id' and 'op', whether it went 'ok', its 'result' (a string for
+    derivatives and integrals, or a dictionary for numeric integrals and plots), the 'message' of the calculation, the
+    'error' (None if it went ok) and the seconds it took ('elapsed')
+    """
+    op = _text(job.get("op"), "").strip().lower()
+    outcome = {"id": job.get("id"), "op": op, "ok": False, "result": None, "message": "", "error": None,
+               "elapsed": 0.0}
+    start = time.perf_counter()
+
+    if job.get("invalid"):     # The line of the job could not be read (see readJobs)
+        outcome["error"] = job["invalid"]
+        return outcome
+    if op not in HANDLERS:
+        outcome["error"] = f"Unknown op '{op}', expected one of {', '.join(OPERATIONS)}"
+        return outcome
+    if not job.get("func"):
+        outcome["error"] = "Missing 'func'"
+        return outcome
+    invalid = invalidVariable(job)
+    if invalid is not None:
+        outcome["error"] = f"'{invalid}' can't be used as the name of a variable"
+        return outcome
+
+    try:
+        result, message = HANDLERS[op](job)
+    except Exception as e:      # Sympy raises all sorts of exceptions for incomplete or invalid expressions
+        outcome["error"] = f"{type(e).__name__}: {e}"
+    else:
+        outcome["message"] = message
+        if result is None:
+            outcome["error"] = message.split(" | ")[-1]
+        else:
+            outcome["ok"] = True
+            outcome["result"] = result
+
+    outcome["elapsed"] = time.perf_counter() - start
+    return outcome
+
+
+def _readLine(line: str) -> dict:
+    try:
+        row = json.loads(line)
+    except json.JSONDecodeError as e:
+        return {"invalid": f"Invalid JSON: {e}"}
+    if not isinstance(row, dict):
+        return {"invalid": f"Expected a JSON object, got {type(row).__name__}"}
+    return row
+
+
+def readJobs(stream, fmt: str = "jsonl"):
+    """
+    Reads jobs lazily from a text stream.
+    :param stream: file-like object with the jobs
+    :param fmt: "jsonl" (a JSON object per line) or "csv" (with a header row naming the fields)
+    :return: a generator of job dictionaries, each with an 'id' (its position in the input if it had none). A line that
+    isn't a JSON object becomes a job with only its 'id' and the reason it is 'invalid', so its result is an error and
+    the rest of the jobs still run
+    """
+    if fmt == "csv":
+        rows = csv.DictReader(stream)
+    elif fmt == "jsonl":
+        rows = (_readLine(line) for line in stream if line.strip())
+    else:
+        raise ValueError(f"Unknown format '{fmt}', expected 'jsonl' or 'csv'")
+
+    for index, row in enumerate(rows, start=1):
+        if row.get("id") in (None, ""):
+            row["id"] = index
+        yield row
+
+
+def runJobs(jobs, workers: int = None, budget: evaluation.Budget = None, ordered: bool = False):
+    """
+    Runs jobs in parallel in worker processes, reading them lazily (only a few more than there are workers are ever in
+    flight) and yielding their results as soon as they finish.
+    :param jobs: iterable of job dictionaries
+    :param workers: number of worker processes (one per core by default)
+    :param budget: limits for every job, jobs that exceed them are killed and reported as errors
+    :param ordered: True to yield the results in the same order as the jobs (holding back the ones that finish early)
+    :return: a generator of result dictionaries (see runJob)
+    """
+    workers = workers or os.cpu_count() or 1
+    pool = evaluation.WorkerPool(size=workers, preload=("batch",), name="batch")
+    jobs = iter(jobs)
+    inFlight = {}       # pool job id -> (position, job)
+    finished = {}       # position -> result, only used when ordered
+    submitted = 0
+    nextPosition = 0
+    exhausted = False
+
+    try:
+        while True:
+            while not exhausted and len(inFlight) < 2 * workers:
+                try:
+                    job = next(jobs)
+                except StopIteration:
+                    exhausted = True
+                    break
+                inFlight[pool.submit(runJob, (job,), budget=budget, operation=str(job.get("op")))] = (submitted, job)
+                submitted += 1
+
+            if exhausted and not inFlight:
+                return
+
+            pool.waitForResults()
+            for evaluated in pool.poll():
+                position, job = inFlight.pop(evaluated.jobId)
+                if evaluated.ok:
+                    result = evaluated.value
+                else:
+                    result = {"id": job.get("id"), "op": job.get("op"), "ok": False, "result": None,
+                              "message": "", "error": evaluated.message, "elapsed": evaluated.elapsed}
+
+                if not ordered:
+                    yield result
+                    continue
+                finished[position] = result
+                while nextPosition in finished:
+                    yield finished.pop(nextPosition)
+                    nextPosition += 1
+    finally:
+        pool.shutdown()
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m batch",
+                                     description="Runs differentiate/integrate/plot jobs without the GUI, streaming "
+                                                 "one JSON result per line.")
+    parser.add_argument("input", nargs="?", default="-", help="JSONL or CSV file with the jobs ('-' for stdin)")
+    parser.add_argument("-o", "--output", default="-", help="file where the results are written ('-' for stdout)")
+    parser.add_argument("--format", choices=("jsonl", "csv"), help="format of the input (guessed from its extension)")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (one per core)")
+    parser.add_argument("--timeout", type=float, default=None, help="seconds each job may run for")
+    parser.add_argument("--memory", type=float, default=None, help="MB of memory each job may use")
+    parser.add_argument("--ordered", action="store_true", help="write the results in the same order as the jobs")
+    parser.add_argument("--metrics", default=None, help="file where the metrics of the run are written at the end, "
+                                                        "in the Prometheus text format")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("csv" if args.input.lower().endswith(".csv") else "jsonl")
+    source = sys.stdin if args.input == "-" else open(args.input, newline="", encoding="utf-8")
+    target = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    budget = None
+    if args.timeout is not None or args.memory is not None:
+        budget = evaluation.Budget(seconds=args.timeout, memoryMb=args.memory)
+
+    failures = 0
+    try:
+        for result in runJobs(readJobs(source, fmt), workers=args.workers, budget=budget, ordered=args.ordered):
+            failures += not result["ok"]
+            target.write(json.dumps(result, ensure_ascii=False, default=str) + "\n")
+            target.flush()
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+        if args.metrics:
+            metrics.registry.writePrometheus(args.metrics)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
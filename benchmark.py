@@ -0,0 +1,287 @@
+"""
+Benchmarks of the calculus and graphing hot paths (derivatives, integrals, 2D and 3D graphs) over a fixed corpus of
+expressions. Every case reports its latency percentiles, its memory peak and its throughput; the results can be saved
+as a JSON baseline and later runs compared against it, flagging the cases that got slower or use more memory.
+
+Usage:
+    python -m benchmark --save baseline.json            (on the version used as reference)
+    python -m benchmark --baseline baseline.json        (exits with 1 if something regressed)
+    python -m benchmark --filter integral --repeat 20
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+# Plots are never shown here, and the persistent cache would turn every calculation into a lookup
+os.environ.setdefault("MPLBACKEND", "Agg")
+os.environ.pop("CALC_CACHE_PATH", None)
+
+import mpmath
+import numpy
+import sympy
+from sympy.core.cache import clear_cache
+
+import arrayEvaluation
+import calculus
+import expression
+import graphing
+
+DEFAULT_REPEAT = 7
+DEFAULT_WARMUP = 1
+
+# A case regresses if its median latency (or its memory peak) grows more than this fraction over the baseline...
+DEFAULT_TOLERANCE = 0.25
+# ...and by more than these absolute amounts, so that the noise of very fast cases isn't reported
+MIN_LATENCY_DELTA_MS = 1.0
+MIN_MEMORY_DELTA_KB = 64.0
+
+
+class Case:
+    """
+    A single benchmarked call, i.e. calculus.calculateDifferential("sin(x)**2", "x", 2)
+    """
+
+    def __init__(self, name: str, group: str, function, *args, **kwargs):
+        """
+        :param name: unique name of the case, used to match it with the baseline
+        :param group: kind of operation ("differential", "integral", "graph2d" or "graph3d"), so they can be filtered
+        :param function: function to be called, it must return a (result, message) tuple like the ones in calculus
+        and graphing
+        """
+        self.name = name
+        self.group = group
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        return self.function(*self.args, **self.kwargs)
+
+    def __repr__(self) -> str:
+        return f"Case({self.name})"
+
+
+def _differential(name: str, func: str, inTermsOf: str = "x", nth: int = 1, partial: bool = False) -> Case:
+    return Case(f"differential/{name}", "differential", calculus.calculateDifferential, func, inTermsOf, nth, partial)
+
+
+def _integral(name: str, func: str, lBound: str = "-∞", uBound: str = "+∞", inTermsOf: str = "x") -> Case:
+    return Case(f"integral/{name}", "integral", calculus.calculateIntegral, func, inTermsOf, uBound, lBound)
+
+
+def _graph2d(name: str, func: str, visionRange: tuple = ("-10", "10"), adaptive: bool = True) -> Case:
+    return Case(f"graph2d/{name}", "graph2d", graphing.makeGraph2d, func, "x", visionRange, "#0000ff",
+                adaptive=adaptive)
+
+
+def _graph3d(name: str, func: str, resolution: int) -> Case:
+    return Case(f"graph3d/{name}@{resolution}", "graph3d", graphing.makeGraph3d, func, "x", "y", ("-5", "5"),
+                ("-5", "5"), resolution=resolution)
+
+
+CORPUS = [
+    _differential("polynomial", "3*x**5 - 2*x**3 + x - 7"),
+    _differential("trig", "sin(x)**2*cos(3*x)"),
+    _differential("exponential", "exp(-x**2)*x**3"),
+    _differential("rational", "(x**2 + 1)/(x**3 - 2*x + 5)"),
+    _differential("nested", "sin(exp(cos(x**2)))"),
+    _differential("nth-order", "x**3*exp(x)*sin(x)", nth=5),
+    _differential("partial", "x**2*y**3 + sin(x*y)", "y", partial=True),
+    _differential("partial-nth", "exp(x*y)*cos(y)", "y", nth=3, partial=True),
+
+    _integral("polynomial", "3*x**5 - 2*x**3 + x - 7"),
+    _integral("trig", "sin(x)**2*cos(x)"),
+    _integral("exponential", "x**2*exp(x)"),
+    _integral("rational", "1/(x**2 + 3*x + 2)"),
+    _integral("by-parts", "x*log(x)"),
+    _integral("definite-polynomial", "x**3 - x", "0", "2"),
+    _integral("definite-trig", "x*sin(x)", "0", "pi"),
+    _integral("definite-gaussian", "exp(-x**2)", "0", "1"),
+
+    _graph2d("polynomial", "x**3 - 4*x"),
+    _graph2d("oscillating", "sin(50*x)*exp(-x**2/20)"),
+    _graph2d("poles", "tan(x)"),
+    _graph2d("rational", "1/(x**2 - 1)"),
+    _graph2d("uniform", "sin(x)*x", adaptive=False),
+
+    _graph3d("paraboloid", "x**2 + y**2", 25),
+    _graph3d("paraboloid", "x**2 + y**2", 50),
+    _graph3d("ripple", "sin(sqrt(x**2 + y**2))", 50),
+    _graph3d("ripple", "sin(sqrt(x**2 + y**2))", 100),
+    _graph3d("saddle-exp", "x*y*exp(-(x**2 + y**2)/10)", 100),
+]
+
+
+def _resetCaches() -> None:
+    # Every run starts cold, otherwise only the first one would actually calculate anything
+    calculus.resultCache.clear()
+    expression.clearExpressions()   # Along with their derivative towers, series and compiled numeric functions
+    arrayEvaluation.clearCompiled()
+    clear_cache()
+
+
+def _percentile(ordered: list, q: float) -> float:
+    """
+    :param ordered: sorted values
+    :param q: percentile, between 0 and 100
+    :return: the percentile, interpolating linearly between the closest values
+    """
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def runCase(case: Case, repeat: int = DEFAULT_REPEAT, warmup: int = DEFAULT_WARMUP) -> dict:
+    """
+    Runs a case several times (with empty caches every time) and measures it.
+    :param case: case to run
+    :param repeat: number of timed runs
+    :param warmup: number of runs before the timed ones, which are discarded
+    :return: dictionary with whether the case went 'ok' (and the 'message' if it didn't), the number of 'runs', the
+    latency in milliseconds ('min', 'p50', 'p90', 'p99', 'max', 'mean'), the 'throughput' in runs per second and the
+    memory peak of a single run in KB ('peakKb', measured separately because tracemalloc slows everything down)
+    """
+    for _ in range(warmup):
+        _resetCaches()
+        result, message = case.run()
+        if result is None:
+            return {"ok": False, "message": message}
+
+    timings = []
+    for _ in range(repeat):
+        _resetCaches()
+        start = time.perf_counter()
+        case.run()
+        timings.append(time.perf_counter() - start)
+
+    _resetCaches()
+    tracemalloc.start()
+    try:
+        case.run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    ordered = sorted(timing * 1000 for timing in timings)
+    return {"ok": True, "runs": repeat,
+            "min": ordered[0], "p50": _percentile(ordered, 50), "p90": _percentile(ordered, 90),
+            "p99": _percentile(ordered, 99), "max": ordered[-1], "mean": sum(ordered) / len(ordered),
+            "throughput": len(timings) / sum(timings), "peakKb": peak / 1024}
+
+
+def runSuite(cases: list = None, repeat: int = DEFAULT_REPEAT, warmup: int = DEFAULT_WARMUP, pattern: str = None,
+             progress=None) -> dict:
+    """
+    Runs every case of the corpus (or the received ones).
+    :param cases: cases to run, CORPUS by default
+    :param pattern: if given, only the cases whose name contains it are run
+    :param progress: optional function called with the name of every case and its results once it finishes
+    :return: dictionary with the 'meta'data of the run (versions, platform, date) and the 'results' of every case by name
+    """
+    results = {}
+    for case in (CORPUS if cases is None else cases):
+        if pattern and pattern not in case.name:
+            continue
+        results[case.name] = dict(runCase(case, repeat, warmup), group=case.group)
+        if progress is not None:
+            progress(case.name, results[case.name])
+
+    meta = {"date": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+            "platform": platform.platform(), "sympy": sympy.__version__, "numpy": numpy.__version__,
+            "mpmath": mpmath.__version__, "repeat": repeat}
+    return {"meta": meta, "results": results}
+
+
+def compareToBaseline(current: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> list:
+    """
+    Compares the results of a run with a baseline (both as returned by runSuite).
+    :param tolerance: fraction that the median latency or the memory peak may grow before it is a regression
+    :return: list of dictionaries, one per regression, with the case's 'name', the 'metric' ("p50", "peakKb" or "ok"),
+    its 'baseline' and 'current' values and their 'ratio'
+    """
+    regressions = []
+    for name, result in current["results"].items():
+        reference = baseline["results"].get(name)
+        if reference is None or not reference.get("ok"):
+            continue
+        if not result["ok"]:
+            regressions.append({"name": name, "metric": "ok", "baseline": True, "current": False, "ratio": None})
+            continue
+
+        for metric, minDelta in (("p50", MIN_LATENCY_DELTA_MS), ("peakKb", MIN_MEMORY_DELTA_KB)):
+            before, after = reference[metric], result[metric]
+            if after > before * (1 + tolerance) and after - before > minDelta:
+                regressions.append({"name": name, "metric": metric, "baseline": before, "current": after,
+                                    "ratio": after / before if before else None})
+    return regressions
+
+
+def formatReport(current: dict, baseline: dict = None, regressions: list = None) -> str:
+    """
+    :return: the results as a table, with the change of the median latency against the baseline (if any) and the
+    regressions found listed at the end
+    """
+    lines = [f"{'case':<34} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'runs/s':>9} {'peak KB':>9}"
+             + ("   vs baseline" if baseline else "")]
+    for name, result in current["results"].items():
+        if not result["ok"]:
+            lines.append(f"{name:<34} failed: {result['message']}")
+            continue
+        line = (f"{name:<34} {result['p50']:>9.2f} {result['p90']:>9.2f} {result['p99']:>9.2f} "
+                f"{result['throughput']:>9.1f} {result['peakKb']:>9.0f}")
+        reference = (baseline or {}).get("results", {}).get(name)
+        if reference and reference.get("ok") and reference["p50"]:
+            line += f"   {(result['p50'] / reference['p50'] - 1) * 100:+7.1f}%"
+        lines.append(line)
+
+    if regressions:
+        lines.append("")
+        lines.append(f"{len(regressions)} regression(s):")
+        for regression in regressions:
+            if regression["metric"] == "ok":
+                lines.append(f"  {regression['name']}: worked in the baseline but failed now")
+            else:
+                lines.append(f"  {regression['name']}: {regression['metric']} {regression['baseline']:.2f} -> "
+                             f"{regression['current']:.2f} (x{regression['ratio']:.2f})")
+    elif baseline:
+        lines.append("")
+        lines.append("No regressions")
+    return "\n".join(lines)
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmark",
+                                     description="Benchmarks derivatives, integrals and 2D/3D graphs.")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="timed runs per case")
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP, help="untimed runs per case")
+    parser.add_argument("--filter", default=None, help="only run the cases whose name contains this text")
+    parser.add_argument("--save", default=None, help="file where the results are saved (as JSON) to be a baseline")
+    parser.add_argument("--baseline", default=None, help="JSON file with the results to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="fraction the latency or memory of a case may grow before it is a regression")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+
+    current = runSuite(repeat=args.repeat, warmup=args.warmup, pattern=args.filter,
+                       progress=lambda name, result: print(f"  {name}", file=sys.stderr))
+    regressions = compareToBaseline(current, baseline, args.tolerance) if baseline else []
+    print(formatReport(current, baseline, regressions))
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(current, file, indent=2)
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
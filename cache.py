@@ -0,0 +1,211 @@
+import collections
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+import metrics
+
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+DEFAULT_MAX_DISK_ENTRIES = 20000
+
+# Environment variable that enables the persistent tier of calculus.resultCache (its value is the database's path)
+PERSIST_ENV_VAR = "CALC_CACHE_PATH"
+
+DEFAULT_PERSIST_PATH = os.path.join(os.path.expanduser("~"), ".advanced-calculator", "results.sqlite3")
+
+
+class ResultCache:
+    """
+    Bounded cache of calculation results with LRU eviction.
+    Values are kept in memory (limited both by number of entries and by their pickled size) and, optionally, in a
+    sqlite database that persists between sessions and that can be shared by several processes.
+    Keys must be tuples of strings/numbers, and values must be picklable.
+    """
+
+    def __init__(self, maxEntries: int = DEFAULT_MAX_ENTRIES, maxBytes: int = DEFAULT_MAX_BYTES,
+                 persistPath: str = None, maxDiskEntries: int = DEFAULT_MAX_DISK_ENTRIES, name: str = "results"):
+        """
+        :param maxEntries: maximum number of results kept in memory
+        :param maxBytes: maximum total size (pickled) of the results kept in memory
+        :param persistPath: path of the sqlite database used as the persistent tier (None disables it)
+        :param maxDiskEntries: maximum number of results kept in the persistent tier
+        :param name: name of the cache in the metrics (see metrics.py)
+        """
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.maxDiskEntries = maxDiskEntries
+        self.labels = {"cache": name}   # Of its metrics
+
+        self.entries = collections.OrderedDict()    # key -> (value, size), the most recently used at the end
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "diskHits": 0, "evictions": 0, "stores": 0}
+
+        self.db = None
+        if persistPath:
+            self.persistTo(persistPath)
+        metrics.registry.addCollector(self.collectMetrics)
+
+    def get(self, key: tuple, default=None):
+        """
+        :return: the value stored for the key (moving it to the memory tier if it came from disk), or default
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                metrics.registry.inc("cache_hits_total", self.labels)
+                return self.entries[key][0]
+
+        blob = self._diskGet(key)
+        if blob is not None:
+            try:
+                value = pickle.loads(blob)
+            except Exception:   # Written by an incompatible version, it will be overwritten
+                value = None
+            if value is not None:
+                with self.lock:
+                    self.stats["hits"] += 1
+                    self.stats["diskHits"] += 1
+                metrics.registry.inc("cache_hits_total", self.labels)
+                metrics.registry.inc("cache_disk_hits_total", self.labels)
+                self._memoryPut(key, value, len(blob))
+                return value
+
+        with self.lock:
+            self.stats["misses"] += 1
+        metrics.registry.inc("cache_misses_total", self.labels)
+        return default
+
+    def peek(self, key: tuple, default=None):
+        """
+        Looks a key up like get, but without counting it as a hit or a miss (i.e. for lookups that only may save some
+        work, which would distort the hit rate of the results that are actually asked for)
+        :return: the value stored for the key, or default
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+
+        blob = self._diskGet(key)
+        if blob is not None:
+            try:
+                value = pickle.loads(blob)
+            except Exception:   # Written by an incompatible version, it will be overwritten
+                return default
+            self._memoryPut(key, value, len(blob))
+            return value
+        return default
+
+    def put(self, key: tuple, value, persist: bool = True) -> None:
+        """
+        Stores a value for the key.
+        :param persist: if False the value is only kept in memory (i.e. when it is known to be on disk already)
+        """
+        try:
+            blob = pickle.dumps(value)
+        except Exception:
+            return
+
+        self._memoryPut(key, value, len(blob))
+        if persist:
+            self._diskPut(key, blob)
+
+    def clear(self, disk: bool = False) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+        if disk and self.db is not None:
+            with self.db:
+                self.db.execute("DELETE FROM results")
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self.entries
+
+    def snapshot(self) -> dict:
+        """
+        :return: the hit/miss statistics along with the current size of the cache
+        """
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(self.stats, entries=len(self.entries), bytes=self.bytes,
+                        hitRate=self.stats["hits"] / lookups if lookups else 0.0,
+                        persistent=self.db is not None)
+
+    def collectMetrics(self) -> list:
+        """
+        :return: the size of the cache as (name, labels, value) samples (see metrics.MetricsRegistry.addCollector), its
+        hits and misses are counted as they happen
+        """
+        with self.lock:
+            return [("cache_entries", self.labels, len(self.entries)), ("cache_bytes", self.labels, self.bytes)]
+
+    def _memoryPut(self, key: tuple, value, size: int) -> None:
+        if size > self.maxBytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            self.stats["stores"] += 1
+
+            while len(self.entries) > self.maxEntries or self.bytes > self.maxBytes:
+                oldKey, (oldValue, oldSize) = self.entries.popitem(last=False)
+                self.bytes -= oldSize
+                self.stats["evictions"] += 1
+                metrics.registry.inc("cache_evictions_total", self.labels)
+
+    def persistTo(self, path: str) -> None:
+        """
+        Enables the persistent tier, stored in a sqlite database at the given path (created if it doesn't exist)
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            self.db = sqlite3.connect(path, timeout=1, check_same_thread=False)
+            with self.db:
+                self.db.execute("PRAGMA journal_mode=WAL")
+                self.db.execute("CREATE TABLE IF NOT EXISTS results "
+                                "(key TEXT PRIMARY KEY, value BLOB, used REAL)")
+        except sqlite3.Error as e:
+            # The cache only makes things faster, it is never worth failing because of it
+            print(f"Persistent cache disabled, could not open '{path}': {e}")
+            self.db = None
+
+    def _diskGet(self, key: tuple):
+        if self.db is None:
+            return None
+        try:
+            with self.lock, self.db:
+                row = self.db.execute("SELECT value FROM results WHERE key = ?", (repr(key),)).fetchone()
+                if row is not None:
+                    # Marks it as recently used, so the entries read from disk are the last ones evicted from it.
+                    # Hits in memory don't, they would mean a write for every lookup
+                    self.db.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), repr(key)))
+        except sqlite3.Error:
+            return None
+        return None if row is None else row[0]
+
+    def _diskPut(self, key: tuple, blob: bytes) -> None:
+        if self.db is None:
+            return
+        try:
+            with self.lock, self.db:
+                self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (repr(key), blob, time.time()))
+                count = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+                if count > self.maxDiskEntries:
+                    # Drops the least recently stored (or read from disk) tenth of the entries
+                    self.db.execute("DELETE FROM results WHERE key IN "
+                                    "(SELECT key FROM results ORDER BY used LIMIT ?)",
+                                    (count - self.maxDiskEntries + self.maxDiskEntries // 10,))
+        except sqlite3.Error:
+            pass
@@ -1,11 +1,52 @@
+import argparse
+import multiprocessing
+import os
 import tkinter as tk
 from tkinter import messagebox
+from typing import TYPE_CHECKING
 
 #  ⬇   M Y   O W N   M O D U L E S   ⬇
-import graphing
-import calculus
+import cache
+import evaluation
+import instrumentation
+import lazyImport
+import metrics
+import tokenizer
 import uiElements as ui
 
+if TYPE_CHECKING:   # Lets pyinstaller (and IDEs) find the modules that are imported lazily below
+    import calculus
+    import codeExport
+    import graphing
+    import plotCanvas
+
+# Sympy, NumPy and matplotlib take seconds to import, so they are only loaded once the main menu is on screen
+calculus = lazyImport.LazyModule("calculus")
+graphing = lazyImport.LazyModule("graphing")
+plotCanvas = lazyImport.LazyModule("plotCanvas")
+codeExport = lazyImport.LazyModule("codeExport")
+LAZY_MODULES = ["calculus", "graphing", "plotCanvas", "codeExport"]
+
+# Key that shows the last derivative or integral as a standalone NumPy function (see codeExport.py)
+EXPORT_KEY = "<Control-e>"
+
+
+def showExport(result) -> None:
+    """
+    Shows a result of the calculators as a Python function that evaluates it with NumPy, calculating its common
+    subexpressions once, so that it can be copied into numeric code.
+    :param result: derivative or integral (a sympy expression), or None if there is nothing to export yet
+    """
+    if result is None:
+        return
+    try:
+        code = codeExport.numpySource(result, sorted(str(symbol) for symbol in result.free_symbols))
+    except ValueError as e:
+        messagebox.showerror("Export", f"The result can't be exported: {e}")
+        return
+    ui.CodeInfoWindow(code=code, labelTitleText="Result as a NumPy function", title="Export",
+                      code_font=ui.GEN_CODE_FONT(9), dimensions="720x420")
+
 
 class Graph2D:
     DETAILS_LABEL_CONTENT = "Click here to enter the window for introducing the 2D graph's details.\n\n" \
@@ -20,7 +61,9 @@ class Graph2D:
         mathematical function.
         """
 
-        self.window2d = tk.Tk()
+        self.session = None     # Samples of the last function drawn, reused when only its range or color change
+
+        self.window2d = ui.newWindow()
         self.window2d.geometry("460x320")
         self.window2d.title("Building a 2D graph (sympy)")
         self.window2d.configure(bg=ui.WINDOW_BG)
@@ -65,7 +108,7 @@ class Graph2D:
         # Does the same as the button2dOk when you press enter (return key)
 
         self.window2d.resizable(False, False)
-        self.window2d.mainloop()
+        ui.runMainloop(self.window2d)
 
     def generateGraph(self, forWhat="graph") -> None:
         """
@@ -98,7 +141,8 @@ class Graph2D:
         if forWhat == "graph":
             self.window2d.title("Generating graph...")
             graph, errReport = graphing.makeGraph2d(func=dataList[0], inTermsOf=dataList[1],
-                                                    visionRange=(dataList[3], dataList[4]), funcHue=dataList[2])
+                                                    visionRange=(dataList[3], dataList[4]), funcHue=dataList[2],
+                                                    session=self.session)
 
             if graph is None:
                 errReport = errReport.split(" | ")
@@ -106,8 +150,13 @@ class Graph2D:
                 self.window2d.focus_force()
                 return
             else:
-                self.window2d.after(1, lambda: graph.show())
-                self.window2d.after(1000, lambda: self.window2d.title("Building a 2D graph (sympy)"))
+                self.session = graph.session
+                stats = graph.samplingStats
+                self.window2d.after(1, lambda: plotCanvas.showPlot(graph))
+                self.window2d.after(1000, lambda: self.window2d.title(
+                    f"Building a 2D graph (sympy) - {stats['evaluations']}/{stats['budget']} points "
+                    f"({stats['reused']} reused), "
+                    f"{stats['breaks']} breaks, {(stats['compileTime'] + stats['evalTime']) * 1000:.0f} ms"))
 
         elif forWhat == "code":
             ui.CodeInfoWindow(code=f"plot({dataList[0]}, (inTermsOf={dataList[1]}, visionRangeMin={dataList[3]}, "
@@ -130,8 +179,8 @@ class Graph3D:
         mathematical function.
         """
 
-        self.window3d = tk.Tk()
-        self.window3d.geometry("460x320")
+        self.window3d = ui.newWindow()
+        self.window3d.geometry("460x360")
         self.window3d.title("Building a 3D graph (sympy)")
         self.window3d.configure(bg=ui.WINDOW_BG)
         self.window3d.focus_force()
@@ -164,6 +213,9 @@ class Graph3D:
         visFromEntryY = self.vis3dGroup.add_entry(placeholder="from", width=5)
         visToEntryY = self.vis3dGroup.add_entry(placeholder="to", width=5, column=2, row=5)
 
+        resGroup = ui.OperationTypeGroup(self.window3d, name="Resolution: ", relx=0.1, rely=0.84)
+        self.resEntry = resGroup.add_entry(width=5, placeholder=str(graphing.DEFAULT_RESOLUTION_3D))
+
         button3dOk = ui.DefaultButton(self.window3d, text="Draw function", width=0)
         button3dOk.configure(command=lambda: self.generateGraph())
         button3dOk.placeBt(relx=0.72, rely=0.72)
@@ -178,7 +230,32 @@ class Graph3D:
         # Does the same as the button2dOk when you press enter (return key)
 
         self.window3d.resizable(False, False)
-        self.window3d.mainloop()
+        ui.runMainloop(self.window3d)
+
+    def drawLevel(self, graph, levels, xlabel: str, ylabel: str) -> None:
+        """
+        Draws a level of the 3D graph and, once it is on screen, samples and draws the next one (see
+        graphing.makeGraph3dLevels)
+        :param graph: the sympy.Plot of the level
+        :param levels: generator of the next levels
+        :param xlabel: name of the first variable
+        :param ylabel: name of the second variable
+        """
+        window = plotCanvas.showPlot(graph, xlabel=xlabel, ylabel=ylabel)
+        stats = graph.samplingStats
+        try:
+            self.window3d.title(f"Building a 3D graph (sympy) - {stats['points']} points, "
+                                f"{stats['pointsPerSecond'] / 1e6:.1f} M points/s")
+        except tk.TclError:     # The window was closed, the rest of the levels are not needed
+            return
+
+        def drawNext():
+            following, _ = next(levels, (None, None))
+            if following is not None and window.isOpen():
+                self.drawLevel(following, levels, xlabel, ylabel)
+
+        # Idle callbacks run in order, so the canvas has drawn this level before the next one is sampled
+        self.window3d.after_idle(lambda: self.window3d.after(1, drawNext))
 
     def updateItofLabel(self, variable: str = "x") -> None:
         if variable == "x":
@@ -217,9 +294,19 @@ class Graph3D:
 
         if forWhat == "graph":
             self.window3d.title("Generating graph...")
-            graph, errReport = graphing.makeGraph3d(func=dataList[0], inTermsOfX=dataList[1], inTermsOfY=dataList[2],
-                                                    visionRangeX=(dataList[3], dataList[4]),
-                                                    visionRangeY=(dataList[5], dataList[6]))
+            try:
+                resolution = int(self.resEntry.get())   # Points per axis
+            except ValueError:
+                resolution = graphing.DEFAULT_RESOLUTION_3D
+
+            # A coarse preview is drawn first, and the full resolution replaces it once it is sampled
+            resolution = max(2, resolution)
+            resolutions = (graphing.PREVIEW_RESOLUTION_3D, resolution) \
+                if resolution > graphing.PREVIEW_RESOLUTION_3D else (resolution,)
+            levels = graphing.makeGraph3dLevels(func=dataList[0], inTermsOfX=dataList[1], inTermsOfY=dataList[2],
+                                                visionRangeX=(dataList[3], dataList[4]),
+                                                visionRangeY=(dataList[5], dataList[6]), resolutions=resolutions)
+            graph, errReport = next(levels)
 
             if graph is None:
                 errReport = errReport.split(" | ")
@@ -227,14 +314,14 @@ class Graph3D:
                 self.window3d.focus_force()
                 return
             else:
-                self.window3d.after(1, lambda: graph.show())
-                self.window3d.after(1000, lambda: self.window3d.title("Building a 3D graph (sympy)"))
+                self.window3d.after(1, lambda: self.drawLevel(graph, levels, dataList[1], dataList[2]))
 
         elif forWhat == "code":
             ui.CodeInfoWindow(code=f"plot3d({dataList[0]}, (inTermsOfX={dataList[1]}, visionRangeMinX={dataList[3]}, "
                                    f"visionRangeMaxX={dataList[4]}), "
                                    f"(inTermsOfY={dataList[2]}, visionRangeMinY={dataList[5]}, "
-                                   f"visionRangeMaxY={dataList[6]}))",
+                                   f"visionRangeMaxY={dataList[6]}), nb_of_points_x={self.resEntry.get()}, "
+                                   f"nb_of_points_y={self.resEntry.get()})",
                               labelTitleText="Code used for 3D graph", library="from sympy.plotting import plot3d")
 
         else:
@@ -249,6 +336,14 @@ class DifferentialCalculator:
                                         " is also a button to show what the code that computes" \
                                         " this part looks like in python."
 
+    # Modes of the partial derivative window: a single partial derivative (None), or a whole matrix of them
+    MATRIX_MODES = (None, "gradient", "jacobian", "hessian")
+    MATRIX_SYMBOLS = {None: "∂", "gradient": "∇", "jacobian": "J", "hessian": "H"}
+
+    # Limits of the order of the series shown in series mode (changed with the Up and Down keys)
+    MIN_SERIES_ORDER = 1
+    MAX_SERIES_ORDER = 30
+
     DETAILS_LABEL_CONTENT_NORMALDIFF = "Click here to enter the window for real-time calculation of the differential" \
                                        " equation.\n\nThis part of the program is able to calculate any differential" \
                                        " equation given.\nIn the same way as with every other part, there is also a" \
@@ -261,6 +356,9 @@ class DifferentialCalculator:
         :param partial: True if the differential is going to be partial, false otherwise
         """
         self.partial = partial
+        self.matrixKind = None
+        self.lastResult = None      # Last derivative shown, the one exported with EXPORT_KEY
+        self.seriesOrder = None     # Order of the series shown in series mode, None while showing the derivative
 
         #   char acts as a border signalling the end of the 'in terms of' char that will be inserted
         if partial:
@@ -270,7 +368,7 @@ class DifferentialCalculator:
             self.ansText = "d/d ||"
             self.insertPosAnsText = 3
 
-        self.windowDiff = tk.Tk()
+        self.windowDiff = ui.newWindow()
         self.windowDiff.geometry("460x320")
         self.windowDiff.configure(background=ui.WINDOW_BG)
         self.windowDiff.title(f"Calculating a{' partial ' if partial else ' '}derivative (sympy)")
@@ -299,6 +397,19 @@ class DifferentialCalculator:
         codeButtonDiff.configure(
             command=lambda: self.handleKeyEvent(forWhat="code"))
 
+        if partial:
+            # Switches between a single partial derivative and the gradient, jacobian or hessian (for which several
+            # variables, and functions for the jacobian, can be entered separated by commas)
+            self.modeButtonDiff = ui.DefaultButton(self.windowDiff, text="Mode: ∂", width=0)
+            self.modeButtonDiff.placeBt(relx=0.7, rely=0.1)
+            self.modeButtonDiff.configure(command=self.switchMode)
+        else:
+            # Switches between the derivative and the series of the function around a point ('x' or 'x=a' is entered
+            # as the variable, and the order is changed with the Up and Down keys)
+            self.modeButtonDiff = ui.DefaultButton(self.windowDiff, text="Mode: d/dx", width=0)
+            self.modeButtonDiff.placeBt(relx=0.7, rely=0.1)
+            self.modeButtonDiff.configure(command=self.switchSeriesMode)
+
         self.resultLabelDiff.configure(
             text=(self.ansText[:self.insertPosAnsText] +
                   self.itofEntryDiff.get() +
@@ -307,10 +418,33 @@ class DifferentialCalculator:
         self.funcEntryDiff.bind("<Key>", lambda e: self.handleKeyEvent(e))
         self.itofEntryDiff.bind("<Key>", lambda e: self.handleKeyEvent(e))
 
-        self.windowDiff.bind("<Escape>", lambda e: self.windowDiff.destroy())
-        self.windowDiff.mainloop()
+        self.statsLabelDiff = tk.Label(self.windowDiff, bg=ui.WINDOW_BG, fg=ui.LIGHT_DARK_DECO_BG, text="")
+        self.statsLabelDiff.place(relx=0.5, rely=0.93, anchor=tk.CENTER)
+
+        # Differentials are calculated in a separate process so that typing never waits for sympy, and only once the
+        # input has settled
+        self.engine = evaluation.EvaluationEngine(self.windowDiff)
+        self.debouncer = evaluation.DebounceScheduler(
+            self.windowDiff, self.calculate,
+            snapshot=lambda: (self.funcEntryDiff.get(), self.itofEntryDiff.get(), self.matrixKind, self.seriesOrder))
+
+        self.windowDiff.bind("<Return>", lambda e: self.debouncer.flush())
+        self.windowDiff.bind(EXPORT_KEY, lambda e: self.export())
+        self.windowDiff.bind("<Up>", lambda e: self.changeSeriesOrder(1))
+        self.windowDiff.bind("<Down>", lambda e: self.changeSeriesOrder(-1))
+        self.windowDiff.bind("<Escape>", lambda e: self.close())
+        self.windowDiff.protocol("WM_DELETE_WINDOW", self.close)
+        ui.runMainloop(self.windowDiff)
+
+    def close(self) -> None:
+        """
+        Cancels any differential still being calculated and destroys the window
+        """
+        self.debouncer.cancel()
+        self.engine.shutdown()
+        self.windowDiff.destroy()
 
-    def handleKeyEvent(self, event=None, forWhat="calc", recalling=False) -> None:
+    def handleKeyEvent(self, event=None, forWhat="calc") -> None:
         """
         Handler for the Key event in some entries. It reads the parameters received and decides what to do with them.
         It can either calculate the differential of the given mathematical function, or display a window with the
@@ -318,44 +452,285 @@ class DifferentialCalculator:
         :param event: The event that triggered this function call
         :param forWhat: Can be either 'calc', to indicate that the differential must be calculated,
         or 'code' to indicate that the code necessary for this calculation must be displayed
-        :param recalling: Indicates if this is the first call made to the function (False) or if it has been called
-        again from a previous call (True)
         :return: None
         """
-        recallingDiff = recalling
-        func = self.funcEntryDiff.get()
-        itof = self.itofEntryDiff.get()  # itof stands for in terms of
-        # resultLabel = labelList[0]
-
-        if forWhat.lower() == "code":
+        if forWhat.lower() == "code" and self.matrixKind is not None:
+            func = ", ".join(calculus.cleanExpr(f) for f in tokenizer.splitTopLevel(self.funcEntryDiff.get()))
+            itof = self.itofEntryDiff.get()
+            code = {"gradient": f"[diff({func}, v) for v in ({itof},)]",
+                    "jacobian": f"Matrix([{func}]).jacobian([{itof}])",
+                    "hessian": f"hessian({func}, ({itof},))"}[self.matrixKind]
+            ui.CodeInfoWindow(code=code, labelTitleText=f"Code used for calculating the {self.matrixKind}",
+                              library="from sympy import *", dimensions="380x200")
+        elif forWhat.lower() == "code" and self.seriesOrder is not None:
+            variable, point = self.seriesParameters()
+            ui.CodeInfoWindow(code=f"series({calculus.cleanExpr(self.funcEntryDiff.get())}, {variable or 'x'}, "
+                                   f"{point}, {self.seriesOrder})",
+                              labelTitleText="Code used for calculating series", library="from sympy import *",
+                              dimensions="380x200")
+        elif forWhat.lower() == "code":
+            func = self.funcEntryDiff.get()
+            itof = self.itofEntryDiff.get()  # itof stands for in terms of
             ui.CodeInfoWindow(code=f"diff({calculus.cleanExpr(func)}{f', {itof}' if self.partial else ''})",
                               labelTitleText=f"Code used for calculating{' partial' if self.partial else ''} "
                                              f"derivatives",
                               library="from sympy import *", dimensions="380x200")
+        elif forWhat.lower() == "calc":
+            # The entries are read once the typing settles (the Key event is raised before the entry is updated)
+            self.debouncer.trigger()
+        else:
+            raise SyntaxError(f"Invalid 'forWhat' given: {forWhat},\nExpected 'calc' or 'code'")
 
-        if recallingDiff:
-            recallingDiff = False
-            if forWhat.lower() == "calc":
-                try:
-                    toShow, diffMsg = calculus.calculateDifferential(func, inTermsOf=itof, partial=self.partial)
-                except Exception as e:
-                    # Catches exceptions raised by Sympy whenever it can't calculate a differential
-                    # print(f"DEBUG: An error happened, specifically:\n {e} \n\n Tried: {calculus.cleanExpr(func)}")
-                    str(e)  # This line removes a warning
-
-                    # Indicates that the differential is being calculated:
-                    self.resultLabelDiff.configure(fg=ui.LIGHT_DARK_DECO_BG)
-                else:
-                    baseText = self.resultLabelDiff["text"][:self.resultLabelDiff["text"].index("=") + 2]
+    def calculate(self) -> None:
+        """
+        Submits the calculation of the differential for the current contents of the entries
+        """
+        func = self.funcEntryDiff.get()
+        itof = self.itofEntryDiff.get()  # itof stands for in terms of
 
-                    baseText = baseText[:self.insertPosAnsText] + itof + baseText[baseText.index(" "):]
-                    self.resultLabelDiff.configure(text=baseText + calculus.cleanExpr(toShow), fg=ui.FG_LABELS)
-            else:
-                raise SyntaxError(f"Invalid 'forWhat' given: {forWhat},\nExpected 'calc' or 'code'")
+        if self.matrixKind is not None:
+            self.calculateMatrix(func, itof)
+            return
+        if self.seriesOrder is not None:
+            self.calculateSeries(func)
+            return
 
-        else:
-            recallingDiff = True
-            self.windowDiff.after(1, lambda: self.handleKeyEvent(event, forWhat, recallingDiff))
+        cached = calculus.resultCache.get(calculus.cacheKey("differential", func, itof, 1, self.partial))
+        if cached is not None:
+            self.engine.cancel("calc")
+            self.showDifferential(evaluation.EvaluationResult(0, "ok", (cached, "Differential calculated successfully")),
+                                  itof, func)
+            ui.showDebounceStats(self.statsLabelDiff, self.debouncer)
+            return
+
+        # Submitting on the same channel supersedes the calculation started for the previous input
+        self.engine.submit(calculus.calculateDifferential, (func,),
+                           {"inTermsOf": itof, "partial": self.partial},
+                           onResult=lambda result: self.showDifferential(result, itof, func), channel="calc",
+                           budget=evaluation.BUDGETS["differential"])
+        ui.showDebounceStats(self.statsLabelDiff, self.debouncer)
+
+    def switchMode(self) -> None:
+        """
+        Moves on to the next mode of the partial derivative window (see MATRIX_MODES) and recalculates the result
+        """
+        self.matrixKind = self.MATRIX_MODES[(self.MATRIX_MODES.index(self.matrixKind) + 1) % len(self.MATRIX_MODES)]
+        self.modeButtonDiff.configure(text=f"Mode: {self.MATRIX_SYMBOLS[self.matrixKind]}")
+        self.windowDiff.title(f"Calculating the {self.matrixKind or 'partial derivative'} (sympy)")
+
+        self.engine.cancel("calc")
+        self.resultLabelDiff.configure(
+            text=(self.ansText[:self.insertPosAnsText] + self.itofEntryDiff.get() +
+                  self.ansText[self.insertPosAnsText:]).replace("||", " = ") if self.matrixKind is None
+            else f"{self.MATRIX_SYMBOLS[self.matrixKind]} = ", fg=ui.LIGHT_DARK_DECO_BG)
+        self.debouncer.flush()
+
+    def switchSeriesMode(self) -> None:
+        """
+        Switches between showing the derivative and the series of the function, and recalculates the result
+        """
+        self.seriesOrder = calculus.DEFAULT_SERIES_ORDER if self.seriesOrder is None else None
+        self.modeButtonDiff.configure(text="Mode: d/dx" if self.seriesOrder is None else "Mode: Σ")
+        self.windowDiff.title("Calculating a derivative (sympy)" if self.seriesOrder is None
+                              else "Calculating a series (sympy)")
+
+        self.engine.cancel("calc")
+        self.lastResult = None
+        self.resultLabelDiff.configure(
+            text=(self.ansText[:self.insertPosAnsText] + self.itofEntryDiff.get() +
+                  self.ansText[self.insertPosAnsText:]).replace("||", " = ") if self.seriesOrder is None
+            else self.seriesHeader(), fg=ui.LIGHT_DARK_DECO_BG)
+        self.debouncer.flush()
+
+    def changeSeriesOrder(self, change: int) -> None:
+        """
+        Changes the order of the series shown (in series mode), which only calculates the terms that are missing
+        :param change: number of orders to add (or remove, if negative)
+        """
+        if self.seriesOrder is None:
+            return
+        order = min(max(self.seriesOrder + change, self.MIN_SERIES_ORDER), self.MAX_SERIES_ORDER)
+        if order != self.seriesOrder:
+            self.seriesOrder = order
+            self.resultLabelDiff.configure(text=self.seriesHeader(), fg=ui.LIGHT_DARK_DECO_BG)
+            self.debouncer.flush()
+
+    def seriesHeader(self) -> str:
+        return f"Σ (order {self.seriesOrder}) = "
+
+    def seriesParameters(self) -> (str, str):
+        """
+        :return: the variable of the series (None if it wasn't entered) and the point it is calculated around, read
+        from the variable entry ('x' or 'x=a', around 0 if no point is given)
+        """
+        variable, _, point = self.itofEntryDiff.get().partition("=")
+        return variable.strip() or None, point.strip() or "0"
+
+    def calculateSeries(self, func: str) -> None:
+        """
+        Submits the calculation of the series of the function for the current order and contents of the entries
+        :param func: function to be expanded
+        """
+        variable, point = self.seriesParameters()
+        order = self.seriesOrder
+        cached = calculus.resultCache.get(calculus.cacheKey("series", func, variable, point, order))
+        if cached is not None:
+            self.engine.cancel("calc")
+            self.showSeries(evaluation.EvaluationResult(0, "ok", (cached, "Series calculated successfully")),
+                            func, variable, point, order)
+            ui.showDebounceStats(self.statsLabelDiff, self.debouncer)
+            return
+
+        self.engine.submit(calculus.calculateSeries, (func, variable, point, order),
+                           onResult=lambda result: self.showSeries(result, func, variable, point, order),
+                           channel="calc", budget=evaluation.BUDGETS["series"])
+        ui.showDebounceStats(self.statsLabelDiff, self.debouncer)
+
+    def showSeries(self, result: evaluation.EvaluationResult, func: str, variable: str, point: str,
+                   order: int) -> None:
+        """
+        Shows the series calculated in the background in the result label.
+        :param result: the outcome of calculus.calculateSeries
+        :param func: function that was expanded
+        :param variable: variable of the series
+        :param point: point the series was calculated around
+        :param order: order of the series
+        """
+        if order != self.seriesOrder:   # The order (or the mode) was changed while it was being calculated
+            return
+
+        if result.status in ("timeout", "memory"):
+            self.resultLabelDiff.configure(text=self.seriesHeader() + f"({result.message.lower()})",
+                                           fg=ui.LIGHT_DARK_DECO_BG)
+            return
+        if not result.ok or result.value[0] is None:
+            self.resultLabelDiff.configure(fg=ui.LIGHT_DARK_DECO_BG)
+            return
+
+        toShow = result.value[0]
+        calculus.resultCache.put(calculus.cacheKey("series", func, variable, point, order), toShow, persist=False)
+        with instrumentation.operation("series", recordTotal=False):     # The total was timed by the worker
+            with instrumentation.stage("cleanExpr"):
+                text = self.seriesHeader() + calculus.cleanExpr(toShow)
+            with instrumentation.stage("label"):
+                self.resultLabelDiff.configure(text=text, fg=ui.FG_LABELS)
+        ui.showStageTimings(self.statsLabelDiff, result.stages)
+
+    def export(self) -> None:
+        """
+        Shows the last derivative as a NumPy function (see showExport) or, in series mode, the series as a polynomial
+        in Horner form, along with its error within 1 of the point
+        """
+        if self.seriesOrder is None:
+            showExport(self.lastResult)
+            return
+
+        variable, point = self.seriesParameters()
+        self.engine.submit(calculus.seriesEvaluator, (self.funcEntryDiff.get(), variable, point, self.seriesOrder),
+                           {"interval": (f"({point}) - 1", f"({point}) + 1")},
+                           onResult=self.showSeriesExport, channel="export", budget=evaluation.BUDGETS["series"])
+
+    def showSeriesExport(self, result: evaluation.EvaluationResult) -> None:
+        """
+        Shows the Horner form of the series built in the background (see calculus.seriesEvaluator)
+        """
+        if not result.ok:
+            messagebox.showerror("Export", f"The series can't be exported: {result.message}")
+            return
+        evaluator, message = result.value
+        if evaluator is None:
+            messagebox.showerror("Export", f"The series can't be exported: {message.split('| ', 1)[-1]}")
+            return
+
+        bounds = evaluator["bounds"]
+        title = "Series as a polynomial in Horner form"
+        if bounds is not None:
+            title += f"\nlargest error within [{bounds['interval'][0]:.4g}, {bounds['interval'][1]:.4g}]: " \
+                     f"{bounds['observed']:.3g}"
+            if bounds["lagrange"] is not None:
+                title += f" (Lagrange bound {bounds['lagrange']:.3g})"
+        ui.CodeInfoWindow(code=evaluator["source"], labelTitleText=title, title="Export",
+                          code_font=ui.GEN_CODE_FONT(9), dimensions="720x420")
+
+    def calculateMatrix(self, func: str, itof: str) -> None:
+        """
+        Submits the calculation of the gradient, jacobian or hessian (depending on the mode) for the given entries
+        :param func: function, or functions separated by commas for the jacobian
+        :param itof: variables separated by commas (empty for every variable of the function)
+        """
+        kind = self.matrixKind
+        cached = calculus.resultCache.get(calculus.cacheKey("derivative-matrix", func, itof, kind))
+        if cached is not None:
+            self.engine.cancel("calc")
+            self.showDerivativeMatrix(
+                evaluation.EvaluationResult(0, "ok", (cached, "Derivatives calculated successfully")), func, itof, kind)
+            ui.showDebounceStats(self.statsLabelDiff, self.debouncer)
+            return
+
+        self.engine.submit(calculus.calculateDerivativeMatrix, (func, itof, kind),
+                           onResult=lambda result: self.showDerivativeMatrix(result, func, itof, kind),
+                           channel="calc", budget=evaluation.BUDGETS["derivative-matrix"])
+        ui.showDebounceStats(self.statsLabelDiff, self.debouncer)
+
+    def showDerivativeMatrix(self, result: evaluation.EvaluationResult, func: str, itof: str, kind: str) -> None:
+        """
+        Shows the gradient, jacobian or hessian calculated in the background in the result label, a row per line.
+        :param result: the outcome of calculus.calculateDerivativeMatrix
+        :param func: function(s) whose derivatives were calculated
+        :param itof: variables the derivatives were calculated with respect to
+        :param kind: kind of matrix
+        """
+        if kind != self.matrixKind:     # The mode was changed while it was being calculated
+            return
+
+        symbol = self.MATRIX_SYMBOLS[kind]
+        if result.status in ("timeout", "memory"):
+            self.resultLabelDiff.configure(text=f"{symbol} = ({result.message.lower()})", fg=ui.LIGHT_DARK_DECO_BG)
+            return
+        if not result.ok or result.value[0] is None:
+            self.resultLabelDiff.configure(fg=ui.LIGHT_DARK_DECO_BG)
+            return
+
+        matrix = result.value[0]
+        self.lastResult = None
+        calculus.resultCache.put(calculus.cacheKey("derivative-matrix", func, itof, kind), matrix, persist=False)
+
+        rows = ["[" + ", ".join(calculus.cleanExpr(entry) for entry in matrix["matrix"].row(i)) + "]"
+                for i in range(matrix["matrix"].rows)]
+        header = f"{symbol}({', '.join(matrix['variables'])}) = "
+        self.resultLabelDiff.configure(text=header + ("\n" + " " * len(header)).join(rows), fg=ui.FG_LABELS)
+
+    def showDifferential(self, result: evaluation.EvaluationResult, itof: str, func: str) -> None:
+        """
+        Shows the differential calculated in the background in the result label.
+        :param result: the outcome of calculus.calculateDifferential
+        :param itof: variable the differential was calculated with respect to
+        :param func: function whose differential was calculated
+        """
+        baseText = self.resultLabelDiff["text"][:self.resultLabelDiff["text"].index("=") + 2]
+        baseText = baseText[:self.insertPosAnsText] + itof + baseText[baseText.index(" "):]
+
+        if result.status in ("timeout", "memory"):
+            self.resultLabelDiff.configure(text=baseText + f"({result.message.lower()})", fg=ui.LIGHT_DARK_DECO_BG)
+            return
+
+        if not result.ok or result.value[0] is None:
+            # Sympy raises exceptions whenever it can't calculate a differential (i.e. incomplete expressions)
+            # Indicates that the differential is being calculated:
+            self.resultLabelDiff.configure(fg=ui.LIGHT_DARK_DECO_BG)
+            return
+
+        toShow, diffMsg = result.value
+        self.lastResult = toShow
+        # The worker has already stored it in the persistent tier, if enabled
+        calculus.resultCache.put(calculus.cacheKey("differential", func, itof, 1, self.partial),
+                                 toShow, persist=False)
+        with instrumentation.operation("differential", recordTotal=False):     # The total was timed by the worker
+            with instrumentation.stage("cleanExpr"):
+                text = baseText + calculus.cleanExpr(toShow)
+            with instrumentation.stage("label"):
+                self.resultLabelDiff.configure(text=text, fg=ui.FG_LABELS)
+        ui.showStageTimings(self.statsLabelDiff, result.stages)
 
 
 class IntegralCalculator:
@@ -370,7 +745,9 @@ class IntegralCalculator:
         :return: None
         """
 
-        self.windowInteg = tk.Tk()
+        self.lastResult = None      # Last integral shown, the one exported with EXPORT_KEY
+
+        self.windowInteg = ui.newWindow()
         self.windowInteg.geometry("480x350")
         self.windowInteg.configure(background=ui.WINDOW_BG)
         self.windowInteg.title(f"Calculating an integral (sympy)")
@@ -437,30 +814,46 @@ class IntegralCalculator:
         self.uBoundEntryInteg = boundsGroupInteg.add_entry(width=5, row=1, column=2, placeholder="+∞")
         self.uBoundEntryInteg.bind("<Key>", lambda e: self.handleKeyEvent(e))
 
-        self.windowInteg.bind("<Escape>", lambda e: self.windowInteg.destroy())
-        self.windowInteg.mainloop()
+        self.statsLabelInteg = tk.Label(self.windowInteg, bg=ui.WINDOW_BG, fg=ui.LIGHT_DARK_DECO_BG, text="")
+        self.statsLabelInteg.place(relx=0.5, rely=0.96, anchor=tk.CENTER)
 
-    def handleKeyEvent(self, event=None, forWhat="calc", recalling=False) -> None:
+        # Integrals are calculated in a separate process so that typing never waits for sympy, and only once the
+        # input has settled
+        self.engine = evaluation.EvaluationEngine(self.windowInteg)
+        self.debouncer = evaluation.DebounceScheduler(
+            self.windowInteg, self.calculate,
+            snapshot=lambda: (self.funcEntryInteg.get(), self.itofEntryInteg.get(),
+                              self.uBoundEntryInteg.get(), self.lBoundEntryInteg.get()))
+
+        self.windowInteg.bind("<Return>", lambda e: self.debouncer.flush())
+        self.windowInteg.bind(EXPORT_KEY, lambda e: showExport(self.lastResult))
+        self.windowInteg.bind("<Escape>", lambda e: self.close())
+        self.windowInteg.protocol("WM_DELETE_WINDOW", self.close)
+        ui.runMainloop(self.windowInteg)
+
+    def close(self) -> None:
+        """
+        Cancels any integral still being calculated and destroys the window
+        """
+        self.debouncer.cancel()
+        self.engine.shutdown()
+        self.windowInteg.destroy()
+
+    def handleKeyEvent(self, event=None, forWhat="calc") -> None:
         """
         It can either calculate the integral of the
         given mathematical function, or display a window with the python code used to do that.
         :param event: The event that triggered this function call
         :param forWhat: Can be either 'calc', to indicate that the integral must be calculated,
         or 'code' to indicate that the code necessary for this calculation must be displayed
-        :param recalling: Indicates if this is the first call made to the function (False) or if it has been called
-        again from a previous call (True)
         :return: None
         """
-
-        recallingInteg = recalling
-
-        # [resultLabelInteg, upperBoundLabelInteg, lowerBoundLabelInteg]
-        func = self.funcEntryInteg.get()
-        itof = self.itofEntryInteg.get()  # 'itof' stands for in terms of
-        uBoundSrc = self.uBoundEntryInteg.get()
-        lBoundSrc = self.lBoundEntryInteg.get()
-
         if forWhat.lower() == "code":
+            func = self.funcEntryInteg.get()
+            itof = self.itofEntryInteg.get()  # 'itof' stands for in terms of
+            uBoundSrc = self.uBoundEntryInteg.get()
+            lBoundSrc = self.lBoundEntryInteg.get()
+
             definite = True
             if uBoundSrc.__contains__("∞") or lBoundSrc.__contains__("∞"):
                 definite = False
@@ -470,46 +863,104 @@ class IntegralCalculator:
                               labelTitleText=f"Code used for calculating "
                                              f"{'definite' if definite else 'indefinite'} integrals",
                               library="from sympy import *", dimensions="400x220")
-            return None
-
-        if recallingInteg:
-            if forWhat.lower() == "calc":
-                try:
-                    toShow, integMsg = calculus.calculateIntegral(func, inTermsOf=itof,
-                                                                  uBound=uBoundSrc, lBound=lBoundSrc)
-                except Exception as e:
-                    # Exceptions will be caught all the time because the program
-                    # will try to integrate incomplete expressions
-                    # print(f"An error happened, specifically:\n {e} \n\n Tried: {calculus.cleanExpr(func)}")
-                    str(e)  # Removes a warning
-
-                    # Indicates that the differential is being calculated
-                    self.resultLabelInteg.configure(fg=ui.LIGHT_DARK_DECO_BG)
-
-                    self.upperBoundLabelInteg.configure(fg=ui.LIGHT_DARK_DECO_BG)
-                    self.lowerBoundLabelInteg.configure(fg=ui.LIGHT_DARK_DECO_BG)
-                else:
-                    if toShow is None:
-                        self.resultLabelInteg.configure(fg=ui.LIGHT_DARK_DECO_BG)
-                        self.upperBoundLabelInteg.configure(fg=ui.LIGHT_DARK_DECO_BG)
-                        self.lowerBoundLabelInteg.configure(fg=ui.LIGHT_DARK_DECO_BG)
-                    else:
-                        self.upperBoundLabelInteg.configure(text=uBoundSrc, fg=ui.FG_LABELS)
-                        self.lowerBoundLabelInteg.configure(text=lBoundSrc, fg=ui.FG_LABELS)
-                        self.resultLabelInteg.configure(
-                            text=f"{calculus.cleanExpr(func)} d{itof} = {calculus.cleanExpr(toShow)}",
-                            fg=ui.FG_LABELS)
-
-                        self.symbolLabelInteg.configure(width=round(len(self.resultLabelInteg["text"]) * 0.8))
+        elif forWhat.lower() == "calc":
+            # The entries are read once the typing settles (the Key event is raised before the entry is updated)
+            self.debouncer.trigger()
+        else:
+            raise SyntaxError(f"Invalid 'forWhat' given: {forWhat},\nExpected 'calc' or 'code'")
 
-            else:
-                raise SyntaxError(f"Invalid 'forWhat' given: {forWhat},\nExpected 'calc' or 'code'")
+    def calculate(self) -> None:
+        """
+        Submits the calculation of the integral for the current contents of the entries
+        """
+        func = self.funcEntryInteg.get()
+        itof = self.itofEntryInteg.get()  # 'itof' stands for in terms of
+        uBoundSrc = self.uBoundEntryInteg.get()
+        lBoundSrc = self.lBoundEntryInteg.get()
 
-        if not recallingInteg:
-            recallingInteg = True
-            self.windowInteg.after(1, lambda: self.handleKeyEvent(event, forWhat, recallingInteg))
-        else:
-            recallingInteg = False
+        cached = calculus.resultCache.get(calculus.cacheKey("integral", func, itof, uBoundSrc, lBoundSrc))
+        if cached is not None:
+            self.engine.cancel("calc")
+            self.showIntegral(evaluation.EvaluationResult(0, "ok", ({"tier": "symbolic", "result": cached,
+                                                                     "timings": {}},
+                                                                    "Integral calculated successfully")),
+                              func, itof, uBoundSrc, lBoundSrc)
+            ui.showDebounceStats(self.statsLabelInteg, self.debouncer)
+            return
+
+        # Whether the integral can fall back to numeric quadrature (and so sympy gets less time) is decided by the
+        # worker, parsing the bounds here could block the window (i.e. 9**9**9)
+        # Submitting on the same channel supersedes the calculation started for the previous input
+        self.engine.submit(calculus.calculateIntegralWithFallback, (func, itof, uBoundSrc, lBoundSrc),
+                           {"method": calculus.NUMERIC_METHODS[0], "precision": calculus.DEFAULT_NUMERIC_PRECISION},
+                           onResult=lambda result: self.showIntegral(result, func, itof, uBoundSrc, lBoundSrc),
+                           channel="calc", budget=evaluation.BUDGETS["integral"])
+        ui.showDebounceStats(self.statsLabelInteg, self.debouncer)
+
+    def showIntegral(self, result: evaluation.EvaluationResult, func: str, itof: str, uBoundSrc: str,
+                     lBoundSrc: str) -> None:
+        """
+        Shows the integral calculated in the background in the result labels.
+        :param result: the outcome of calculus.calculateIntegralWithFallback
+        :param func: function that was integrated
+        :param itof: variable the function was integrated with respect to
+        :param uBoundSrc: upper bound, as it was written by the user
+        :param lBoundSrc: lower bound, as it was written by the user
+        """
+        self.windowInteg.title("Calculating an integral (sympy)")
+        if result.status in ("timeout", "memory"):
+            # The integral is too expensive, which is reported instead of leaving the old result on screen
+            self.upperBoundLabelInteg.configure(text=uBoundSrc, fg=ui.LIGHT_DARK_DECO_BG)
+            self.lowerBoundLabelInteg.configure(text=lBoundSrc, fg=ui.LIGHT_DARK_DECO_BG)
+            self.resultLabelInteg.configure(text=f"{calculus.cleanExpr(func)} d{itof} = ({result.message.lower()})",
+                                            fg=ui.LIGHT_DARK_DECO_BG)
+            self.symbolLabelInteg.configure(width=round(len(self.resultLabelInteg["text"]) * 0.8))
+            return
+
+        if not result.ok or result.value[0] is None:
+            # Errors will happen all the time because the program will try to integrate incomplete expressions
+            # Indicates that the integral is being calculated
+            self.resultLabelInteg.configure(fg=ui.LIGHT_DARK_DECO_BG)
+            self.upperBoundLabelInteg.configure(fg=ui.LIGHT_DARK_DECO_BG)
+            self.lowerBoundLabelInteg.configure(fg=ui.LIGHT_DARK_DECO_BG)
+            return
+
+        outcome, integMsg = result.value
+        if outcome["tier"] == "numeric":
+            # Sympy couldn't close the definite integral, so it was calculated numerically instead
+            self.showNumericIntegral(outcome, func, itof, uBoundSrc, lBoundSrc)
+            return
+
+        toShow = outcome["result"]
+        self.lastResult = toShow
+        # The worker has already stored it in the persistent tier, if enabled
+        calculus.resultCache.put(calculus.cacheKey("integral", func, itof, uBoundSrc, lBoundSrc), toShow, persist=False)
+        with instrumentation.operation("integral", recordTotal=False):     # The total was timed by the worker
+            with instrumentation.stage("cleanExpr"):
+                text = f"{calculus.cleanExpr(func)} d{itof} = {calculus.cleanExpr(toShow)}"
+            with instrumentation.stage("label"):
+                self.upperBoundLabelInteg.configure(text=uBoundSrc, fg=ui.FG_LABELS)
+                self.lowerBoundLabelInteg.configure(text=lBoundSrc, fg=ui.FG_LABELS)
+                self.resultLabelInteg.configure(text=text, fg=ui.FG_LABELS)
+                self.symbolLabelInteg.configure(width=round(len(self.resultLabelInteg["text"]) * 0.8))
+        ui.showStageTimings(self.statsLabelInteg, result.stages)
+
+    def showNumericIntegral(self, outcome: dict, func: str, itof: str, uBoundSrc: str, lBoundSrc: str) -> None:
+        """
+        Shows the integral calculated numerically in the result labels, and how long each tier took in the window's
+        title.
+        :param outcome: what calculus.calculateIntegralWithFallback returned for the numeric tier
+        """
+        numeric, timings = outcome["result"], outcome["timings"]
+        self.upperBoundLabelInteg.configure(text=uBoundSrc, fg=ui.FG_LABELS)
+        self.lowerBoundLabelInteg.configure(text=lBoundSrc, fg=ui.FG_LABELS)
+        self.resultLabelInteg.configure(
+            text=f"{calculus.cleanExpr(func)} d{itof} ≈ {numeric['value']} (± {numeric['error']:.1e})",
+            fg=ui.FG_LABELS)
+        self.symbolLabelInteg.configure(width=round(len(self.resultLabelInteg["text"]) * 0.8))
+
+        self.windowInteg.title(f"Calculating an integral (sympy) - symbolic gave up after {timings['symbolic']:.1f} s, "
+                               f"numeric ({numeric['method']}) {timings['numeric'] * 1000:.0f} ms")
 
 
 class Main:
@@ -523,6 +974,11 @@ class Main:
                             " operation."
 
     DETAILS_DELAY_MS = 100
+    PREWARM_DELAY_MS = 200
+
+    # Keys that turn the timing of the stages of every calculation on and off, and that show the timings recorded
+    INSTRUMENTATION_KEY = "<F8>"
+    TIMINGS_KEY = "<F9>"
 
     detailsLabel: tk.Label
     windowMain: tk.Tk
@@ -552,6 +1008,19 @@ class Main:
 
         Main.windowMain.after(Main.DETAILS_DELAY_MS, lambda: Main.detailsLabel.configure(text=text))
 
+    @staticmethod
+    def toggleInstrumentation() -> None:
+        """
+        Turns the timing of the stages of the calculations on or off (the workers follow it from their next job)
+        """
+        instrumentation.setEnabled(not instrumentation.isEnabled())
+        Main.showInstrumentationState()
+
+    @staticmethod
+    def showInstrumentationState() -> None:
+        Main.windowMain.title("Main menu" + (f" - timing stages ({Main.TIMINGS_KEY.strip('<>')} to see them)"
+                                             if instrumentation.isEnabled() else ""))
+
     @staticmethod
     def generate() -> None:
         """
@@ -560,7 +1029,7 @@ class Main:
         WIN_X = 540
         WIN_Y = 380
 
-        Main.windowMain = tk.Tk()
+        Main.windowMain = ui.newWindow()
         Main.windowMain.title("Main menu")
         Main.windowMain.geometry(f"{WIN_X}x{WIN_Y}")
         Main.windowMain.configure(bg=ui.WINDOW_BG)
@@ -613,9 +1082,32 @@ class Main:
         btInteg.overrideEnterBinding(lambda: Main.replaceDetails(IntegralCalculator))
 
         Main.windowMain.bind("<Escape>", lambda event: Main.windowMain.destroy())
+        Main.windowMain.bind(Main.INSTRUMENTATION_KEY, lambda event: Main.toggleInstrumentation())
+        Main.windowMain.bind(Main.TIMINGS_KEY, lambda event: ui.CodeInfoWindow(
+            code=instrumentation.report(), labelTitleText="Time spent in every stage", title="Timings",
+            code_font=ui.GEN_CODE_FONT(9), dimensions="720x420"))
         Main.windowMain.resizable(False, False)
+        Main.showInstrumentationState()
+
+        # The heavy modules are loaded in the background once the menu has been drawn
+        Main.windowMain.after(Main.PREWARM_DELAY_MS, lambda: lazyImport.prewarm(calculus, graphing, plotCanvas))
         Main.windowMain.mainloop()
 
 
 if __name__ == '__main__':
-    Main.generate()
+    multiprocessing.freeze_support()     # Needed by the evaluation workers when bundled with pyinstaller
+
+    parser = argparse.ArgumentParser(description="Advanced scientific calculator")
+    parser.add_argument("--import-report", action="store_true",
+                        help="print how long the menu and the lazily loaded modules take to import, and exit")
+    args = parser.parse_args()
+
+    if args.import_report:
+        print(lazyImport.importTimeReport(["calculator"]), end="\n\n")
+        print(lazyImport.importTimeReport(LAZY_MODULES))
+    else:
+        # Results are persisted between sessions (calculus and the evaluation workers read it from the environment,
+        # so they all share the same database)
+        os.environ.setdefault(cache.PERSIST_ENV_VAR, cache.DEFAULT_PERSIST_PATH)
+        metrics.exportFromEnvironment()    # Only if CALC_METRICS_FILE or CALC_METRICS_PORT are set
+        Main.generate()
@@ -1,21 +1,42 @@
+import multiprocessing
+import os
+import time
+
+import mpmath
 from sympy import *
 
+import cache
+import evaluation
+import expression
+import instrumentation
+import simplification
+import tokenizer
+
+# Results of previous calculations, shared by every call in this process (and, if CALC_CACHE_PATH is set, persisted
+# between sessions)
+resultCache = cache.ResultCache(persistPath=os.environ.get(cache.PERSIST_ENV_VAR))
+
+# Quadrature methods of mpmath that can be used for numeric integrals (tanh-sinh copes best with endpoint singularities)
+NUMERIC_METHODS = ("tanh-sinh", "gauss-legendre")
+DEFAULT_NUMERIC_PRECISION = 15      # Significant digits
+
+# Matrices of derivatives that calculateDerivativeMatrix can compute
+MATRIX_KINDS = ("gradient", "jacobian", "hessian")
 
-def preCalc(expr: str) -> str:
+# Order of the series calculated by calculateSeries when none is given (terms up to (x - point)**5)
+DEFAULT_SERIES_ORDER = 6
+
+
+def preCalc(expr: str, locales: tuple = tokenizer.DEFAULT_LOCALES) -> str:
     """
     Parses the expression received in order for sympy to understand expressions in other languages or other ways of
     writing some mathematical functions (e.g. sen (seno) is the spanish way to write sin (sine) and sympy only
-    understands sin).
+    understands sin), as well as implicit multiplications (5x) and superscripts (x²). See tokenizer.normalize.
     :param expr: expression to parse
+    :param locales: locales whose spellings of the functions are understood (see tokenizer.SYNONYMS)
     :return: parsed expression
     """
-    synonymsDict = {"sen": "sin", "arcsin": "asin",
-                    "arcos": "acos", "arccos": "acos",
-                    "tg": "tan", "arctan": "atan", "∞": "oo"}
-
-    for key in synonymsDict:
-        expr = expr.replace(key, synonymsDict[key])
-    return expr
+    return tokenizer.normalize(str(expr), locales)
 
 def cleanExpr(expr: str) -> str:
     """
@@ -25,31 +46,29 @@ def cleanExpr(expr: str) -> str:
     :param expr: function to be parsed
     :return: 'clean' parsed function
     """
-    substituteDict = {"**": "^", "*": "·"}
+    return tokenizer.prettify(str(expr))
 
-    # Only 3 exponents that I managed to represent properly in utf-8
-    superIndexDict = {"^1 ": f'\u00b9 ', "^2 ": f'\u00b2 ', "^3 ": f'\u00b3 '}
 
-    expr = str(expr)
-    expr += " "
-
-    for key in substituteDict.keys():
-        if expr.__contains__(key):
-            expr = expr.replace(key, substituteDict[key])
-
-    for key in superIndexDict.keys():
-        if expr.__contains__(key):
-            try:
-                int(expr[expr.index(key) + 1])
-            except ValueError:
-                print(f"Value error in: '{expr[expr.index(key) + 1]}'")
-            else:
-                expr = expr.replace(key, superIndexDict[key])
-
-    return expr.strip()
+def cacheKey(operation: str, func: str, *params, strategy: str = None) -> tuple:
+    """
+    Builds the key under which a result is stored in resultCache, so that expressions that only differ in the way
+    they were written (spaces, synonyms...) share the same entry.
+    :param operation: name of the calculation (i.e. "differential")
+    :param func: function the calculation is applied to
+    :param params: every other parameter that changes the result (variable, order, bounds...)
+    :param strategy: simplification strategy applied to the result (the one configured for the operation by default)
+    :return: the key, as a tuple of strings
+    """
+    strategy = strategy or simplification.strategyFor(operation)
+    try:
+        normalized = preCalc(str(func))
+    except SyntaxError:     # It can't be calculated (see tokenizer.normalize), so it will never be stored either
+        normalized = str(func)
+    return (operation, "".join(normalized.split())) + tuple("".join(str(p).split()) for p in params) + (strategy,)
 
 
-def calculateDifferential(func: str, inTermsOf=None, nth=1, partial=False) -> (Derivative, str):
+@instrumentation.instrumented("differential")
+def calculateDifferential(func: str, inTermsOf=None, nth=1, partial=False, simplify: str = None) -> (Derivative, str):
     """
     Computes the nth differential (partial or whole) of the received function.
     :param func: function whose differential will be calculated
@@ -57,59 +76,443 @@ def calculateDifferential(func: str, inTermsOf=None, nth=1, partial=False) -> (D
     :param nth: the differential to be calculated (i.e. nth=2 means the 2nd derivative of the function
     will be calculated)
     :param partial: indicates if the differential should be partial (True), or whole (False)
+    :param simplify: simplification strategy applied to the result, one of simplification.STRATEGY_NAMES (the one
+    configured for "differential" by default)
     :return: The calculated derivative (if possible), along with a message, which will be the error message produced if
     the derivative was not computable.
     """
-    d = preCalc(func)
-    count = 0
+    simplify = simplify or simplification.strategyFor("differential")
+    key = cacheKey("differential", func, inTermsOf, nth, partial, strategy=simplify)
+    with instrumentation.stage("cache"):
+        cached = resultCache.get(key)
+    if cached is not None:
+        return cached, "Differential calculated successfully"
 
-    if inTermsOf is None:
-        if partial:
-            return None, "An error occurred | For a partial derivative, the variable\nto derive with respect to must be entered"
+    if inTermsOf is None and partial:
+        return None, "An error occurred | For a partial derivative, the variable\nto derive with respect to must be entered"
 
-        try:
-            diff(d)
-        except ValueError as e:      # This happens when an unknown expression is entered (e.g. multiplication without *)
-            return None, "An error occurred | Invalid expression was entered for the function\n" \
-                         "so the differential could not be calculated"
+    try:
+        compiled = expression.compileExpression(func)
+        stepSimplifier = simplification.simplifier(simplification.strategyFor("differential-step"))
+        tower = compiled.tower(inTermsOf, stepSimplifier)
+        higherThanStored = False
+        if tower is not None and tower.highest < nth:
+            # This order (or a lower one) may have been calculated by another process or session, the rest are built
+            # on top of it. The highest order of every tower is stored as (order, derivative) before the final
+            # simplification
+            towerKey = cacheKey("differential-step", func, tower.symbol)
+            with instrumentation.stage("cache"):
+                stored = resultCache.peek(towerKey)
+            if stored is not None and stored[0] <= nth:
+                tower.seed(*stored)
+            higherThanStored = stored is None or stored[0] < nth
+        with instrumentation.stage("diff"):
+            d = compiled.derivative(inTermsOf, nth, stepSimplifier)
+        if higherThanStored:
+            resultCache.put(towerKey, (nth, d))
+    except (SympifyError, SyntaxError, TypeError, ValueError):
+        # This happens when an unknown expression is entered, or there are several variables and none was chosen
+        return None, "An error occurred | Invalid expression was entered for the function\n" \
+                     "so the differential could not be calculated"
 
-        else:   # inTermsOf is None and there is no error
-            while count < nth and d != 0:
-                d = diff(d)
-                count += 1
+    with instrumentation.stage("simplify"):
+        d = simplification.simplifyExpression(d, simplify)[0]
+    resultCache.put(key, d)
+    return d, "Differential calculated successfully"
 
-    else:   # inTermsOf is not None
-        while count < nth and d != 0:
-            d = diff(d, inTermsOf)
-            count += 1
 
-    return d, "Differential calculated successfully"
+def derivativeMetrics(func: str, inTermsOf=None) -> list:
+    """
+    :param func: function whose derivatives were calculated
+    :param inTermsOf: variable they were calculated with respect to
+    :return: for every order calculated so far in this process (in order, None for the ones that were skipped), a
+    dictionary with its 'order', the number of 'nodes' of its tree and the seconds spent differentiating ('diffTime')
+    and simplifying it ('simplifyTime')
+    """
+    stepSimplifier = simplification.simplifier(simplification.strategyFor("differential-step"))
+    tower = expression.compileExpression(func).tower(inTermsOf, stepSimplifier)
+    return [] if tower is None else list(tower.metrics)
+
+
+def _expansion(func: str, inTermsOf, point: str) -> expression.SeriesExpansion:
+    """
+    :return: the expansion of the function around the point, which reuses the derivatives calculateDifferential
+    calculated (and the terms calculated before for any order)
+    :raises ValueError: if the point isn't a number (or infinity)
+    """
+    center = expression.parse(point)
+    if not center.is_number or center.has(nan, zoo) or not (center.is_finite or center in (oo, -oo)):
+        raise ValueError(f"the point {point} is not a number")
+    stepSimplifier = simplification.simplifier(simplification.strategyFor("differential-step"))
+    return expression.compileExpression(func).expansion(inTermsOf, center, stepSimplifier)
+
+
+@instrumentation.instrumented("series")
+def calculateSeries(func: str, inTermsOf=None, point: str = "0", order: int = DEFAULT_SERIES_ORDER) -> (Expr, str):
+    """
+    Computes the Taylor series (or the Laurent series, where the function isn't analytic) of the received function
+    around a point. Asking for a higher order later only calculates the terms that are missing.
+    :param func: function to be expanded
+    :param inTermsOf: variable of the series (the only variable of the function if None)
+    :param point: point the series is calculated around (oo for an asymptotic series)
+    :param order: the terms of lower degree than this are calculated (the rest are left in an O() term)
+    :return: The calculated series (if possible), along with a message, which will be the error message produced if
+    the series was not computable.
+    """
+    key = cacheKey("series", func, inTermsOf, point, order)
+    with instrumentation.stage("cache"):
+        cached = resultCache.get(key)
+    if cached is not None:
+        return cached, "Series calculated successfully"
+
+    try:
+        with instrumentation.stage("series"):
+            s = _expansion(func, inTermsOf, point).series(int(order))
+    except (SympifyError, SyntaxError, TypeError, ValueError):
+        return None, "An error occurred | Invalid expression was entered for the function\n" \
+                     "or the point, so the series could not be calculated"
+    except (NotImplementedError, PoleError) as e:
+        return None, f"An error occurred | The series could not be calculated around {point}.\n{e}"
+
+    resultCache.put(key, s)
+    return s, "Series calculated successfully"
+
+
+def seriesEvaluator(func: str, inTermsOf=None, point: str = "0", order: int = DEFAULT_SERIES_ORDER,
+                    interval: tuple = None, name: str = "series") -> (dict, str):
+    """
+    Turns the series of a function (see calculateSeries) into a fast evaluator of the truncated polynomial in Horner
+    form, and estimates its error.
+    :param interval: (lower, upper) range of the variable where the error is estimated (not estimated if None)
+    :param name: name of the function in the generated source
+    :return: A dictionary with the 'series', the 'evaluator' (an expression.HornerEvaluator, which works over NumPy
+    arrays), the 'source' of an equivalent standalone Python function and the 'bounds' of the error over the interval
+    (see SeriesExpansion.errorBounds, None without an interval), along with a message, which will be the error message
+    produced if the series can't be evaluated that way.
+    """
+    try:
+        expansion = _expansion(func, inTermsOf, point)
+        with instrumentation.stage("series"):
+            evaluator = expansion.horner(int(order))
+        bounds = None
+        if interval is not None:
+            with instrumentation.stage("bounds"):
+                bounds = expansion.errorBounds(int(order), tuple(float(expression.parse(v)) for v in interval))
+    except (SympifyError, SyntaxError, TypeError, ValueError) as e:
+        return None, f"An error occurred | The series could not be turned into a polynomial.\n{e}"
+    except (NotImplementedError, PoleError) as e:
+        return None, f"An error occurred | The series could not be calculated around {point}.\n{e}"
+
+    docstring = f"{cleanExpr(func)} around {expansion.symbol} = {cleanExpr(expansion.point)} up to order {order}"
+    return {"series": expansion.series(int(order)), "evaluator": evaluator, "bounds": bounds,
+            "source": evaluator.source(name, str(expansion.symbol), docstring)}, "Series evaluator built successfully"
+
 
-def calculateIntegral(func: str, inTermsOf=None, uBound: str= "0", lBound: str= "0") -> (Integral, str):
+def _derivativeRows(funcs: list, variables: list, kind: str, rows: list, simplify: str) -> list:
+    """
+    Calculates some rows of a matrix of derivatives (see calculateDerivativeMatrix). The entries of the Hessian below
+    its diagonal are left as None, as they are the same as the ones above it.
+    :return: list with the entries of each of the rows, in the same order as rows
+    """
+    stepSimplifier = simplification.simplifier(simplification.strategyFor("differential-step"))
+    compiled = [expression.compileExpression(func) for func in funcs]
+    calculated = []
+
+    for row in rows:
+        if kind == "hessian":
+            # Every entry is derived from the first derivative, which is shared with the rest of the row
+            first = compiled[0].derivative(variables[row], 1, stepSimplifier)
+            entries = [None] * row + [compiled[0].derivative(variables[row], 2, stepSimplifier)] + \
+                [diff(first, Symbol(variable)) for variable in variables[row + 1:]]
+        else:
+            entries = [compiled[row].derivative(variable, 1, stepSimplifier) for variable in variables]
+        calculated.append([None if entry is None else simplification.simplifyExpression(entry, simplify)[0]
+                           for entry in entries])
+    return calculated
+
+
+@instrumentation.instrumented("derivative-matrix")
+def calculateDerivativeMatrix(funcs: str, variables: str = "", kind: str = "gradient", simplify: str = None,
+                              workers: int = 1) -> (dict, str):
+    """
+    Computes the gradient or the Hessian of a function, or the Jacobian of a vector of functions, in a single call.
+    The Hessian is symmetric, so only the entries on and above its diagonal are calculated.
+    :param funcs: function (or functions separated by commas, for the Jacobian)
+    :param variables: variables separated by commas, in order (empty for every variable of the functions, sorted
+    alphabetically)
+    :param kind: one of MATRIX_KINDS
+    :param simplify: simplification strategy applied to every entry, one of simplification.STRATEGY_NAMES (the one
+    configured for "differential" by default)
+    :param workers: number of processes the rows are split between (only used with more than one row, and never from
+    inside an evaluation worker, which can't start processes). Starting them takes about a second, so it only pays off
+    for big matrices of complicated functions
+    :return: A dictionary with the 'kind', the 'variables', the 'matrix' (a sympy Matrix, with a single row for the
+    gradient), its common subexpressions ('cse', as returned by sympy's cse for every entry) and the size of the
+    entries before and after extracting them ('nodes' and 'nodesCse'), along with a message, which will be the error
+    message produced if the matrix was not computable.
+    """
+    if kind not in MATRIX_KINDS:
+        return None, f"An error occurred | Unknown kind of matrix '{kind}',\nexpected one of {MATRIX_KINDS}"
+
+    simplify = simplify or simplification.strategyFor("differential")
+    key = cacheKey("derivative-matrix", funcs, variables, kind, strategy=simplify)
+    cached = resultCache.get(key)
+    if cached is not None:
+        return cached, "Derivatives calculated successfully"
+
+    funcList = tokenizer.splitTopLevel(funcs) if isinstance(funcs, str) else list(funcs)
+    if not funcList:
+        return None, "An error occurred | No function was entered"
+    if kind != "jacobian" and len(funcList) > 1:
+        return None, f"An error occurred | The {kind} is calculated for a single function,\n" \
+                     "use the jacobian for several of them"
+
+    try:
+        compiled = [expression.compileExpression(func) for func in funcList]
+    except (SympifyError, SyntaxError, TypeError) as e:
+        return None, "An error occurred | Invalid expression was entered for the function\n" \
+                     f"so the derivatives could not be calculated.\n{e}"
+
+    variableList = tokenizer.splitTopLevel(variables) if isinstance(variables, str) else list(variables)
+    if not variableList:
+        variableList = sorted(set().union(*(c.freeSymbols for c in compiled)))
+    if not variableList:
+        return None, "An error occurred | The function has no variables to derive with respect to"
+
+    rows = list(range(len(funcList) if kind == "jacobian" else 1 if kind == "gradient" else len(variableList)))
+    with instrumentation.stage("diff"):
+        if workers > 1 and len(rows) > 1 and not multiprocessing.current_process().daemon:
+            calculated = _derivativeRowsInParallel(funcList, variableList, kind, rows, simplify, workers)
+        else:
+            calculated = _derivativeRows(funcList, variableList, kind, rows, simplify)
+
+    if kind == "hessian":
+        for row in rows:
+            for column in range(row):
+                calculated[row][column] = calculated[column][row]
+    matrix = Matrix(calculated)
+
+    entries = list(matrix)
+    with instrumentation.stage("cse"):
+        replacements, reduced = cse(entries)
+    result = {"kind": kind, "variables": variableList, "matrix": matrix, "cse": (replacements, reduced),
+              "nodes": sum(expression.treeSize(entry) for entry in entries),
+              "nodesCse": sum(expression.treeSize(sub) for _, sub in replacements) +
+                          sum(expression.treeSize(entry) for entry in reduced)}
+    resultCache.put(key, result)
+    return result, "Derivatives calculated successfully"
+
+
+def _derivativeRowsInParallel(funcs: list, variables: list, kind: str, rows: list, simplify: str,
+                              workers: int) -> list:
+    pool = evaluation.WorkerPool(size=min(workers, len(rows)), name="derivative-rows")
+    try:
+        jobs = {pool.submit(_derivativeRows, (funcs, variables, kind, [row], simplify)): row for row in rows}
+        calculated = {}
+        while len(calculated) < len(rows):
+            pool.waitForResults()
+            for outcome in pool.poll():
+                if not outcome.ok:
+                    raise RuntimeError(outcome.message)
+                calculated[jobs[outcome.jobId]] = outcome.value[0]
+        return [calculated[row] for row in rows]
+    finally:
+        pool.shutdown()
+
+
+@instrumentation.instrumented("integral")
+def calculateIntegral(func: str, inTermsOf=None, uBound: str= "0", lBound: str= "0",
+                      simplify: str = None, seconds: float = None) -> (Integral, str):
     """
     Computes the integral (definite or indefinite) of the received function.
     :param func: function whose integral will be computed
     :param inTermsOf: variable to integrate
     :param uBound: upper bound of the integral (as a string so that things like sin(x), x, x**2, etc. can be used)
     :param lBound: lower bound of the integral (as a string so that things like sin(x), x, x**2, etc. can be used)
+    :param simplify: simplification strategy applied to the result, one of simplification.STRATEGY_NAMES (the one
+    configured for "integral" by default)
+    :param seconds: time sympy is given to calculate it, where that can be enforced (see simplification.timeLimit). If
+    it runs out, the integral is returned unevaluated (see isUnevaluated) and it is not cached. None for no limit.
     :return: The calculated integral (if possible), along with a message, which will be the error message produced if
     the integral was not computable.
     """
-    r = preCalc(func)
-    uBound = preCalc(uBound)
-    lBound = preCalc(lBound)
+    simplify = simplify or simplification.strategyFor("integral")
+    key = cacheKey("integral", func, inTermsOf, uBound, lBound, strategy=simplify)
+    with instrumentation.stage("cache"):
+        cached = resultCache.get(key)
+    if cached is not None:
+        return cached, "Integral calculated successfully"
 
     try:
-        if lBound.__contains__("oo") or uBound.__contains__("oo"):
-            # Indefinite integral
-            r = integrate(r, Symbol(inTermsOf))
-        else:
-            # Definite integral
-            r = integrate(r, (inTermsOf, lBound, uBound))
+        r = expression.compileExpression(func).expr
+        variable = Symbol(str(inTermsOf).strip())
+        uBound = preCalc(uBound)
+        lBound = preCalc(lBound)
+        isIndefinite = lBound.__contains__("oo") or uBound.__contains__("oo")
+        if not isIndefinite:
+            upper, lower = expression.parse(uBound), expression.parse(lBound)
+    except (SympifyError, SyntaxError, TypeError) as e:
+        return None, "An error occurred | Invalid expression was entered for the function\n" \
+                     f"so the integral could not be calculated.\n{e}"
+
+    try:
+        with instrumentation.stage("integrate"), simplification.timeLimit(seconds):
+            if isIndefinite:
+                # Indefinite integral
+                r = integrate(r, variable)
+            else:
+                # Definite integral
+                r = integrate(r, (variable, lower, upper))
 
+    except simplification.SimplifyTimeout:
+        return Integral(r, variable if isIndefinite else (variable, lower, upper)), \
+            f"Integral could not be calculated symbolically within {seconds} s"
     except ValueError as e:
         return None, "An error occurred | Invalid expression was entered for the function\n" \
-                     f"so the differential could not be calculated.\n{e}"
+                     f"so the integral could not be calculated.\n{e}"
 
+    with instrumentation.stage("simplify"):
+        r = simplification.simplifyExpression(r, simplify)[0]
+    resultCache.put(key, r)
     return r, "Integral calculated successfully"
 
+
+
+def isUnevaluated(result) -> bool:
+    """
+    :return: True if sympy could not close the integral (so the result still contains an Integral)
+    """
+    return isinstance(result, Basic) and result.has(Integral)
+
+
+def numericBounds(uBound: str, lBound: str) -> (Expr, Expr):
+    """
+    :return: the bounds as sympy numbers if both of them are finite numbers (so the integral can be computed
+    numerically), or (None, None) otherwise.
+    """
+    try:
+        upper = expression.parse(uBound)
+        lower = expression.parse(lBound)
+    except (SympifyError, TypeError, SyntaxError):
+        return None, None
+
+    if upper.is_number and lower.is_number and upper.is_finite and lower.is_finite:
+        return upper, lower
+    return None, None
+
+
+@instrumentation.instrumented("integral-numeric")
+def calculateNumericIntegral(func: str, inTermsOf: str, uBound: str, lBound: str, method: str = "tanh-sinh",
+                             precision: int = DEFAULT_NUMERIC_PRECISION) -> (dict, str):
+    """
+    Computes a definite integral with adaptive numeric quadrature (mpmath), for the integrals that sympy can't close.
+    :param func: function to be integrated
+    :param inTermsOf: variable to integrate
+    :param uBound: upper bound of the integral, must evaluate to a finite number
+    :param lBound: lower bound of the integral, must evaluate to a finite number
+    :param method: quadrature method, one of NUMERIC_METHODS
+    :param precision: number of significant digits used in the computation
+    :return: A dictionary with the 'value' of the integral (a sympy Float), the 'error' estimated by the quadrature,
+    the 'method' and the 'precision' used (if possible), along with a message, which will be the error message produced
+    if the integral was not computable.
+    """
+    if method not in NUMERIC_METHODS:
+        return None, f"An error occurred | Unknown quadrature method '{method}',\nexpected one of {NUMERIC_METHODS}"
+
+    upper, lower = numericBounds(uBound, lBound)
+    if upper is None:
+        return None, "An error occurred | Numeric integrals need both bounds to be finite numbers"
+
+    try:
+        integrand = expression.compileExpression(func).numeric([inTermsOf], modules="mpmath")
+        with mpmath.workdps(precision), instrumentation.stage("quad"):
+            value, error = mpmath.quad(integrand, [mpmath.mpf(lower.evalf(precision)),
+                                                   mpmath.mpf(upper.evalf(precision))],
+                                       method=method, error=True)
+    except (SympifyError, TypeError, ValueError, ZeroDivisionError) as e:
+        return None, "An error occurred | The integral could not be calculated numerically.\n" \
+                     f"{e}"
+
+    if isinstance(value, mpmath.mpc):
+        value = value.real if abs(value.imag) <= error else value
+    return {"value": sympify(value).evalf(precision), "error": float(error), "method": method,
+            "precision": precision}, "Integral calculated numerically"
+
+
+def integrateTiered(func: str, inTermsOf: str, uBound: str, lBound: str,
+                    symbolicBudget: evaluation.Budget = None, method: str = "tanh-sinh",
+                    precision: int = DEFAULT_NUMERIC_PRECISION) -> (dict, str):
+    """
+    Computes an integral trying sympy first and, if it can't close a definite integral within its budget, falling back
+    to numeric quadrature. The symbolic tier is run in a worker process so that it can be stopped.
+    :param func: function to be integrated
+    :param inTermsOf: variable to integrate
+    :param uBound: upper bound of the integral
+    :param lBound: lower bound of the integral
+    :param symbolicBudget: budget for the symbolic tier (evaluation.BUDGETS["integral-symbolic"] by default)
+    :param method: quadrature method of the numeric tier, one of NUMERIC_METHODS
+    :param precision: number of significant digits of the numeric tier
+    :return: A dictionary with the 'tier' that produced the result ("symbolic" or "numeric"), the 'result' itself (an
+    expression for the symbolic tier, or what calculateNumericIntegral returns for the numeric one) and the seconds
+    each tier took ('timings'), along with a message, which will be the error message produced if the integral was
+    not computable.
+    """
+    if symbolicBudget is None:
+        symbolicBudget = evaluation.BUDGETS["integral-symbolic"]
+    timings = {}
+
+    start = time.perf_counter()
+    outcome = evaluation.runWithBudget(calculateIntegral, (func,),
+                                       {"inTermsOf": inTermsOf, "uBound": uBound, "lBound": lBound},
+                                       budget=symbolicBudget)
+    timings["symbolic"] = time.perf_counter() - start
+
+    if outcome.ok and outcome.value[0] is not None and not isUnevaluated(outcome.value[0]):
+        return {"tier": "symbolic", "result": outcome.value[0], "timings": timings}, outcome.value[1]
+
+    if numericBounds(uBound, lBound)[0] is None:
+        message = outcome.value[1] if outcome.ok else f"An error occurred | {outcome.message}"
+        return None, message
+
+    start = time.perf_counter()
+    numeric, message = calculateNumericIntegral(func, inTermsOf, uBound, lBound, method=method, precision=precision)
+    timings["numeric"] = time.perf_counter() - start
+
+    if numeric is None:
+        return None, message
+    return {"tier": "numeric", "result": numeric, "timings": timings}, message
+
+
+def calculateIntegralWithFallback(func: str, inTermsOf: str, uBound: str, lBound: str, symbolicSeconds: float = None,
+                                  method: str = "tanh-sinh",
+                                  precision: int = DEFAULT_NUMERIC_PRECISION) -> (dict, str):
+    """
+    Computes an integral like integrateTiered, but in the current process, so it can be the job of a worker (whose
+    whole budget covers both tiers). If the bounds are finite numbers sympy is given symbolicSeconds (see
+    calculateIntegral), and the integral is calculated numerically if it can't close it within them. Otherwise sympy
+    has no limit of its own, and an integral it can't close is returned unevaluated.
+    :param symbolicSeconds: time sympy is given when the integral can fall back to numeric quadrature
+    (evaluation.BUDGETS["integral-symbolic"] by default)
+    :return: the same as integrateTiered
+    """
+    if symbolicSeconds is None:
+        symbolicSeconds = evaluation.BUDGETS["integral-symbolic"].seconds
+    fallback = numericBounds(uBound, lBound)[0] is not None
+    timings = {}
+
+    start = time.perf_counter()
+    result, message = calculateIntegral(func, inTermsOf=inTermsOf, uBound=uBound, lBound=lBound,
+                                        seconds=symbolicSeconds if fallback else None)
+    timings["symbolic"] = time.perf_counter() - start
+    if result is None:
+        return None, message
+    if not (fallback and isUnevaluated(result)):
+        return {"tier": "symbolic", "result": result, "timings": timings}, message
+
+    start = time.perf_counter()
+    numeric, message = calculateNumericIntegral(func, inTermsOf, uBound, lBound, method=method, precision=precision)
+    timings["numeric"] = time.perf_counter() - start
+
+    if numeric is None:
+        return None, message
+    return {"tier": "numeric", "result": numeric, "timings": timings}, message
@@ -0,0 +1,304 @@
+"""
+Export of the results of the calculators (derivatives, integrals...) as standalone numeric code that can be used in
+numeric pipelines without sympy. The common subexpressions of the result are calculated once (see sympy.cse), and it
+is either printed as a Python function that only needs NumPy (and scipy.special for special functions), or compiled
+into a C extension (a NumPy ufunc) with sympy's code generation and the local C compiler.
+
+    d, message = calculus.calculateDifferential("x**2*sin(x)", "x", 3)
+    print(numpySource(d, ["x"], name="d3"))
+    writeModule(d, ["x"], "d3.py", name="d3")
+    ufunc = compileExtension(d, ["x"])
+    print(formatBenchmark(benchmark(d, ["x"], extension=True)))
+
+Usage:
+    python -m codeExport "x**2*sin(x)" --diff x --order 3 -o d3.py --name d3 --benchmark --extension
+"""
+import argparse
+import collections
+import keyword
+import sys
+import time
+
+import numpy as np
+from sympy import Integral, Symbol, count_ops, cse, numbered_symbols
+from sympy.printing.numpy import SciPyPrinter
+from sympy.utilities.autowrap import CodeWrapError, UfuncifyCodeWrapper
+from sympy.utilities.codegen import C99CodeGen
+
+import arrayEvaluation
+
+# Modules the generated functions may import, anything else can't evaluate arrays
+EXPORTED_MODULES = ("numpy", "scipy.special")
+
+# Prefix of the variables that hold the common subexpressions in the generated functions
+SUBEXPRESSION_PREFIX = "_t"
+
+MAX_DOCSTRING_LENGTH = 300
+
+# Inputs of the benchmarks, drawn uniformly from this range (positive, so that logarithms and roots are real)
+BENCHMARK_RANGE = (0.1, 2.0)
+BENCHMARK_POINTS = 100000
+BENCHMARK_NAIVE_POINTS = 200    # subs/evalf is thousands of times slower, it gets fewer points
+BENCHMARK_REPEAT = 5
+
+# Maximum number of ufuncs kept by compileExtension (the least recently used are dropped first)
+MAX_EXTENSIONS = 32
+
+# (expression, variables) -> ufunc, so an expression isn't compiled again while it is used. The most recently used are
+# at the end
+_extensions = collections.OrderedDict()
+
+
+def _prepare(result, variables: list) -> tuple:
+    """
+    :return: a tuple (expression, symbols of the variables)
+    :raises ValueError: if the expression can't be exported
+    """
+    expr = arrayEvaluation.asExpression(result)
+    if expr.has(Integral):
+        raise ValueError("the expression contains integrals that could not be calculated")
+    invalid = [v for v in variables if not v.isidentifier() or keyword.iskeyword(v)]
+    if invalid:
+        raise ValueError(f"{', '.join(invalid)} can't be used as the name of a variable")
+    unknown = {str(symbol) for symbol in expr.free_symbols} - set(variables)
+    if unknown:
+        raise ValueError(f"unknown variables {', '.join(sorted(unknown))}")
+    return expr, [Symbol(v) for v in variables]
+
+
+def eliminateSubexpressions(result, variables: list) -> dict:
+    """
+    Finds the common subexpressions of an expression.
+    :param result: sympy expression (i.e. returned by calculus.calculateDifferential), CompiledExpression or string
+    :param variables: names of the variables of the expression
+    :return: dictionary with the 'subexpressions' (list of (symbol, expression), each one may use the previous ones),
+    the 'reduced' expression that uses them, and the number of operations 'before' and 'after' eliminating them
+    """
+    expr, symbols = _prepare(result, variables)
+    replacements, (reduced,) = cse(expr, symbols=numbered_symbols(SUBEXPRESSION_PREFIX), optimizations="basic")
+    return {"subexpressions": replacements, "reduced": reduced, "before": count_ops(expr),
+            "after": sum(count_ops(sub) for _, sub in replacements) + count_ops(reduced)}
+
+
+def _print(printer: SciPyPrinter, expr) -> str:
+    code = printer.doprint(expr)
+    if "\n" in code:   # The printer lists the functions it doesn't know in comments before the code
+        functions = [line.strip(" #") for line in code.splitlines()[1:-1]]
+        raise ValueError(f"NumPy and SciPy can't evaluate {', '.join(functions)}")
+    return code
+
+
+def _plural(count: int, noun: str) -> str:
+    return f"{count} {noun}{'' if count == 1 else 's'}"
+
+
+def numpySource(result, variables: list, name: str = "f") -> str:
+    """
+    Prints an expression as the source of a standalone Python module with a function that evaluates it over NumPy
+    arrays (or plain numbers), calculating its common subexpressions only once.
+    :param result: sympy expression (i.e. returned by calculus.calculateDifferential), CompiledExpression or string
+    :param variables: names of the variables of the expression, in the order the function receives them
+    :param name: name of the function
+    :return: the source of the module
+    :raises ValueError: if the expression can't be evaluated with NumPy (i.e. unevaluated integrals or functions
+    without a NumPy or SciPy counterpart)
+    """
+    if not name.isidentifier() or keyword.iskeyword(name):
+        raise ValueError(f"'{name}' can't be used as the name of a function")
+    expr, symbols = _prepare(result, variables)
+    eliminated = eliminateSubexpressions(expr, variables)
+
+    printer = SciPyPrinter({"fully_qualified_modules": True})
+    body = [f"    {symbol} = {_print(printer, sub)}" for symbol, sub in eliminated["subexpressions"]]
+    value = _print(printer, eliminated["reduced"])
+    if symbols and not expr.free_symbols:   # A constant, it still gets the shape of the inputs
+        value = f"numpy.full(numpy.broadcast({', '.join(variables)}).shape, {value}, dtype=float)"
+        printer.module_imports["numpy"].add("full")
+    body.append(f"    return {value}")
+
+    unsupported = sorted(module for module in printer.module_imports if module not in EXPORTED_MODULES)
+    if unsupported:     # i.e. math, whose functions only take numbers
+        raise ValueError(f"the expression needs {', '.join(unsupported)}, which can't evaluate arrays")
+
+    description = str(expr)
+    if len(description) > MAX_DOCSTRING_LENGTH:
+        description = description[:MAX_DOCSTRING_LENGTH] + "..."
+    lines = [f'"""', f"Generated by codeExport.py ({eliminated['before']} operations, {eliminated['after']} after "
+                     f"eliminating {_plural(len(eliminated['subexpressions']), 'common subexpression')})", '"""']
+    lines += [f"import {module}" for module in sorted(printer.module_imports)]
+    lines += ["", "", f"def {name}({', '.join(variables)}):",
+              f'    """{description}"""'.replace("\\", "\\\\"), *body, ""]
+    return "\n".join(lines)
+
+
+def compileNumpy(result, variables: list, name: str = "f"):
+    """
+    :return: the function printed by numpySource, loaded in this process
+    """
+    namespace = {}
+    exec(compile(numpySource(result, variables, name), f"<codeExport {name}>", "exec"), namespace)
+    return namespace[name]
+
+
+def writeModule(result, variables: list, path: str, name: str = "f") -> str:
+    """
+    Writes the module printed by numpySource to a file.
+    :return: the path of the file
+    """
+    source = numpySource(result, variables, name)
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(source)
+    return path
+
+
+def compileExtension(result, variables: list, tempdir: str = None, flags: tuple = ()):
+    """
+    Compiles an expression into a C extension with a NumPy ufunc that evaluates it, calculating its common
+    subexpressions only once (see sympy.utilities.autowrap.ufuncify). It needs a C compiler and the Python and NumPy
+    headers, and takes a second or two, so the ufuncs of the last MAX_EXTENSIONS expressions compiled are kept.
+    :param result: sympy expression (i.e. returned by calculus.calculateDifferential), CompiledExpression or string
+    :param variables: names of the variables of the expression (at least one), in the order the ufunc receives them
+    :param tempdir: directory where the extension is built and kept (a temporary one that is deleted by default)
+    :param flags: extra flags for the compiler
+    :return: the ufunc
+    :raises ValueError: if the expression can't be exported
+    :raises RuntimeError: if the extension could not be compiled
+    """
+    expr, symbols = _prepare(result, variables)
+    if not symbols:
+        raise ValueError("a ufunc needs at least one variable")
+
+    key = (str(expr), tuple(variables))
+    if key not in _extensions or tempdir is not None:
+        generator = C99CodeGen("ufuncify", cse=True)
+        routine = generator.routine("autofunc0", expr, symbols, None)
+        try:
+            _extensions[key] = UfuncifyCodeWrapper(generator, tempdir, list(flags), False).wrap_code([routine])
+        except CodeWrapError as e:
+            raise RuntimeError(f"the extension could not be compiled: {e}") from e
+        while len(_extensions) > MAX_EXTENSIONS:
+            _extensions.popitem(last=False)
+    else:
+        _extensions.move_to_end(key)
+    return _extensions[key]
+
+
+def _throughput(function, points: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return points / best if best > 0 else float("inf")
+
+
+def benchmark(result, variables: list, points: int = BENCHMARK_POINTS, naivePoints: int = BENCHMARK_NAIVE_POINTS,
+              repeat: int = BENCHMARK_REPEAT, extension: bool = False, seed: int = 0) -> dict:
+    """
+    Compares how fast an expression is evaluated point by point with subs/evalf, with sympy's lambdify, with the
+    function printed by numpySource and, optionally, with the C extension of compileExtension.
+    :param points: number of random inputs (drawn from BENCHMARK_RANGE) for the array methods
+    :param naivePoints: number of them that are also evaluated with subs/evalf
+    :param repeat: times every method is run, the fastest run is the one reported
+    :param extension: True to also compile and time the C extension
+    :return: dictionary with the 'points', the statistics of the common subexpression elimination ('subexpressions',
+    'opsBefore', 'opsAfter'), the 'pointsPerSecond' of every method, the 'speedup' of every method over subs/evalf and
+    the 'maxError' (relative) of the exported functions against subs/evalf
+    """
+    expr, symbols = _prepare(result, variables)
+    rng = np.random.default_rng(seed)
+    inputs = [rng.uniform(*BENCHMARK_RANGE, points) for _ in symbols] or [np.zeros(points)]
+    naiveInputs = [values[:naivePoints] for values in inputs]
+
+    def naive():
+        return np.array([complex(expr.subs(dict(zip(symbols, point))).evalf()).real
+                         for point in zip(*(values.tolist() for values in naiveInputs))])
+
+    exported = compileNumpy(expr, variables)
+    lambdified = arrayEvaluation.compileForArrays(expr, variables)[0]
+    methods = {"subs/evalf": (naive, naivePoints), "lambdify": (lambda: lambdified(*inputs[:len(symbols)]), points),
+               "numpy+cse": (lambda: exported(*inputs[:len(symbols)]), points)}
+    if extension:
+        ufunc = compileExtension(expr, variables)
+        methods["c+cse"] = (lambda: ufunc(*inputs), points)
+
+    reference = naive()
+    eliminated = eliminateSubexpressions(expr, variables)
+    stats = {"points": points, "subexpressions": len(eliminated["subexpressions"]), "opsBefore": eliminated["before"],
+             "opsAfter": eliminated["after"], "pointsPerSecond": {}, "speedup": {}, "maxError": {}}
+    for methodName, (function, count) in methods.items():
+        stats["pointsPerSecond"][methodName] = _throughput(function, count, 1 if methodName == "subs/evalf" else repeat)
+        stats["speedup"][methodName] = stats["pointsPerSecond"][methodName] / stats["pointsPerSecond"]["subs/evalf"]
+        if methodName != "subs/evalf":
+            values = np.broadcast_to(function(), (points,))[:naivePoints]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                errors = np.abs(values - reference) / np.maximum(np.abs(reference), 1.0)
+            stats["maxError"][methodName] = float(np.nanmax(errors)) if np.isfinite(errors).any() else float("nan")
+    return stats
+
+
+def formatBenchmark(stats: dict) -> str:
+    """
+    :return: a table with the results of benchmark
+    """
+    lines = [f"{stats['points']} points, {_plural(stats['subexpressions'], 'common subexpression')} "
+             f"({stats['opsBefore']} operations -> {stats['opsAfter']})",
+             f"{'method':<12} {'points/s':>14} {'speedup':>10} {'max error':>10}"]
+    for methodName, pointsPerSecond in stats["pointsPerSecond"].items():
+        error = stats["maxError"].get(methodName)
+        lines.append(f"{methodName:<12} {pointsPerSecond:>14,.0f} {stats['speedup'][methodName]:>9.0f}x "
+                     f"{'' if error is None else f'{error:.1e}':>10}")
+    return "\n".join(lines)
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m codeExport",
+                                     description="Exports a function, its derivative or its integral as a standalone "
+                                                 "Python/NumPy function (or a C extension).")
+    parser.add_argument("func", help="function to export (or to differentiate or integrate first)")
+    operation = parser.add_mutually_exclusive_group()
+    operation.add_argument("--diff", metavar="VAR", help="export the derivative with respect to VAR")
+    operation.add_argument("--integrate", metavar="VAR", help="export the integral with respect to VAR")
+    parser.add_argument("--order", type=int, default=1, help="order of the derivative")
+    parser.add_argument("--lower", default="-∞", help="lower bound of the integral (indefinite by default)")
+    parser.add_argument("--upper", default="+∞", help="upper bound of the integral")
+    parser.add_argument("--variables", help="comma separated variables of the exported function, in order (all of "
+                                            "the ones in the result, sorted, by default)")
+    parser.add_argument("--name", default="f", help="name of the exported function")
+    parser.add_argument("-o", "--output", default="-", help="file where the module is written ('-' for stdout)")
+    parser.add_argument("--benchmark", action="store_true", help="compare its speed with subs/evalf")
+    parser.add_argument("--extension", action="store_true", help="also compile it into a C extension (benchmarked "
+                                                                 "along with the rest)")
+    args = parser.parse_args(argv)
+
+    import calculus     # Only needed here, importing it takes a while
+
+    if args.diff:
+        result, message = calculus.calculateDifferential(args.func, args.diff, args.order)
+    elif args.integrate:
+        result, message = calculus.calculateIntegral(args.func, args.integrate, uBound=args.upper, lBound=args.lower)
+    else:
+        result, message = args.func, ""
+    if result is None:
+        print(message.replace("\n", " "), file=sys.stderr)
+        return 1
+
+    variables = [v.strip() for v in args.variables.split(",")] if args.variables else \
+        sorted(str(symbol) for symbol in arrayEvaluation.asExpression(result).free_symbols)
+    try:
+        if args.output == "-":
+            print(numpySource(result, variables, args.name))
+        else:
+            writeModule(result, variables, args.output, args.name)
+        if args.extension and not args.benchmark:
+            compileExtension(result, variables)
+        if args.benchmark:
+            print(formatBenchmark(benchmark(result, variables, extension=args.extension)), file=sys.stderr)
+    except (ValueError, RuntimeError) as e:
+        print(f"An error occurred | {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,657 @@
+import atexit
+import collections
+import itertools
+import multiprocessing
+import os
+import time
+from multiprocessing.connection import wait as waitConnections
+
+import instrumentation
+import metrics
+
+# Processes are always spawned (never forked) so that the workers don't inherit the state of the tkinter interpreter
+MP_CONTEXT = multiprocessing.get_context("spawn")
+
+DEFAULT_POOL_SIZE = 2
+
+# Seconds a superseded job is allowed to keep running (its result is discarded) before its worker is killed. Cheap
+# jobs usually finish within this time, which saves the cost of spawning (and warming up) a new worker process.
+DEFAULT_KILL_GRACE = 0.25
+
+# Milliseconds the input has to stay unchanged before it is evaluated
+DEFAULT_DEBOUNCE_MS = 250
+
+
+class Budget:
+    """
+    Limits for the evaluation of a single job. A job that exceeds them is killed along with its worker.
+    None means unlimited.
+    """
+
+    def __init__(self, seconds: float = None, memoryMb: float = None):
+        """
+        :param seconds: wall-clock time the job may run for
+        :param memoryMb: resident memory (RSS) the worker may use while running the job. It is only enforced where the
+        memory of another process can be read (/proc, so Linux)
+        """
+        self.seconds = seconds
+        self.memoryMb = memoryMb
+
+    def __repr__(self) -> str:
+        return f"Budget(seconds={self.seconds}, memoryMb={self.memoryMb})"
+
+
+# Budget used by every kind of operation, they can be modified with setBudget
+BUDGETS = {
+    "differential": Budget(seconds=5, memoryMb=1024),
+    "integral": Budget(seconds=10, memoryMb=1024),
+    # Definite integrals with numeric bounds give sympy less time, because they can fall back to numeric quadrature
+    "integral-symbolic": Budget(seconds=2, memoryMb=1024),
+    "integral-numeric": Budget(seconds=10, memoryMb=1024),
+    "derivative-matrix": Budget(seconds=10, memoryMb=1024),
+    "series": Budget(seconds=10, memoryMb=1024),
+}
+
+
+def setBudget(operation: str, seconds: float = None, memoryMb: float = None) -> None:
+    """
+    Changes the budget of an operation (i.e. "integral"), creating it if it didn't exist.
+    """
+    BUDGETS[operation] = Budget(seconds=seconds, memoryMb=memoryMb)
+
+
+def _residentMemoryMb(pid: int) -> float | None:
+    """
+    :return: the resident memory of the process in MB, or None if it can't be known in this platform
+    """
+    try:
+        with open(f"/proc/{pid}/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class EvaluationResult:
+    """
+    Outcome of a job evaluated by a WorkerPool.
+    status is "ok" if the job finished and 'value' holds what the function returned, "error" if the function
+    raised an exception (in which case 'message' holds the exception's text), "timeout" if it ran for longer than its
+    budget allowed or "memory" if it used more memory than allowed (or ran out of it).
+    If instrumentation was enabled when the job was submitted, 'stages' holds the (operation, stage, seconds) tuples
+    timed while it was evaluated (see instrumentation.py).
+    """
+
+    def __init__(self, jobId: int, status: str, value=None, message: str = "", elapsed: float = 0.0,
+                 stages: list = None):
+        self.jobId = jobId
+        self.status = status
+        self.value = value
+        self.message = message
+        self.elapsed = elapsed
+        self.stages = stages or []
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "ok"
+
+    def __repr__(self) -> str:
+        return f"EvaluationResult(jobId={self.jobId}, status={self.status!r}, elapsed={self.elapsed:.3f}s)"
+
+
+def _workerLoop(conn, preload: tuple) -> None:
+    """
+    Main loop of every worker process. It receives jobs through the pipe, runs them and sends their outcome back.
+    :param conn: worker side of the pipe shared with the parent process
+    :param preload: names of the modules to import before accepting jobs, so that the first job doesn't pay for them
+    """
+    for moduleName in preload:
+        __import__(moduleName)
+    conn.send("ready")
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+
+        if job is None:     # Shutdown request
+            return
+
+        jobId, function, args, kwargs, instrument, profilePath = job
+        instrumentation.setEnabled(instrument)     # It may have been toggled in the parent since the worker started
+        if instrument:
+            instrumentation.startTrace()
+        metrics.registry.startTrace()
+        start = time.perf_counter()
+        try:
+            if profilePath:
+                value = instrumentation.profileCall(function, args, kwargs, profilePath)
+            else:
+                value = function(*args, **kwargs)
+        except MemoryError:
+            outcome = (jobId, "memory", None, "The calculation ran out of memory")
+        except Exception as e:
+            outcome = (jobId, "error", None, f"{type(e).__name__}: {e}")
+        else:
+            outcome = (jobId, "ok", value, "")
+
+        elapsed = time.perf_counter() - start
+        stages = instrumentation.stopTrace() if instrument else []
+        recorded = metrics.registry.stopTrace()
+        try:
+            conn.send(outcome + (elapsed, stages, recorded))
+        except Exception as e:      # The result could not be pickled
+            conn.send((jobId, "error", None, f"Unsendable result: {e}", elapsed, stages, recorded))
+
+
+class Worker:
+    """
+    A single process that evaluates one job at a time and that can be killed at any moment (which is the only way of
+    stopping a sympy computation that is already running).
+    """
+
+    def __init__(self, preload: tuple = ()):
+        self.preload = preload
+        self.jobId = None
+        self.budget = None
+        self.startedAt = 0.0
+        self.ready = False
+        self.conn = None
+        self.process = None
+        self.start()
+
+    def start(self) -> None:
+        self.conn, childConn = MP_CONTEXT.Pipe()
+        self.process = MP_CONTEXT.Process(target=_workerLoop, args=(childConn, self.preload), daemon=True)
+        self.process.start()
+        childConn.close()
+        self.jobId = None
+        self.ready = False
+
+    def isReady(self) -> bool:
+        """
+        :return: True once the process has started and imported its preloaded modules, so budgets only count the
+        time spent on the job itself
+        """
+        if not self.ready and self.conn.poll():
+            try:
+                self.ready = self.conn.recv() == "ready"
+            except EOFError:
+                self.restart()
+        return self.ready
+
+    @property
+    def busy(self) -> bool:
+        return self.jobId is not None
+
+    def run(self, jobId: int, function, args: tuple, kwargs: dict, budget: Budget = None, profile: str = None) -> None:
+        self.conn.send((jobId, function, args, kwargs, instrumentation.enabled, profile))
+        self.jobId = jobId
+        self.budget = budget
+        self.startedAt = time.perf_counter()
+
+    def overBudget(self, now: float) -> tuple | None:
+        """
+        :return: (status, message) if the current job has exceeded its budget, None otherwise
+        """
+        if self.budget is None:
+            return None
+
+        if self.budget.seconds is not None and now - self.startedAt > self.budget.seconds:
+            return "timeout", f"The calculation took longer than {self.budget.seconds:g} s"
+
+        if self.budget.memoryMb is not None:
+            memory = _residentMemoryMb(self.process.pid)
+            if memory is not None and memory > self.budget.memoryMb:
+                return "memory", f"The calculation used more than {self.budget.memoryMb:g} MB of memory"
+        return None
+
+    def receive(self):
+        """
+        :return: the outcome tuple of the current job if it has finished, or None otherwise
+        """
+        if self.jobId is None or not self.conn.poll():
+            return None
+        try:
+            outcome = self.conn.recv()
+        except EOFError:    # The process died while evaluating the job
+            outcome = (self.jobId, "error", None, "The worker process died unexpectedly",
+                       time.perf_counter() - self.startedAt, [], [])
+            self.restart()
+            return outcome
+        self.jobId = None
+        return outcome
+
+    def restart(self) -> None:
+        """
+        Kills the process (and whatever it was computing) and starts a fresh one in its place
+        """
+        self.kill()
+        self.start()
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(timeout=1)
+        self.conn.close()
+        self.jobId = None
+
+    def stop(self) -> None:
+        """
+        Asks the process to finish cleanly, killing it if it is busy.
+        """
+        if self.busy:
+            self.kill()
+            return
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+
+class WorkerPool:
+    """
+    Pool of killable worker processes.
+    Jobs can be submitted on a 'channel': submitting a new job on a channel supersedes the job previously submitted on
+    it, so a queued job is dropped and a running one has its result discarded (and its worker killed if it keeps
+    running for longer than killGrace seconds). Only the results of jobs that have not been superseded are returned.
+    The pool never blocks on its own, poll() has to be called periodically (see EvaluationEngine for tkinter).
+    """
+
+    _names = itertools.count(1)
+
+    def __init__(self, size: int = DEFAULT_POOL_SIZE, preload: tuple = ("calculus",),
+                 killGrace: float = DEFAULT_KILL_GRACE, name: str = None):
+        """
+        :param size: number of worker processes
+        :param preload: names of the modules the workers import before accepting jobs
+        :param killGrace: seconds a superseded job may keep running before its worker is killed
+        :param name: name of the pool in the metrics (see metrics.py), a number by default
+        """
+        self.workers = [Worker(preload) for _ in range(max(1, size))]
+        self.killGrace = killGrace
+        self.name = name or str(next(WorkerPool._names))
+
+        self.queue = collections.deque()    # (jobId, function, args, kwargs, budget, profile)
+        self.channels = {}                  # channel -> id of the latest job submitted on it
+        self.jobChannels = {}               # jobId -> channel
+        self.jobOperations = {}             # jobId -> name of the operation in the metrics
+        self.stale = {}                     # ids of superseded jobs that are still running -> when superseded
+        self.listeners = {}                 # jobId -> function that receives its result (instead of poll's caller)
+        self.ids = itertools.count(1)
+
+        self.stats = {"submitted": 0, "completed": 0, "superseded": 0, "killed": 0, "overBudget": 0}
+        metrics.registry.addCollector(self.collectMetrics)
+
+    def submit(self, function, args: tuple = (), kwargs: dict = None, channel=None, budget: Budget = None,
+               profile: str = None, operation: str = None, onResult=None) -> int:
+        """
+        Queues a job to be evaluated by the pool.
+        :param function: module level function to evaluate (it has to be picklable)
+        :param args: positional arguments for the function
+        :param kwargs: keyword arguments for the function
+        :param channel: if not None, the job supersedes the previous job submitted on the same channel
+        :param budget: limits for the job, if exceeded it is killed and its result has status "timeout" or "memory"
+        :param profile: path of a file where the worker writes a profile of the job (see instrumentation.profileCall).
+        If CALC_PROFILE_DIR is set, every job is profiled into that directory.
+        :param operation: name of the job in the metrics (see metrics.py), the name of the function by default
+        :param onResult: function called with the EvaluationResult by whichever call to poll() collects it, which then
+        doesn't return it. This way several users of the pool (i.e. the EvaluationEngine of every window) can poll it
+        without taking each other's results
+        :return: the id of the job, which will be found in its EvaluationResult
+        """
+        jobId = next(self.ids)
+        profileDir = os.environ.get(instrumentation.PROFILE_DIR_ENV_VAR)
+        if profile is None and profileDir:
+            os.makedirs(profileDir, exist_ok=True)
+            profile = os.path.join(profileDir, f"{getattr(function, '__name__', 'job')}-{os.getpid()}-{jobId}.prof")
+
+        if channel is not None:
+            previous = self.channels.get(channel)
+            if previous is not None:
+                self.cancel(previous)
+            self.channels[channel] = jobId
+            self.jobChannels[jobId] = channel
+
+        self.jobOperations[jobId] = operation or getattr(function, "__name__", "job")
+        if onResult is not None:
+            self.listeners[jobId] = onResult
+        self.queue.append((jobId, function, args, kwargs or {}, budget, profile))
+        self.stats["submitted"] += 1
+        self._dispatch()
+        return jobId
+
+    def cancel(self, jobId: int) -> bool:
+        """
+        Cancels a job, if it is queued it is dropped and if it is running its result will be discarded.
+        :return: True if the job was pending, False if it had already finished (or was unknown)
+        """
+        channel = self.jobChannels.pop(jobId, None)
+        if channel is not None and self.channels.get(channel) == jobId:
+            del self.channels[channel]
+        self.listeners.pop(jobId, None)
+
+        for job in self.queue:
+            if job[0] == jobId:
+                self.queue.remove(job)
+                self.jobOperations.pop(jobId, None)
+                self.stats["superseded"] += 1
+                return True
+
+        for worker in self.workers:
+            if worker.jobId == jobId:
+                self.stale[jobId] = time.perf_counter()
+                self.stats["superseded"] += 1
+                return True
+        return False
+
+    def cancelChannel(self, channel) -> None:
+        jobId = self.channels.get(channel)
+        if jobId is not None:
+            self.cancel(jobId)
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of jobs whose result is still to be returned by poll()
+        """
+        running = sum(1 for worker in self.workers if worker.busy and worker.jobId not in self.stale)
+        return running + len(self.queue)
+
+    def poll(self) -> list:
+        """
+        Collects the jobs that have finished and hands queued jobs to the idle workers.
+        :return: list of EvaluationResult, one for every job (not superseded) that finished since the last call, except
+        the ones submitted with onResult, which are handed to it instead
+        """
+        results = []
+        delivered = []      # (listener, result), called once the pool is consistent again
+        now = time.perf_counter()
+
+        for worker in self.workers:
+            if not worker.busy:
+                continue
+
+            outcome = worker.receive()
+            if outcome is None:
+                if worker.jobId in self.stale:
+                    if now - self.stale[worker.jobId] > self.killGrace:
+                        del self.stale[worker.jobId]
+                        self.jobOperations.pop(worker.jobId, None)
+                        worker.restart()
+                        self.stats["killed"] += 1
+                    continue
+
+                exceeded = worker.overBudget(now)
+                if exceeded is None:
+                    continue
+
+                outcome = (worker.jobId, exceeded[0], None, exceeded[1], now - worker.startedAt, [], [])
+                worker.restart()
+                self.stats["killed"] += 1
+                self.stats["overBudget"] += 1
+
+            jobId, status, value, message, elapsed, stages, recorded = outcome
+            instrumentation.merge(stages)   # Superseded jobs are timed too
+            metrics.registry.merge(recorded)
+            operation = self.jobOperations.pop(jobId, "job")
+            if jobId in self.stale:
+                del self.stale[jobId]
+                continue
+
+            self._forget(jobId)
+            self.stats["completed"] += 1
+            metrics.registry.inc("evaluations_total", {"operation": operation, "status": status})
+            metrics.registry.observe("evaluation_seconds", elapsed, {"operation": operation})
+            result = EvaluationResult(jobId, status, value, message, elapsed, stages)
+            listener = self.listeners.pop(jobId, None)
+            if listener is not None:
+                delivered.append((listener, result))
+            else:
+                results.append(result)
+
+        self._dispatch()
+        for listener, result in delivered:
+            listener(result)
+        return results
+
+    def wait(self, jobId: int, timeout: float = None) -> EvaluationResult | None:
+        """
+        Blocks until the given job finishes. Results of other jobs that finish in the meantime are lost, so this is
+        meant for scripts that don't poll the pool themselves.
+        :return: the EvaluationResult of the job, or None if the timeout ran out before
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            for result in self.poll():
+                if result.jobId == jobId:
+                    return result
+
+            remaining = None if deadline is None else deadline - time.perf_counter()
+            if remaining is not None and remaining <= 0:
+                return None
+            self.waitForResults(0.05 if remaining is None else min(0.05, remaining))
+
+    def waitForResults(self, timeout: float = 0.05) -> None:
+        """
+        Blocks until some worker has something to report (or the timeout runs out), so that scripts can wait before
+        calling poll() again without spinning.
+        """
+        conns = [worker.conn for worker in self.workers if worker.busy or not worker.ready]
+        if conns:
+            waitConnections(conns, timeout=timeout)
+        else:
+            time.sleep(min(timeout, 0.005))
+
+    def collectMetrics(self) -> list:
+        """
+        :return: the state of the pool as (name, labels, value) samples (see metrics.MetricsRegistry.addCollector)
+        """
+        labels = {"pool": self.name}
+        samples = [("pool_workers", labels, len(self.workers)),
+                   ("pool_busy_workers", labels, sum(1 for worker in self.workers if worker.busy)),
+                   ("pool_queue_depth", labels, len(self.queue))]
+        samples += [("pool_jobs_total", dict(labels, event=event), count) for event, count in self.stats.items()]
+        return samples
+
+    def shutdown(self) -> None:
+        self.queue.clear()
+        for worker in self.workers:
+            worker.stop()
+
+    def _forget(self, jobId: int) -> None:
+        channel = self.jobChannels.pop(jobId, None)
+        if channel is not None and self.channels.get(channel) == jobId:
+            del self.channels[channel]
+
+    def _dispatch(self) -> None:
+        for worker in self.workers:
+            if not self.queue:
+                return
+            if not worker.busy and worker.isReady():
+                jobId, function, args, kwargs, budget, profile = self.queue.popleft()
+                worker.run(jobId, function, args, kwargs, budget, profile)
+
+
+_sharedPool = None
+
+
+def runWithBudget(function, args: tuple = (), kwargs: dict = None, budget: Budget = None,
+                  pool: WorkerPool = None) -> EvaluationResult:
+    """
+    Evaluates function(*args, **kwargs) in a worker process and waits for it, killing it if it exceeds the budget.
+    Meant for scripts, the tkinter windows use an EvaluationEngine instead.
+    :param pool: pool where the job is evaluated (the shared pool by default)
+    :return: the EvaluationResult of the job
+    """
+    pool = pool if pool is not None else getSharedPool()
+    return pool.wait(pool.submit(function, args, kwargs, budget=budget))
+
+
+def getSharedPool() -> WorkerPool:
+    """
+    Returns the pool shared by every window of the program, creating it (and starting its workers) the first time.
+    """
+    global _sharedPool
+    if _sharedPool is None:
+        _sharedPool = WorkerPool(name="shared")
+        atexit.register(_sharedPool.shutdown)
+    return _sharedPool
+
+
+class EvaluationEngine:
+    """
+    Connects a WorkerPool with the tkinter event loop. Jobs are evaluated outside of the tkinter thread and their
+    callbacks are run from the event loop (through 'after'), so typing never waits for a computation to finish.
+    """
+
+    def __init__(self, master, pool: WorkerPool = None, pollMs: int = 15):
+        """
+        :param master: any tkinter widget, used to schedule the polling of the pool
+        :param pool: pool where jobs are evaluated (the shared pool by default)
+        :param pollMs: milliseconds between two checks for finished jobs while there are jobs pending
+        """
+        self.master = master
+        self.pool = pool if pool is not None else getSharedPool()
+        self.pollMs = pollMs
+
+        self.callbacks = {}     # jobId -> callback
+        self.channelJobs = {}   # channel -> id of the latest job submitted on it
+        self.pollId = None
+
+    def submit(self, function, args: tuple = (), kwargs: dict = None, onResult=None, channel=None,
+               budget: Budget = None) -> int:
+        """
+        Evaluates function(*args, **kwargs) in the pool and calls onResult(EvaluationResult) from the event loop once
+        it finishes. If a channel is given, the previous job submitted on it by this engine is superseded and its
+        callback will never be called. If a budget is given and the job exceeds it, the callback receives a result
+        with status "timeout" or "memory".
+        """
+        if channel is not None:
+            # The callback of the job being superseded will never be called
+            self.callbacks.pop(self.channelJobs.pop(channel, None), None)
+
+        # The result is handed to this engine whichever engine polls the pool, they may share it
+        jobId = self.pool.submit(function, args, kwargs, channel=None if channel is None else (id(self), channel),
+                                 budget=budget, onResult=self._deliver)
+        if onResult is not None:
+            self.callbacks[jobId] = onResult
+        if channel is not None:
+            self.channelJobs[channel] = jobId
+
+        if self.pollId is None:
+            self.pollId = self.master.after(self.pollMs, self._poll)
+        return jobId
+
+    def cancel(self, channel) -> None:
+        """
+        Cancels the job pending on the given channel (if any), its callback will never be called
+        """
+        jobId = self.channelJobs.pop(channel, None)
+        if jobId is not None:
+            self.callbacks.pop(jobId, None)
+            self.pool.cancel(jobId)
+
+    def _deliver(self, result: EvaluationResult) -> None:
+        callback = self.callbacks.pop(result.jobId, None)
+        self._forgetChannel(result.jobId)
+        if callback is not None:
+            callback(result)
+
+    def _poll(self) -> None:
+        self.pollId = None
+        self.pool.poll()    # The results of the jobs of every engine are handed to them (see _deliver)
+
+        if self.callbacks or self.pool.stale:
+            self.pollId = self.master.after(self.pollMs, self._poll)
+
+    def shutdown(self) -> None:
+        """
+        Cancels every job submitted through this engine. Meant to be called when its window is destroyed.
+        """
+        if self.pollId is not None:
+            try:
+                self.master.after_cancel(self.pollId)
+            except Exception:   # The widget has already been destroyed
+                pass
+            self.pollId = None
+
+        for jobId in self.callbacks:
+            self.pool.cancel(jobId)
+        self.callbacks.clear()
+        self.channelJobs.clear()
+
+    def _forgetChannel(self, jobId: int) -> None:
+        for channel, channelJobId in list(self.channelJobs.items()):
+            if channelJobId == jobId:
+                del self.channelJobs[channel]
+
+
+class DebounceScheduler:
+    """
+    Coalesces bursts of events (i.e. keystrokes) into a single call to 'callback', made once no event has been
+    triggered for delayMs milliseconds, so only the settled input is evaluated.
+    """
+
+    def __init__(self, master, callback, delayMs: int = DEFAULT_DEBOUNCE_MS, snapshot=None):
+        """
+        :param master: any tkinter widget, used to schedule the calls
+        :param callback: function (without parameters) that evaluates the input
+        :param delayMs: milliseconds without events needed for the input to be considered settled
+        :param snapshot: optional function that returns the current input. If it returns the same as in the last
+        evaluation, the evaluation is skipped (i.e. after moving the cursor with the arrow keys)
+        """
+        self.master = master
+        self.callback = callback
+        self.delayMs = delayMs
+        self.snapshot = snapshot
+
+        self.afterId = None
+        self.lastSnapshot = None
+        self.stats = {"events": 0, "evaluations": 0, "coalesced": 0, "unchanged": 0}
+
+    @property
+    def skipped(self) -> int:
+        """
+        Number of events that did not end up in an evaluation of their own
+        """
+        return self.stats["coalesced"] + self.stats["unchanged"]
+
+    def trigger(self) -> None:
+        """
+        Registers an event, (re)starting the countdown to the evaluation
+        """
+        self.stats["events"] += 1
+        if self.afterId is not None:
+            self.master.after_cancel(self.afterId)
+            self.stats["coalesced"] += 1
+        self.afterId = self.master.after(self.delayMs, self._fire)
+
+    def flush(self) -> None:
+        """
+        Evaluates right away (i.e. when the return key is pressed), even if the input is unchanged
+        """
+        self.cancel()
+        self.lastSnapshot = None
+        self._fire()
+
+    def cancel(self) -> None:
+        if self.afterId is not None:
+            self.master.after_cancel(self.afterId)
+            self.afterId = None
+
+    def _fire(self) -> None:
+        self.afterId = None
+        if self.snapshot is not None:
+            current = self.snapshot()
+            if current == self.lastSnapshot:
+                self.stats["unchanged"] += 1
+                return
+            self.lastSnapshot = current
+
+        self.stats["evaluations"] += 1
+        self.callback()
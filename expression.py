@@ -0,0 +1,520 @@
+import collections
+import math
+import threading
+import time
+from tokenize import TokenError
+
+import numpy as np
+import sympy
+from sympy import Add, Basic, Dummy, Expr, Mul, O, S, Symbol, diff, factorial, lambdify, oo, preorder_traversal, sympify
+from sympy.core.sympify import SympifyError
+from sympy.parsing.sympy_parser import convert_xor, parse_expr, standard_transformations
+
+import instrumentation
+import tokenizer
+
+# Maximum number of expressions kept by compileExpression (the least recently used are dropped first)
+MAX_EXPRESSIONS = 256
+
+# Points where the error of a truncated series is measured over an interval (see SeriesExpansion.errorBounds)
+ERROR_SAMPLES = 1025
+
+# Functions of sympy (besides its classes and constants) that can be used in the expressions that are parsed
+PARSER_FUNCTIONS = ("sqrt", "cbrt", "root", "real_root", "diff", "integrate", "limit", "summation", "product",
+                    "series", "simplify", "expand", "factor", "cancel", "apart", "together", "trigsimp", "Matrix")
+
+_parserNamespace = None
+
+
+def _namespace() -> dict:
+    """
+    :return: the only names an expression can use when it is parsed: the classes and constants of sympy (sin, Integral,
+    pi...) and the PARSER_FUNCTIONS, without any of python's builtins
+    """
+    global _parserNamespace
+    if _parserNamespace is None:
+        namespace = {name: value for name, value in vars(sympy).items() if not name.startswith("_") and
+                     (isinstance(value, Basic) or isinstance(value, type) and issubclass(value, Basic))}
+        namespace.update({name: getattr(sympy, name) for name in PARSER_FUNCTIONS})
+        namespace.update(abs=sympy.Abs, max=sympy.Max, min=sympy.Min, __builtins__={})
+        _parserNamespace = namespace
+    return _parserNamespace
+
+
+def _normalize(source: str, locales: tuple) -> str:
+    try:
+        return tokenizer.normalize(str(source), locales)
+    except SyntaxError as e:    # Python code that isn't a mathematical expression (see tokenizer.normalize)
+        raise SympifyError(source, e)
+
+
+def _parseNormalized(text: str) -> Expr:
+    try:
+        return parse_expr(text, global_dict=_namespace(), transformations=standard_transformations + (convert_xor,))
+    except (TokenError, SyntaxError) as e:
+        raise SympifyError(text, e)
+
+
+def parse(source: str, locales: tuple = tokenizer.DEFAULT_LOCALES) -> Expr:
+    """
+    Parses an expression written by the user (see tokenizer.normalize). Unlike sympify, which runs its input as
+    python code, it only lets the expression use sympy's mathematical names, so it is safe for untrusted input.
+    :param source: expression to parse
+    :param locales: locales whose spellings of the functions are understood (see tokenizer.SYNONYMS)
+    :raises SympifyError: if the expression can't be parsed, or it isn't a mathematical expression
+    """
+    return _parseNormalized(_normalize(source, locales))
+
+
+def treeSize(expr: Expr) -> int:
+    """
+    :return: number of nodes of the expression's tree, a measure of how expensive it is to work with it
+    """
+    return sum(1 for _ in preorder_traversal(expr))
+
+
+class DerivativeTower:
+    """
+    Successive derivatives of a function with respect to one variable. Each order is calculated from the previous one
+    (so asking for the 5th derivative after the 4th only differentiates once) and optionally simplified before it is
+    stored, to keep the expressions from growing with every order.
+    """
+
+    def __init__(self, expr: Expr, symbol: Symbol, simplifier=None):
+        """
+        :param expr: function to derive
+        :param symbol: variable to derive with respect to
+        :param simplifier: optional function applied to every order before it is stored (i.e. sympy's cancel)
+        """
+        self.symbol = symbol
+        self.simplifier = simplifier
+        self.orders = [expr]    # orders[k] is the kth derivative
+        self.metrics = [{"order": 0, "nodes": treeSize(expr), "diffTime": 0.0, "simplifyTime": 0.0}]
+        self.lock = threading.Lock()
+
+    @property
+    def highest(self) -> int:
+        """
+        Highest order calculated so far
+        """
+        return len(self.orders) - 1
+
+    def seed(self, order: int, derivative: Expr) -> None:
+        """
+        Stores a derivative that was calculated elsewhere (i.e. found in a cache), so the next orders are calculated
+        from it. The orders in between are left uncalculated, and it is ignored if it is not higher than the highest.
+        """
+        with self.lock:
+            if order > self.highest:
+                gap = [None] * (order - self.highest - 1)
+                self.orders.extend(gap + [derivative])
+                self.metrics.extend(gap + [{"order": order, "nodes": treeSize(derivative), "diffTime": 0.0,
+                                            "simplifyTime": 0.0}])
+
+    def get(self, order: int) -> Expr:
+        """
+        :return: the derivative of the given order, calculating the orders missing up to it
+        """
+        with self.lock:
+            if order <= self.highest and self.orders[order] is not None:
+                return self.orders[order]
+
+            # The lowest known order from which the requested one can be reached
+            start = order if order <= self.highest else self.highest
+            while self.orders[start] is None:
+                start -= 1
+
+            current = self.orders[start]
+            for k in range(start + 1, order + 1):
+                if k <= self.highest and self.orders[k] is not None:
+                    current = self.orders[k]
+                    continue
+
+                begin = time.perf_counter()
+                current = S.Zero if current == 0 else diff(current, self.symbol)
+                diffTime = time.perf_counter() - begin
+                simplifyTime = 0.0
+                if self.simplifier is not None and current != 0:
+                    begin = time.perf_counter()
+                    current = self.simplifier(current)
+                    simplifyTime = time.perf_counter() - begin
+                self._store(k, current, {"order": k, "nodes": treeSize(current), "diffTime": diffTime,
+                                         "simplifyTime": simplifyTime})
+            return current
+
+    def _store(self, order: int, derivative: Expr, metrics: dict) -> None:
+        if order > self.highest:
+            self.orders.append(derivative)
+            self.metrics.append(metrics)
+        else:
+            self.orders[order] = derivative
+            self.metrics[order] = metrics
+
+
+def _isFinite(value: Expr) -> bool:
+    return not value.has(S.NaN, S.ComplexInfinity, S.Infinity, S.NegativeInfinity)
+
+
+def _term(coefficient: Expr, power: Expr) -> Expr:
+    # Numbers times a sum are distributed (5*(x - 1) -> 5*x - 5), which would hide the point of the expansion
+    if coefficient.is_Number and power.is_Add and coefficient != 1:
+        return Mul(coefficient, power, evaluate=False)
+    return coefficient * power
+
+
+class SeriesExpansion:
+    """
+    Taylor (or Laurent) expansion of a function around a point, calculated term by term: asking for more terms after
+    some were calculated only calculates the new ones. The Taylor coefficients are the derivatives of a DerivativeTower
+    at the point (divided by k!), so they share the derivatives already calculated for the function. Where the
+    function isn't analytic (poles, removable singularities, expansions around infinity) the terms are drawn from
+    sympy's lazy lseries generator instead, which may also give fractional powers (Puiseux series).
+    """
+
+    def __init__(self, expr: Expr, symbol: Symbol, point=S.Zero, tower: DerivativeTower = None):
+        """
+        :param expr: function to expand
+        :param symbol: variable of the expansion
+        :param point: point the function is expanded around (oo or -oo for an asymptotic expansion in 1/symbol)
+        :param tower: derivatives of the function with respect to the variable, a new tower by default
+        """
+        self.expr = expr
+        self.symbol = symbol
+        self.point = sympify(point)
+        self.tower = tower if tower is not None else DerivativeTower(expr, symbol)
+        self.infinite = self.point in (oo, -oo)
+        self.h = Dummy("h")     # Variable of the expansion: symbol - point, or 1/symbol around infinity
+
+        self.terms = {}         # exponent of h -> coefficient, only the ones that aren't 0
+        self.order = 0          # Every term whose exponent is lower than this one is known
+        self.kind = "taylor"
+        self._generator = None
+        self._pending = None    # Next term of the generator, which wasn't needed yet
+        self.lock = threading.Lock()
+
+        if self.infinite or not _isFinite(expr.subs(symbol, self.point)):
+            self._startLaurent()
+
+    def _startLaurent(self) -> None:
+        self.kind = "laurent"
+        self.terms = {}
+        self.order = -oo
+        substituted = self.expr.subs(self.symbol, (1 if self.point == oo else -1) / self.h if self.infinite
+                                     else self.point + self.h)
+        self._generator = substituted.lseries(self.h, 0)
+        self._pending = None
+
+    def _split(self, term: Expr) -> tuple:
+        # (coefficient, exponent) of a term of the generator; as_coeff_exponent gives up on terms like h*log(h)
+        coefficient, exponent = S.One, S.Zero
+        for factor in Mul.make_args(term):
+            base, power = factor.as_base_exp()
+            if base == self.h:
+                exponent += power
+            else:
+                coefficient *= factor
+        return coefficient, exponent
+
+    def extend(self, order: int) -> "SeriesExpansion":
+        """
+        Calculates the terms whose exponent is lower than the order, if they weren't calculated yet
+        """
+        with self.lock:
+            if self.order == oo:
+                return self
+            if self.kind == "taylor":
+                for k in range(self.order, order):
+                    derivative = self.tower.get(k)
+                    if derivative == 0:     # So are the next ones, the expansion is exact (i.e. a polynomial)
+                        self.order = oo
+                        return self
+                    coefficient = derivative.subs(self.symbol, self.point) / factorial(k)
+                    if not _isFinite(coefficient):  # Not analytic there after all (i.e. sqrt(x) around 0)
+                        self._startLaurent()
+                        break
+                    if coefficient != 0:
+                        self.terms[S(k)] = coefficient
+                    self.order = k + 1
+                else:
+                    return self
+
+            while self.order < order:
+                if self._pending is None:
+                    try:
+                        term = next(self._generator)
+                    except StopIteration:   # The expansion is exact (i.e. a polynomial)
+                        self.order = oo
+                        break
+                    self._pending = [self._split(arg) for arg in Add.make_args(term.expand())]
+                if min(exponent for _, exponent in self._pending) >= order:
+                    self.order = order
+                    break
+                for coefficient, exponent in self._pending:
+                    self.terms[exponent] = self.terms.get(exponent, S.Zero) + coefficient
+                self._pending = None
+        return self
+
+    def coefficients(self, order: int) -> list:
+        """
+        :return: the (exponent, coefficient) pairs of the terms whose exponent is lower than the order, in order of
+        exponent (exponents of symbol - point, or of 1/symbol around infinity)
+        """
+        self.extend(order)
+        return sorted((exponent, coefficient) for exponent, coefficient in self.terms.items()
+                      if exponent < order and coefficient != 0)
+
+    def _variable(self) -> Expr:
+        if self.infinite:
+            return (1 if self.point == oo else -1) / self.symbol
+        return self.symbol - self.point
+
+    def polynomial(self, order: int) -> Expr:
+        """
+        :return: the expansion truncated before the given order, without its O() term
+        """
+        u = self._variable()
+        # Coefficients of Laurent series may still depend on the variable (i.e. the log(x) of an expansion around 0)
+        return Add(*(_term(coefficient.subs(self.h, u), u ** exponent)
+                     for exponent, coefficient in self.coefficients(order)))
+
+    def series(self, order: int) -> Expr:
+        """
+        :return: the expansion truncated before the given order, followed by the O() term of its order
+        """
+        polynomial = self.polynomial(order)
+        if self.order == oo:    # Nothing is left out
+            return polynomial
+        return polynomial + O(self._variable() ** order, (self.symbol, self.point))
+
+    def horner(self, order: int) -> "HornerEvaluator":
+        """
+        :return: a HornerEvaluator of the expansion truncated before the given order
+        :raises ValueError: if it has fractional powers or logarithms, or coefficients that aren't real numbers
+        """
+        coefficients = self.coefficients(order)
+        if any(not exponent.is_integer or coefficient.has(self.h) for exponent, coefficient in coefficients):
+            raise ValueError("the expansion has fractional powers or logarithms, it isn't a power series")
+        if self.infinite:
+            raise ValueError("expansions around infinity can't be evaluated as polynomials")
+        if not coefficients:
+            return HornerEvaluator([0.0], 0, float(self.point))
+
+        lowest = int(coefficients[0][0])
+        values = [0.0] * (int(coefficients[-1][0]) - lowest + 1)
+        for exponent, coefficient in coefficients:
+            try:
+                values[int(exponent) - lowest] = float(coefficient)
+            except TypeError:
+                raise ValueError(f"the coefficient {coefficient} isn't a real number")
+        return HornerEvaluator(values, lowest, float(self.point))
+
+    def errorBounds(self, order: int, interval: tuple, samples: int = ERROR_SAMPLES) -> dict:
+        """
+        Estimates the error of the expansion truncated before the given order over an interval.
+        :param interval: (low, high) range of the variable
+        :return: dictionary with the largest error 'observed' between the function and the truncated expansion (at
+        evenly spaced samples of the interval), and, for Taylor expansions, the 'lagrange' bound of the remainder:
+        max |f^(order)| / order! * max |x - point|^order, with the maximum of the derivative taken over the samples
+        of the interval and the point (None for Laurent expansions)
+        """
+        low, high = float(interval[0]), float(interval[1])
+        xs = np.linspace(low, high, samples)
+        exact = lambdify([self.symbol], self.expr, modules="numpy")
+        with np.errstate(all="ignore"):
+            errors = np.abs(np.broadcast_to(exact(xs), xs.shape) - self.horner(order)(xs))
+        finite = errors[np.isfinite(errors)]
+        bounds = {"interval": (low, high), "observed": float(finite.max()) if finite.size else float("nan"),
+                  "lagrange": None}
+
+        if self.kind == "taylor":
+            point = float(self.point)
+            hull = np.linspace(min(low, point), max(high, point), samples)
+            derivative = lambdify([self.symbol], self.tower.get(order), modules="numpy")
+            with np.errstate(all="ignore"):
+                maximum = float(np.nanmax(np.abs(np.broadcast_to(derivative(hull), hull.shape))))
+            radius = max(abs(low - point), abs(high - point))
+            bounds["lagrange"] = maximum / math.factorial(order) * radius ** order
+        return bounds
+
+
+class HornerEvaluator:
+    """
+    Truncated power (or Laurent) series evaluated with Horner's rule over NumPy arrays or numbers:
+    u**lowest * (c0 + u*(c1 + u*(c2 + ...))) with u = x - point. It only keeps floats, so it can be pickled (i.e. sent
+    back by an evaluation worker).
+    """
+
+    def __init__(self, coefficients: list, lowest: int, point: float):
+        """
+        :param coefficients: coefficients of u**lowest, u**(lowest + 1)...
+        :param lowest: exponent of the first coefficient (negative for Laurent series)
+        :param point: point the series is centered on
+        """
+        self.coefficients = [float(c) for c in coefficients]
+        self.lowest = lowest
+        self.point = point
+
+    def __call__(self, x):
+        u = np.asarray(x, dtype=float) - self.point
+        result = np.full_like(u, self.coefficients[-1])
+        for coefficient in reversed(self.coefficients[:-1]):
+            result = result * u + coefficient
+        return result * u ** float(self.lowest) if self.lowest else result
+
+    def source(self, name: str = "f", variable: str = "x", docstring: str = "") -> str:
+        """
+        :return: the source of a standalone Python function that evaluates the series the same way
+        """
+        nested = repr(self.coefficients[-1])
+        for coefficient in reversed(self.coefficients[:-1]):
+            nested = f"({nested})*u + {coefficient!r}"
+        value = f"u**{self.lowest} * ({nested})" if self.lowest else nested
+        lines = [f"def {name}({variable}):"]
+        if docstring:
+            lines.append(f'    """{docstring}"""')
+        lines += [f"    u = {variable} - {self.point!r}", f"    return {value}", ""]
+        return "\n".join(lines)
+
+    def __repr__(self) -> str:
+        return f"HornerEvaluator(degree={len(self.coefficients) - 1}, lowest={self.lowest}, point={self.point})"
+
+
+class CompiledExpression:
+    """
+    A function parsed once, along with everything that is derived from it (derivatives, compiled numeric functions,
+    pretty-printed form), which is calculated the first time it is needed and reused afterwards.
+    Use compileExpression to create them, so that the same function is shared by every window of the session.
+    """
+
+    def __init__(self, source: str, locales: tuple = tokenizer.DEFAULT_LOCALES):
+        """
+        :param source: function, as written by the user
+        :param locales: locales whose spellings of the functions are understood (see tokenizer.SYNONYMS)
+        :raises SympifyError: if the function can't be parsed
+        """
+        self.source = source
+        with instrumentation.stage("preCalc"):
+            self.normalized = _normalize(source, locales)
+        with instrumentation.stage("sympify"):
+            self.expr = _parseNormalized(self.normalized)
+        self.freeSymbols = frozenset(str(symbol) for symbol in self.expr.free_symbols)
+
+        self._towers = {}       # (variable, simplifier) -> DerivativeTower
+        self._expansions = {}   # (variable, point, simplifier) -> SeriesExpansion
+        self._numeric = {}      # (variables, modules) -> compiled function
+        self._pretty = None
+
+    def symbol(self, variable: str = None) -> Symbol:
+        """
+        :param variable: name of the variable, None for the only variable of the function
+        :return: the sympy Symbol of the variable, or None if the function is constant and no variable was given
+        :raises ValueError: if no variable was given and the function has more than one
+        """
+        if variable is not None:
+            return Symbol(variable.strip())
+        if len(self.freeSymbols) > 1:
+            raise ValueError(f"the function has several variables ({', '.join(sorted(self.freeSymbols))}), "
+                             "one of them must be specified")
+        return Symbol(next(iter(self.freeSymbols))) if self.freeSymbols else None
+
+    def tower(self, variable: str = None, simplifier=None) -> DerivativeTower:
+        """
+        :param variable: variable to derive with respect to, None for the only variable of the function
+        :param simplifier: function applied to every order (see DerivativeTower), each one has its own tower
+        :return: the derivatives of the function with respect to the variable (None if the function is constant and
+        no variable was given)
+        :raises ValueError: if no variable was given and the function has more than one
+        """
+        symbol = self.symbol(variable)
+        if symbol is None:
+            return None
+
+        key = (str(symbol), simplifier)
+        if key not in self._towers:
+            self._towers.setdefault(key, DerivativeTower(self.expr, symbol, simplifier))
+        return self._towers[key]
+
+    def derivative(self, variable: str = None, order: int = 1, simplifier=None) -> Expr:
+        """
+        :param variable: variable to derive with respect to, None for the only variable of the function
+        :param order: order of the derivative (i.e. 2 for the second derivative)
+        :param simplifier: function applied to every order (see DerivativeTower)
+        :return: the derivative (the function itself for order 0)
+        :raises ValueError: if no variable was given and the function has more than one
+        """
+        tower = self.tower(variable, simplifier)
+        if order == 0:
+            return self.expr
+        return S.Zero if tower is None else tower.get(order)
+
+    def expansion(self, variable: str = None, point=S.Zero, simplifier=None) -> SeriesExpansion:
+        """
+        :param variable: variable of the expansion, None for the only variable of the function
+        :param point: point the function is expanded around
+        :param simplifier: function applied to every derivative (see DerivativeTower)
+        :return: the expansion of the function around the point, which shares its derivatives with the tower of the
+        same variable and simplifier
+        :raises ValueError: if no variable was given and the function has more than one
+        """
+        symbol = self.symbol(variable) or Symbol("x")   # Constant functions are expanded in any variable
+        point = parse(point) if isinstance(point, str) else sympify(point)
+        key = (str(symbol), point, simplifier)
+        if key not in self._expansions:
+            tower = self.tower(str(symbol), simplifier)
+            self._expansions.setdefault(key, SeriesExpansion(self.expr, symbol, point, tower))
+        return self._expansions[key]
+
+    def numeric(self, variables: list, modules: str = "numpy"):
+        """
+        :param variables: names of the variables, in the order the compiled function will receive them
+        :param modules: module used for the evaluation ("numpy" for whole arrays, "mpmath" for arbitrary precision)
+        :return: the function compiled with sympy's lambdify
+        """
+        key = (tuple(variables), modules)
+        if key not in self._numeric:
+            self._numeric[key] = lambdify([Symbol(v) for v in variables], self.expr, modules=modules)
+        return self._numeric[key]
+
+    @property
+    def pretty(self) -> str:
+        """
+        The function written to be displayed (see tokenizer.prettify)
+        """
+        if self._pretty is None:
+            self._pretty = tokenizer.prettify(str(self.expr))
+        return self._pretty
+
+    def __repr__(self) -> str:
+        return f"CompiledExpression({self.source!r})"
+
+
+_expressions = collections.OrderedDict()    # key -> CompiledExpression, the most recently used at the end
+_lock = threading.Lock()
+
+
+def compileExpression(source: str, locales: tuple = tokenizer.DEFAULT_LOCALES) -> CompiledExpression:
+    """
+    Returns the compiled form of a function, parsing it only if it hadn't been compiled before in this process (the
+    functions that only differ in the way they are written, like "5x" and "5*x", share it).
+    :param source: function, as written by the user
+    :param locales: locales whose spellings of the functions are understood (see tokenizer.SYNONYMS)
+    :return: the CompiledExpression
+    :raises SympifyError: if the function can't be parsed
+    """
+    key = ("".join(_normalize(source, locales).split()), tuple(locales))
+    with _lock:
+        if key in _expressions:
+            _expressions.move_to_end(key)
+            return _expressions[key]
+
+    compiled = CompiledExpression(str(source), locales)
+    with _lock:
+        compiled = _expressions.setdefault(key, compiled)
+        while len(_expressions) > MAX_EXPRESSIONS:
+            _expressions.popitem(last=False)
+    return compiled
+
+
+def clearExpressions() -> None:
+    with _lock:
+        _expressions.clear()
@@ -1,16 +1,408 @@
+import time
+
+import mpmath
+import numpy as np
 from sympy.core.sympify import SympifyError
-from sympy.plotting import plot3d
-from sympy.plotting import plot as plot2d
+from sympy.plotting.plot import List2DSeries, SurfaceBaseSeries
+from sympy.plotting.plot import Plot as SeriesPlot
 from sympy.plotting.pygletplot import PygletPlot as Plot
 
+import expression
+import metrics
+
+DEFAULT_SAMPLES_2D = 1000
+
+# Adaptive sampling of 2D plots (see sampleAdaptive2d)
+DEFAULT_MAX_POINTS_2D = 2000
+ADAPTIVE_INITIAL_POINTS = 65
+ADAPTIVE_TOLERANCE = 1e-3       # Maximum deviation from a straight segment, relative to the height of the function
+ADAPTIVE_MAX_DEPTH = 14         # Maximum times the initial intervals can be halved
+JUMP_TOLERANCE = 0.05           # Minimum jump (relative to the height of the function) considered a discontinuity
+
+# Points per axis of the 3D meshes
+DEFAULT_RESOLUTION_3D = 50
+PREVIEW_RESOLUTION_3D = 15
+
+
+def compileFunction(func: str, variables: list) -> tuple:
+    """
+    Parses a function and compiles it once (see expression.compileExpression), both to a NumPy function (that
+    evaluates whole arrays in a single call) and to an mpmath function (slower, but able to evaluate the points where
+    NumPy fails).
+    :param func: mathematical function to compile
+    :param variables: names of the variables of the function, in the order the compiled functions will receive them
+    :return: a tuple (numpyFunction, mpmathFunction, expression)
+    """
+    compiled = expression.compileExpression(func)
+    unknown = compiled.freeSymbols - set(variables)
+    if unknown:
+        raise ValueError(f"unknown variables {', '.join(sorted(unknown))}")
+
+    return compiled.numeric(variables, modules="numpy"), compiled.numeric(variables, modules="mpmath"), compiled.expr
+
+
+def _realValues(values, shape: tuple) -> np.ndarray:
+    """
+    Turns what a compiled function returned into a float array of the given shape, where the points that are not real
+    numbers are NaN (which matplotlib leaves as gaps).
+    """
+    values = np.broadcast_to(np.asarray(values, dtype=complex), shape)
+    real = values.real.copy()
+    real[np.abs(values.imag) > 1e-12 * np.maximum(1, np.abs(values.real))] = np.nan
+    real[~np.isfinite(real)] = np.nan
+    return real
+
+
+def evaluateFunction(numeric, precise, *arrays) -> (np.ndarray, int):
+    """
+    Evaluates a compiled function over whole arrays in a single vectorized call. The points where NumPy fails (it
+    overflows, or the function raises) are evaluated again, one by one, with mpmath.
+    :param numeric: NumPy version of the function (see compileFunction)
+    :param precise: mpmath version of the function (see compileFunction), None to leave the points where NumPy fails
+    as NaN
+    :param arrays: values of each of the variables, all of them of the same shape
+    :return: the values of the function (NaN where it is not defined), along with the number of points that needed
+    the mpmath fallback
+    """
+    shape = np.shape(arrays[0])
+    with np.errstate(all="ignore"):
+        try:
+            values = _realValues(numeric(*arrays), shape)
+        except Exception:   # i.e. functions that only exist in sympy
+            values = np.full(shape, np.nan)
+
+    if precise is None:
+        return values, 0
+
+    failed = np.argwhere(np.isnan(values))
+    for index in map(tuple, failed):
+        try:
+            value = complex(precise(*(float(array[index]) for array in arrays)))
+        except (ValueError, TypeError, ZeroDivisionError, OverflowError):
+            continue
+        if abs(value.imag) <= 1e-12 * max(1.0, abs(value.real)) and mpmath.isfinite(value.real):
+            values[index] = value.real
+
+    return values, len(failed)
+
+
+def sampleFunction2d(func: str, inTermsOf: str, visionRange: tuple, samples: int = DEFAULT_SAMPLES_2D) -> tuple:
+    """
+    Samples a function of one variable over a range, compiling it once and evaluating every sample in one call.
+    :param func: mathematical function to sample
+    :param inTermsOf: variable used by the function
+    :param visionRange: range (min, max) to sample
+    :param samples: number of (evenly spaced) samples
+    :return: a tuple (xs, ys, stats) where stats is a dictionary with the number of 'samples', the 'fallbackPoints'
+    evaluated with mpmath and the seconds spent compiling ('compileTime') and evaluating ('evalTime') the function
+    """
+    start = time.perf_counter()
+    numeric, precise, _ = compileFunction(func, [inTermsOf])
+    compiled = time.perf_counter()
+
+    xs = np.linspace(float(expression.parse(visionRange[0])), float(expression.parse(visionRange[1])), samples)
+    ys, fallbackPoints = evaluateFunction(numeric, precise, xs)
+    evaluated = time.perf_counter()
+
+    return xs, ys, {"samples": samples, "fallbackPoints": fallbackPoints,
+                    "compileTime": compiled - start, "evalTime": evaluated - compiled}
+
+
+def _robustView(ys: np.ndarray) -> (float, tuple):
+    """
+    :return: the height of the function ignoring its most extreme values (so that poles don't dominate it), along with
+    the band of values (min, max) worth showing
+    """
+    finite = ys[np.isfinite(ys)]
+    if finite.size == 0:
+        return 1.0, (-1.0, 1.0)
+    low, high = np.percentile(finite, [5, 95])
+    scale = float(high - low) if high - low > 0 else max(1.0, float(np.max(np.abs(finite))))
+    return scale, (max(float(np.min(finite)), low - scale), min(float(np.max(finite)), high + scale))
+
+
+def sampleAdaptive2d(func: str, inTermsOf: str, visionRange: tuple, maxPoints: int = DEFAULT_MAX_POINTS_2D,
+                     initialPoints: int = ADAPTIVE_INITIAL_POINTS, tolerance: float = ADAPTIVE_TOLERANCE) -> tuple:
+    """
+    Samples a function of one variable concentrating the points where it curves and around its discontinuities.
+    Starting from an even grid, every round halves (in a single vectorized evaluation) the intervals whose midpoint
+    deviates from a straight segment, that border a point where the function is not defined, or whose jump doesn't
+    shrink when halved (a pole or a jump). The intervals that still jump when they can't be halved any more are
+    discontinuities, and a NaN point is inserted in them so that the line is broken there instead of joining both
+    sides.
+    :param func: mathematical function to sample
+    :param inTermsOf: variable used by the function
+    :param visionRange: range (min, max) to sample
+    :param maxPoints: maximum number of points (the budget), no more intervals are halved once it is reached
+    :param initialPoints: number of points of the initial even grid
+    :param tolerance: maximum deviation from a straight segment, relative to the height of the function
+    :return: a tuple (xs, ys, stats) where stats is the point budget report: number of 'samples' (including the NaN
+    breaks), 'evaluations', refinement 'rounds', 'breaks' found, the 'budget', whether it was 'capped', the
+    'fallbackPoints' evaluated with mpmath, the seconds spent compiling ('compileTime') and evaluating ('evalTime'),
+    and the band of values worth showing ('view', which leaves out the top of the poles)
+    """
+    start = time.perf_counter()
+    numeric, precise, _ = compileFunction(func, [inTermsOf])
+    compiled = time.perf_counter()
+
+    low, high = float(expression.parse(visionRange[0])), float(expression.parse(visionRange[1]))
+    xs, ys, isBreak, stats = _refineAdaptive(numeric, precise, low, high, maxPoints, initialPoints, tolerance)
+    stats["compileTime"] = compiled - start
+    return xs, ys, stats
+
+
+def _refineAdaptive(numeric, precise, low: float, high: float, maxPoints: int, initialPoints: int,
+                    tolerance: float) -> tuple:
+    """
+    Adaptive sampling of a compiled function over [low, high] (see sampleAdaptive2d).
+    :return: a tuple (xs, ys, isBreak, stats), isBreak being True at the NaN points inserted at the discontinuities,
+    and stats the same as the ones of sampleAdaptive2d without the 'compileTime'
+    """
+    start = time.perf_counter()
+    xs = np.linspace(low, high, max(3, min(initialPoints, maxPoints)))
+    ys, fallbackPoints = evaluateFunction(numeric, precise, xs)
+    scale, view = _robustView(ys)
+    minWidth = (xs[1] - xs[0]) / 2 ** ADAPTIVE_MAX_DEPTH
+
+    refine = np.ones(len(xs) - 1, dtype=bool)      # Intervals to be halved in the next round
+    suspect = np.zeros(len(xs) - 1, dtype=bool)    # Intervals whose jump didn't shrink the last time they were halved
+    rounds = 0
+    capped = False
+
+    while refine.any():
+        room = maxPoints - len(xs)
+        if room <= 0:
+            capped = True
+            break
+
+        idx = np.nonzero(refine)[0]
+        if len(idx) > room:
+            # The widest intervals are the ones that benefit the most from the remaining budget
+            idx = np.sort(idx[np.argsort(xs[idx] - xs[idx + 1], kind="stable")[:room]])
+            capped = True
+
+        x0, x1, y0, y1 = xs[idx], xs[idx + 1], ys[idx], ys[idx + 1]
+        xm = (x0 + x1) / 2
+        ym, fallback = evaluateFunction(numeric, precise, xm)
+        fallbackPoints += fallback
+        rounds += 1
+
+        with np.errstate(invalid="ignore"):
+            # Curvature is only worth following while the function is on screen (not near the top of a pole)
+            visible = (np.fmax(y0, y1) >= view[0] - scale) & (np.fmin(y0, y1) <= view[1] + scale)
+            curved = visible & (np.abs(ym - (y0 + y1) / 2) > tolerance * scale)
+            parentJump = np.abs(y1 - y0)
+            bigJump = parentJump > JUMP_TOLERANCE * scale
+            leftJumps = bigJump & (np.abs(ym - y0) > 0.75 * parentJump)
+            rightJumps = bigJump & (np.abs(y1 - ym) > 0.75 * parentJump)
+
+        canHalve = (x1 - x0) / 2 > minWidth
+        leftEdge = np.isnan(y0) != np.isnan(ym)
+        rightEdge = np.isnan(ym) != np.isnan(y1)
+
+        refine[idx] = canHalve & (curved | leftEdge | leftJumps)
+        refine = np.insert(refine, idx + 1, canHalve & (curved | rightEdge | rightJumps))
+        suspect[idx] = leftJumps
+        suspect = np.insert(suspect, idx + 1, rightJumps)
+        xs = np.insert(xs, idx + 1, xm)
+        ys = np.insert(ys, idx + 1, ym)
+
+    evaluations = len(xs)
+    with np.errstate(invalid="ignore"):
+        # Only the jumps that were followed down to the narrowest interval, and that are not entirely off screen
+        # (like both sides of the top of a pole) are breaks
+        resolved = np.diff(xs) <= 2 * minWidth * (1 + 1e-9)
+        y0, y1 = ys[:-1], ys[1:]
+        offScreen = ((y0 > view[1] + scale) & (y1 > view[1] + scale)) | ((y0 < view[0] - scale) & (y1 < view[0] - scale))
+        breaks = np.nonzero(suspect & resolved & ~offScreen & (np.abs(y1 - y0) > JUMP_TOLERANCE * scale))[0]
+    xs = np.insert(xs, breaks + 1, (xs[breaks] + xs[breaks + 1]) / 2)
+    ys = np.insert(ys, breaks + 1, np.nan)
+    isBreak = np.zeros(len(xs), dtype=bool)
+    isBreak[breaks + 1 + np.arange(len(breaks))] = True
+
+    return xs, ys, isBreak, {"samples": len(xs), "evaluations": evaluations, "rounds": rounds, "breaks": len(breaks),
+                             "budget": maxPoints, "capped": capped, "fallbackPoints": fallbackPoints,
+                             "evalTime": time.perf_counter() - start, "view": view}
+
 
-def makeGraph2d(func: str, inTermsOf: str, visionRange: tuple, funcHue: str) -> (Plot, str):
+class Graph2dSession:
     """
-    Creates and returns a sympy.Plot object that represents the received function in 2D.
+    Samples of a function of one variable that are kept between graphs, so that drawing it again over another range
+    only samples the part of the range that wasn't sampled before (and drawing it over the same range, i.e. to change
+    its color, samples nothing). The function is compiled once, when the session is created.
+    """
+
+    # A zoomed in range with fewer samples than this is sampled again, otherwise the line would look jagged
+    MIN_VISIBLE_POINTS = ADAPTIVE_INITIAL_POINTS
+
+    def __init__(self, func: str, inTermsOf: str, maxPoints: int = DEFAULT_MAX_POINTS_2D,
+                 initialPoints: int = ADAPTIVE_INITIAL_POINTS, tolerance: float = ADAPTIVE_TOLERANCE):
+        """
+        :raises SympifyError, ValueError: if the function can't be compiled (see compileFunction)
+        """
+        self.func = func
+        self.inTermsOf = inTermsOf
+        self.maxPoints = maxPoints
+        self.initialPoints = initialPoints
+        self.tolerance = tolerance
+
+        start = time.perf_counter()
+        self.numeric, self.precise, _ = compileFunction(func, [inTermsOf])
+        self.compileTime = time.perf_counter() - start
+
+        self.xs = self.ys = self.isBreak = None
+        self.covered = None     # Range (min, max) of the samples kept
+
+    def matches(self, func: str, inTermsOf: str) -> bool:
+        return func == self.func and inTermsOf == self.inTermsOf
+
+    def _sample(self, low: float, high: float, maxPoints: int, totals: dict) -> tuple:
+        xs, ys, isBreak, stats = _refineAdaptive(self.numeric, self.precise, low, high, maxPoints,
+                                                 self.initialPoints, self.tolerance)
+        for name in ("evaluations", "rounds", "fallbackPoints", "evalTime"):
+            totals[name] += stats[name]
+        totals["capped"] = totals["capped"] or stats["capped"]
+        return xs, ys, isBreak
+
+    def sample(self, visionRange: tuple) -> tuple:
+        """
+        Samples the function over a range, reusing the samples kept from the previous ranges: only the parts of the
+        range outside of them are sampled (with a share of the point budget proportional to their width). The range
+        is sampled again from scratch if it doesn't overlap with them, or if it is so zoomed in that few of them are
+        in it.
+        :param visionRange: range (min, max) to sample
+        :return: a tuple (xs, ys, stats) like the one of sampleAdaptive2d, with the samples in the range. Its stats
+        only count the 'evaluations' made in this call, and also have the number of samples 'reused'.
+        """
+        low, high = sorted((float(expression.parse(visionRange[0])), float(expression.parse(visionRange[1]))))
+        totals = {"evaluations": 0, "rounds": 0, "fallbackPoints": 0, "evalTime": 0.0, "capped": False}
+        width = (high - low) or 1.0
+
+        if self.covered is None or high < self.covered[0] or low > self.covered[1]:
+            self.xs, self.ys, self.isBreak = self._sample(low, high, self.maxPoints, totals)
+            self.covered = (low, high)
+            reused = 0
+        else:
+            reused = np.count_nonzero((self.xs >= low) & (self.xs <= high) & ~self.isBreak)
+            if low < self.covered[0]:
+                budget = max(self.initialPoints, round(self.maxPoints * (self.covered[0] - low) / width))
+                xs, ys, isBreak = self._sample(low, self.covered[0], budget, totals)
+                # Its last sample is the first one kept
+                self.xs = np.concatenate((xs[:-1], self.xs))
+                self.ys = np.concatenate((ys[:-1], self.ys))
+                self.isBreak = np.concatenate((isBreak[:-1], self.isBreak))
+            if high > self.covered[1]:
+                budget = max(self.initialPoints, round(self.maxPoints * (high - self.covered[1]) / width))
+                xs, ys, isBreak = self._sample(self.covered[1], high, budget, totals)
+                self.xs = np.concatenate((self.xs, xs[1:]))
+                self.ys = np.concatenate((self.ys, ys[1:]))
+                self.isBreak = np.concatenate((self.isBreak, isBreak[1:]))
+            self.covered = (min(low, self.covered[0]), max(high, self.covered[1]))
+
+        visible = (self.xs >= low) & (self.xs <= high)
+        if np.count_nonzero(visible & ~self.isBreak) < self.MIN_VISIBLE_POINTS:
+            xs, ys, isBreak = self._sample(low, high, self.maxPoints, totals)
+            outside = ~visible
+            before = outside & (self.xs < low)
+            after = outside & (self.xs > high)
+            self.xs = np.concatenate((self.xs[before], xs, self.xs[after]))
+            self.ys = np.concatenate((self.ys[before], ys, self.ys[after]))
+            self.isBreak = np.concatenate((self.isBreak[before], isBreak, self.isBreak[after]))
+            visible = (self.xs >= low) & (self.xs <= high)
+            reused = 0
+
+        # The samples just outside of the range are included too, so that the line reaches its edges
+        visible[1:] |= visible[:-1]
+        visible[:-1] |= visible[1:].copy()
+        xs, ys = self.xs[visible], self.ys[visible]
+        stats = {"samples": len(xs), "reused": int(reused),
+                 "breaks": int(np.count_nonzero(self.isBreak[visible])), "budget": self.maxPoints,
+                 "compileTime": self.compileTime, "view": _robustView(ys)[1], **totals}
+        self.compileTime = 0.0     # Only reported by the first graph
+        return xs, ys, stats
+
+
+class MeshSurfaceSeries(SurfaceBaseSeries):
+    """
+    Surface whose meshes have already been evaluated, so sympy's backend draws them as they are instead of sampling
+    the function again.
+    """
+
+    def __init__(self, xMesh: np.ndarray, yMesh: np.ndarray, zMesh: np.ndarray, label: str = ""):
+        super().__init__()
+        self.xMesh = xMesh
+        self.yMesh = yMesh
+        self.zMesh = zMesh
+        self.label = label
+
+        self._xlim = (float(np.min(xMesh)), float(np.max(xMesh)))
+        self._ylim = (float(np.min(yMesh)), float(np.max(yMesh)))
+        if np.isnan(zMesh).all():
+            self._zlim = (-1.0, 1.0)
+        else:
+            self._zlim = (float(np.nanmin(zMesh)), float(np.nanmax(zMesh)))
+
+    def __str__(self) -> str:
+        return f"mesh surface {self.label}"
+
+    def get_meshes(self) -> tuple:
+        return self.xMesh, self.yMesh, self.zMesh
+
+
+def sampleFunction3d(func: str, inTermsOfX: str, inTermsOfY: str, visionRangeX: tuple, visionRangeY: tuple,
+                     resolutions: tuple = (DEFAULT_RESOLUTION_3D,)):
+    """
+    Samples a function of two variables over a grid, compiling it once and evaluating the whole mesh in a single
+    NumPy call. Several resolutions can be requested to refine the surface progressively (i.e. a coarse preview first
+    and the full resolution after), the function is only compiled for the first one.
+    :param func: mathematical function to sample
+    :param inTermsOfX: variable of the first axis
+    :param inTermsOfY: variable of the second axis
+    :param visionRangeX: range (min, max) of the first axis
+    :param visionRangeY: range (min, max) of the second axis
+    :param resolutions: points per axis of each of the meshes to produce, in order
+    :return: a generator of tuples (xMesh, yMesh, zMesh, stats), one for each resolution, where stats is a dictionary
+    with the 'resolution', the number of 'points', the 'fallbackPoints' evaluated with mpmath, the seconds spent
+    compiling ('compileTime', only in the first one) and evaluating ('evalTime') and the 'pointsPerSecond'
+    """
+    start = time.perf_counter()
+    numeric, precise, _ = compileFunction(func, [inTermsOfX, inTermsOfY])
+    compileTime = time.perf_counter() - start
+
+    xRange = (float(expression.parse(visionRangeX[0])), float(expression.parse(visionRangeX[1])))
+    yRange = (float(expression.parse(visionRangeY[0])), float(expression.parse(visionRangeY[1])))
+
+    for resolution in resolutions:
+        start = time.perf_counter()
+        xMesh, yMesh = np.meshgrid(np.linspace(*xRange, resolution), np.linspace(*yRange, resolution))
+        zMesh, fallbackPoints = evaluateFunction(numeric, precise, xMesh, yMesh)
+        evalTime = time.perf_counter() - start
+
+        yield xMesh, yMesh, zMesh, {"resolution": resolution, "points": zMesh.size, "fallbackPoints": fallbackPoints,
+                                    "compileTime": compileTime, "evalTime": evalTime,
+                                    "pointsPerSecond": zMesh.size / evalTime if evalTime > 0 else float("inf")}
+        compileTime = 0.0
+
+
+def _recordSampling(kind: str, seconds: float, points: int) -> None:
+    metrics.registry.observe("plot_seconds", seconds, {"kind": kind})
+    metrics.registry.inc("plot_points_total", {"kind": kind}, points)
+
+
+def makeGraph2d(func: str, inTermsOf: str, visionRange: tuple, funcHue: str, adaptive: bool = True,
+                session: Graph2dSession = None) -> (Plot, str):
+    """
+    Creates and returns a sympy.Plot object that represents the received function in 2D. The function is compiled
+    once and sampled with NumPy (see sampleAdaptive2d and sampleFunction2d), the number of samples and the time spent
+    are stored in the 'samplingStats' attribute of the Plot.
     :param func: mathematical function to draw
     :param inTermsOf: variable used by the function
     :param visionRange: range (min, max) where the function will be represented.
     :param funcHue: hue (color) in which the function will be drawn
+    :param adaptive: True to concentrate the samples where the function curves and breaks (see sampleAdaptive2d), or
+    False to sample it evenly
+    :param session: Graph2dSession of a previous graph (its 'session' attribute). If it is of the same function, its
+    samples are reused (see Graph2dSession.sample), so changing only the range or the color is almost instant.
     :return: a tuple containing the generated sympy.Plot object (if possible), and a string that will contain the error
     message produced if said Plot object could not be created.
     """
@@ -31,41 +423,111 @@ def makeGraph2d(func: str, inTermsOf: str, visionRange: tuple, funcHue: str) ->
             return None, \
                 "An error occurred | The function should be\nin terms of a variable, not a number"
 
+        start = time.perf_counter()
         try:
-            p = plot2d(func, (inTermsOf, visionRange[0], visionRange[1]), show=False, line_color=funcHue)
+            if adaptive:
+                if session is None or not session.matches(func, inTermsOf):
+                    session = Graph2dSession(func, inTermsOf)
+                xs, ys, stats = session.sample(visionRange)
+            else:
+                xs, ys, stats = sampleFunction2d(func, inTermsOf, visionRange)
         except SympifyError:
             return None, "An error occurred | Multiplications should be\ndenoted by '*' (i.e. 5*x, not 5x)"
+        except ValueError as e:
+            return None, f"An error occurred | The function contains {e}"
+
+        _recordSampling("2d", time.perf_counter() - start, stats.get("evaluations", stats["samples"]))
+
+        series = List2DSeries(xs, ys)
+        series.label = func
+        series.line_color = funcHue
+        ylim = None
+        if stats.get("breaks"):
+            # Leaves the top of the poles out of the picture, otherwise the rest of the function would look flat
+            margin = (stats["view"][1] - stats["view"][0]) * 0.1
+            ylim = (stats["view"][0] - margin, stats["view"][1] + margin)
+        p = SeriesPlot(series, xlabel=inTermsOf, ylabel=f"f({inTermsOf})", ylim=ylim, show=False)
+        p.samplingStats = stats     # Sample count and timings, so they can be reported
+        p.session = session if adaptive else None
 
         return p, "Graph created successfully"
 
 
-def makeGraph3d(func: str, inTermsOfX: str, inTermsOfY: str, visionRangeX: tuple, visionRangeY: tuple) -> (Plot, str):
+def makeGraph3d(func: str, inTermsOfX: str, inTermsOfY: str, visionRangeX: tuple, visionRangeY: tuple,
+                resolution: int = DEFAULT_RESOLUTION_3D) -> (Plot, str):
     """
-    Creates and returns a sympy.Plot object that represents the received function in 2D.
+    Creates and returns a sympy.Plot object that represents the received function in 3D. The whole mesh is evaluated
+    in a single NumPy call (see sampleFunction3d), the number of points and the time spent are stored in the
+    'samplingStats' attribute of the Plot.
     :param func: mathematical function to draw
     :param inTermsOfX: variable used by the function in the first axis
     :param inTermsOfY: variable used by the function in the second axis
     :param visionRangeX: range (min, max) where the function will be represented for the first variable's axis.
     :param visionRangeY: range (min, max) where the function will be represented for the second variable's axis.
+    :param resolution: number of points per axis of the mesh
     :return: a tuple containing the generated sympy.Plot object (if possible), and a string that will contain the error
     message produced if said Plot object could not be created.
     """
+    return next(makeGraph3dLevels(func, inTermsOfX, inTermsOfY, visionRangeX, visionRangeY, (resolution,)))
+
 
+def makeGraph3dLevels(func: str, inTermsOfX: str, inTermsOfY: str, visionRangeX: tuple, visionRangeY: tuple,
+                      resolutions: tuple = (PREVIEW_RESOLUTION_3D, DEFAULT_RESOLUTION_3D)):
+    """
+    Same as makeGraph3d, but drawing the surface at several resolutions (i.e. a coarse preview first and the full
+    resolution after). The function is only compiled once, and each graph is made as soon as its mesh is sampled.
+    :param resolutions: number of points per axis of each of the meshes, in order
+    :return: a generator of (sympy.Plot, message) tuples, one per resolution, or of a single (None, error message)
+    tuple if the graph could not be created
+    """
     if not func.__contains__(inTermsOfX) and not func.__contains__(inTermsOfY):
-        return None, "An error occurred | " \
-                     "An error occurred, the function doesn't\ncontain the variable specified for X or Y"
+        yield None, "An error occurred | " \
+                    "An error occurred, the function doesn't\ncontain the variable specified for X or Y"
+        return
+    try:
+        float(inTermsOfX)
+        float(inTermsOfY)
+    except ValueError:
+        pass
     else:
-        try:
-            float(inTermsOfX)
-            float(inTermsOfY)
-        except ValueError:
-            pass
-        else:
-            return None, \
-                "An error occurred | An error occurred, the function should be\nin terms of a variable, not a number"
+        yield None, \
+            "An error occurred | An error occurred, the function should be\nin terms of a variable, not a number"
+        return
+
+    for level in surfaceLevels(func, inTermsOfX, inTermsOfY, visionRangeX, visionRangeY, resolutions):
+        yield makeSurfacePlot(func, *level)
+
+
+def surfaceLevels(func: str, inTermsOfX: str, inTermsOfY: str, visionRangeX: tuple, visionRangeY: tuple,
+                  resolutions: tuple):
+    """
+    Wrapper of sampleFunction3d that catches the errors caused by the user's input.
+    :return: a generator of (xMesh, yMesh, zMesh, stats) tuples, one per resolution as soon as its mesh is sampled, or
+    of a single (None, error message) tuple if the function could not be sampled
+    """
+    try:
+        yield from sampleFunction3d(func, inTermsOfX, inTermsOfY, visionRangeX, visionRangeY, resolutions)
+    except SympifyError:
+        yield None, "An error occurred | Multiplications should be\ndenoted by '*' (i.e. 5*x, not 5x)"
+    except ValueError as e:
+        yield None, f"An error occurred | The function contains {e}"
+
+
+def makeSurfacePlot(func: str, xMesh: np.ndarray, yMesh: np.ndarray = None, zMesh: np.ndarray = None,
+                    stats: dict = None) -> (Plot, str):
+    """
+    Creates the sympy.Plot object for a surface sampled by sampleFunction3d.
+    :return: a tuple containing the generated sympy.Plot object (if possible), and a string that will contain the error
+    message produced if said Plot object could not be created (which is received in place of the xMesh when the
+    sampling failed).
+    """
+    if xMesh is None:
+        return None, yMesh
 
-    p = plot3d(func, (inTermsOfX, visionRangeX[0], visionRangeX[1]), (inTermsOfY, visionRangeY[0], visionRangeY[1]),
-               show=False)
+    if stats is not None:
+        _recordSampling("3d", stats["compileTime"] + stats["evalTime"], stats["points"])
+    p = SeriesPlot(MeshSurfaceSeries(xMesh, yMesh, zMesh, label=func), show=False)
+    p.samplingStats = stats     # Point count and timings, so they can be reported
 
     return p, "Graph created successfully"
 
@@ -0,0 +1,343 @@
+"""
+Timing of the stages of every operation (parsing, differentiating, simplifying, updating the labels...) and profiling
+of single calculations.
+
+    with instrumentation.operation("differential"):
+        with instrumentation.stage("sympify"):
+            ...
+
+Stages are recorded under the innermost operation being run in the thread, in a histogram per (operation, stage).
+Instrumentation is off unless CALC_INSTRUMENT is set (to anything but 0/false/no) or setEnabled(True) is called, and
+while it is off operation() and stage() return the same object that does nothing, so they can stay in the code.
+The stages timed in the evaluation workers are sent back with the results and added to the histograms of the process
+that submitted them (see evaluation.WorkerPool).
+"""
+import bisect
+import collections
+import functools
+import io
+import os
+import sys
+import threading
+import time
+
+ENV_VAR = "CALC_INSTRUMENT"
+
+# Directory where the evaluation workers write a profile of every job they run, if it is set (see evaluation.WorkerPool)
+PROFILE_DIR_ENV_VAR = "CALC_PROFILE_DIR"
+
+# Upper bounds (in ms) of the buckets of the histograms, the last one catches everything slower
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+
+# Seconds between the samples taken by a Profiler in "sampling" mode
+DEFAULT_SAMPLE_INTERVAL = 0.001
+
+PROFILE_MODES = ("cprofile", "sampling")
+
+enabled = os.environ.get(ENV_VAR, "").strip().lower() not in ("", "0", "false", "no")
+
+_histograms = {}    # (operation, stage) -> Histogram
+_lock = threading.Lock()
+_local = threading.local()  # operations: stack of the operations being run, trace: list where stages are copied to
+
+
+class Histogram:
+    """
+    Distribution of the durations of a stage, in the buckets of BUCKETS_MS
+    """
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS_MS)
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS_MS, seconds * 1000)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> float:
+        """
+        :param q: percentile, from 0 to 100
+        :return: an estimate of the percentile in seconds (the upper bound of its bucket, or the maximum if lower)
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(bound / 1000, self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {"count": self.count, "total": self.total, "mean": self.total / self.count if self.count else 0.0,
+                "min": self.min if self.count else 0.0, "max": self.max, "p50": self.percentile(50),
+                "p90": self.percentile(90), "p99": self.percentile(99),
+                "buckets": dict(zip(BUCKETS_MS, self.counts))}
+
+
+def setEnabled(on: bool) -> None:
+    global enabled
+    enabled = bool(on)
+
+
+def isEnabled() -> bool:
+    return enabled
+
+
+class _Nothing:
+    """
+    What operation() and stage() return while instrumentation is off
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+
+_NOTHING = _Nothing()
+
+
+class _Stage:
+    def __init__(self, name: str):
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        operations = getattr(_local, "operations", None)
+        record(operations[-1] if operations else "other", self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _Operation(_Stage):
+    def __init__(self, name: str, recordTotal: bool = True):
+        super().__init__(name)
+        self.recordTotal = recordTotal
+
+    def __enter__(self):
+        if not hasattr(_local, "operations"):
+            _local.operations = []
+        _local.operations.append(self.name)
+        return super().__enter__()
+
+    def __exit__(self, *exc) -> bool:
+        _local.operations.pop()
+        if self.recordTotal:
+            record(self.name, "total", time.perf_counter() - self.start)
+        return False
+
+
+def operation(name: str, recordTotal: bool = True):
+    """
+    :param recordTotal: False to only record the stages, i.e. for the part of an operation that is run in the GUI
+    after its "total" was recorded by a worker
+    :return: a context manager under which the stages are recorded as part of the operation (whose whole duration is
+    recorded as its "total" stage)
+    """
+    return _Operation(name, recordTotal) if enabled else _NOTHING
+
+
+def instrumented(operationName: str):
+    """
+    Decorator that runs every call of a function as an operation (see operation), if instrumentation is enabled
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with _Operation(operationName):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def stage(name: str):
+    """
+    :return: a context manager that records how long the code inside it takes, as a stage of the current operation
+    """
+    return _Stage(name) if enabled else _NOTHING
+
+
+def _observe(operationName: str, stageName: str, seconds: float) -> None:
+    with _lock:
+        histogram = _histograms.get((operationName, stageName))
+        if histogram is None:
+            histogram = _histograms[(operationName, stageName)] = Histogram()
+        histogram.observe(seconds)
+
+
+def record(operationName: str, stageName: str, seconds: float) -> None:
+    _observe(operationName, stageName, seconds)
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace.append((operationName, stageName, seconds))
+
+
+def startTrace() -> None:
+    """
+    Starts keeping a copy of the stages recorded by this thread (i.e. for a single job), until stopTrace is called
+    """
+    _local.trace = []
+
+
+def stopTrace() -> list:
+    """
+    :return: the (operation, stage, seconds) tuples recorded since startTrace
+    """
+    trace = getattr(_local, "trace", None) or []
+    _local.trace = None
+    return trace
+
+
+def merge(trace: list) -> None:
+    """
+    Adds the stages recorded somewhere else (i.e. by a worker process, see stopTrace) to the histograms
+    """
+    for operationName, stageName, seconds in trace or ():
+        _observe(operationName, stageName, seconds)
+
+
+def snapshot() -> dict:
+    """
+    :return: dictionary of operation -> stage -> statistics of the stage (see Histogram.snapshot), in seconds
+    """
+    with _lock:
+        result = collections.defaultdict(dict)
+        for (operationName, stageName), histogram in sorted(_histograms.items()):
+            result[operationName][stageName] = histogram.snapshot()
+    return dict(result)
+
+
+def histograms() -> dict:
+    """
+    :return: dictionary of (operation, stage) -> its Histogram (see metrics.py)
+    """
+    with _lock:
+        return dict(_histograms)
+
+
+def reset() -> None:
+    with _lock:
+        _histograms.clear()
+
+
+def report() -> str:
+    """
+    :return: a table with the count and the latency percentiles of every stage of every operation
+    """
+    lines = [f"{'operation':<20} {'stage':<14} {'count':>6} {'mean ms':>9} {'p50 ms':>9} {'p90 ms':>9} {'max ms':>9}"]
+    for operationName, stages in snapshot().items():
+        for stageName, stats in stages.items():
+            lines.append(f"{operationName:<20} {stageName:<14} {stats['count']:>6} {stats['mean'] * 1000:>9.2f} "
+                         f"{stats['p50'] * 1000:>9.2f} {stats['p90'] * 1000:>9.2f} {stats['max'] * 1000:>9.2f}")
+    return "\n".join(lines) if len(lines) > 1 else "Nothing has been recorded yet"
+
+
+class Profiler:
+    """
+    Profiles the code run inside it (in the thread that enters it), either with cProfile ("cprofile" mode, whose
+    output are pstats files) or by sampling the stack every few milliseconds ("sampling" mode, whose output are folded
+    stacks, the format read by flamegraph.pl and speedscope).
+    """
+
+    def __init__(self, mode: str = "cprofile", interval: float = DEFAULT_SAMPLE_INTERVAL):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profiling mode '{mode}', expected one of {PROFILE_MODES}")
+        self.mode = mode
+        self.interval = interval
+        self.profile = None
+        self.stacks = collections.Counter()     # folded stack -> number of samples
+        self.stopped = threading.Event()
+        self.sampler = None
+
+    def __enter__(self):
+        if self.mode == "cprofile":
+            import cProfile     # Only needed here, importing it (and pstats) slows down the start of the GUI
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            self.sampler = threading.Thread(target=self._sample, args=(threading.get_ident(),), name="profiler",
+                                            daemon=True)
+            self.sampler.start()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        if self.mode == "cprofile":
+            self.profile.disable()
+        else:
+            self.stopped.set()
+            self.sampler.join()
+        return False
+
+    def _sample(self, threadId: int) -> None:
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(threadId)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def folded(self) -> str:
+        """
+        :return: the samples as folded stacks (a line per stack, its frames separated by ';' and followed by the
+        number of samples)
+        """
+        if self.mode != "sampling":
+            raise ValueError("Folded stacks are only recorded in 'sampling' mode")
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def write(self, path: str) -> None:
+        """
+        Writes the profile to a file: a pstats file in "cprofile" mode, or folded stacks in "sampling" mode
+        """
+        if self.mode == "cprofile":
+            self.profile.dump_stats(path)
+        else:
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(self.folded())
+
+    def summary(self, top: int = 20) -> str:
+        """
+        :return: the functions where most time was spent (cumulative time in "cprofile" mode, samples in "sampling"
+        mode), as text
+        """
+        if self.mode == "sampling":
+            return "\n".join(self.folded().splitlines()[:top])
+        import pstats
+        stream = io.StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats("cumulative").print_stats(top)
+        return stream.getvalue()
+
+
+def profileCall(function, args: tuple = (), kwargs: dict = None, path: str = None, mode: str = None):
+    """
+    Runs a function under a Profiler and writes its profile to a file.
+    :param path: file where the profile is written
+    :param mode: one of PROFILE_MODES, by default "sampling" for paths ending in .folded or .txt and "cprofile" for
+    the rest
+    :return: what the function returned
+    """
+    if mode is None:
+        mode = "sampling" if path.lower().endswith((".folded", ".txt")) else "cprofile"
+    profiler = Profiler(mode)
+    try:
+        with profiler:
+            return function(*args, **(kwargs or {}))
+    finally:
+        profiler.write(path)
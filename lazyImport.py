@@ -0,0 +1,91 @@
+import importlib
+import subprocess
+import sys
+import threading
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is only imported the first time one of its attributes is used, so that heavy modules
+    (sympy, matplotlib...) don't delay the main menu. It can also be loaded in advance from another thread (see
+    prewarm).
+    """
+
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+        self.__dict__["_lock"] = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def load(self):
+        """
+        Imports the module (only the first time it is called) and returns it
+        """
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self.__dict__["_module"] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute: str):
+        return getattr(self.load(), attribute)
+
+    def __setattr__(self, attribute: str, value) -> None:
+        setattr(self.load(), attribute, value)
+
+    def __repr__(self) -> str:
+        return f"<lazy module '{self._name}' ({'loaded' if self.loaded else 'not loaded'})>"
+
+
+def prewarm(*modules: LazyModule, onDone=None) -> threading.Thread:
+    """
+    Loads lazy modules in a background thread, so that they are (usually) ready by the time they are needed.
+    :param modules: modules to be loaded, in order
+    :param onDone: optional function called (from the background thread) once all of them are loaded
+    :return: the thread, which has already been started
+    """
+    def loadAll():
+        for module in modules:
+            try:
+                module.load()
+            except Exception as e:  # The error will be raised again (where it can be handled) when the module is used
+                print(f"Could not prewarm '{module._name}': {e}")
+        if onDone is not None:
+            onDone()
+
+    thread = threading.Thread(target=loadAll, name="prewarm", daemon=True)
+    thread.start()
+    return thread
+
+
+def importTimeReport(moduleNames: list, top: int = 15) -> str:
+    """
+    Measures how long it takes to import some modules in a fresh interpreter (using python's '-X importtime') and
+    returns a breakdown of the slowest imports.
+    :param moduleNames: names of the modules to import
+    :param top: number of imports (the slowest, by cumulative time) to be listed
+    :return: the report, as text
+    """
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {', '.join(moduleNames)}"],
+                               capture_output=True, text=True)
+
+    entries = []    # (cumulative, self, depth, name)
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        selfUs, cumulativeUs, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((int(cumulativeUs), int(selfUs), depth, name.strip()))
+
+    total = sum(entry[1] for entry in entries)
+    lines = [f"Importing {', '.join(moduleNames)}: {total / 1000:.1f} ms in {len(entries)} modules"]
+    if completed.returncode != 0:
+        lines.append(completed.stderr.strip().splitlines()[-1])
+
+    lines.append(f"{'cumulative':>12} {'self':>10}  module")
+    for cumulativeUs, selfUs, depth, name in sorted(entries, reverse=True)[:top]:
+        lines.append(f"{cumulativeUs / 1000:>9.1f} ms {selfUs / 1000:>7.1f} ms  {'  ' * depth}{name}")
+    return "\n".join(lines)
@@ -0,0 +1,315 @@
+"""
+Metrics of the calculator (evaluations, their latency, the caches, the worker pools, the time spent drawing graphs...)
+exported in the Prometheus text format or as JSON.
+
+Every module records its metrics in the registry of its process (metrics.registry) as they happen; the state of the
+caches and the worker pools is read by collectors when the metrics are exported. What the evaluation workers record is
+sent back with the results of their jobs and added to the registry of the process that submitted them (see
+evaluation.WorkerPool), like the stages of instrumentation.py. The metrics can be:
+    - written to a file, i.e. for node_exporter's textfile collector (registry.writePrometheus, or CALC_METRICS_FILE)
+    - served over HTTP at /metrics (Prometheus) and /metrics.json (registry.serve, or CALC_METRICS_PORT)
+    - read as a dictionary (registry.snapshot)
+The calculation service (service.py) also serves them at the same paths.
+"""
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+import weakref
+
+import instrumentation
+
+FILE_ENV_VAR = "CALC_METRICS_FILE"
+PORT_ENV_VAR = "CALC_METRICS_PORT"
+WRITE_SECONDS = 15     # How often the metrics file is rewritten
+
+PREFIX = "calc_"
+
+# Type and description of every metric, by name (without the prefix)
+DESCRIPTIONS = {
+    "evaluations_total": ("counter", "Jobs evaluated by the worker pools, by operation and outcome"),
+    "evaluation_seconds": ("histogram", "Time the worker pools took to evaluate a job, by operation"),
+    "pool_workers": ("gauge", "Worker processes of each pool"),
+    "pool_busy_workers": ("gauge", "Worker processes evaluating a job"),
+    "pool_queue_depth": ("gauge", "Jobs waiting for a worker"),
+    "pool_jobs_total": ("counter", "Jobs handled by each pool, by what happened to them"),
+    "cache_hits_total": ("counter", "Lookups that found a result in the cache"),
+    "cache_misses_total": ("counter", "Lookups that didn't find a result in the cache"),
+    "cache_disk_hits_total": ("counter", "Lookups that found a result in the persistent tier of the cache"),
+    "cache_evictions_total": ("counter", "Results dropped from the cache to make room for others"),
+    "cache_entries": ("gauge", "Results kept in memory by the cache"),
+    "cache_bytes": ("gauge", "Size of the results kept in memory by the cache"),
+    "plot_seconds": ("histogram", "Time spent sampling graphs, by kind"),
+    "plot_points_total": ("counter", "Points evaluated to draw graphs, by kind"),
+    "render_seconds": ("histogram", "Time spent rendering graphs to images, by kind and format"),
+    "stage_seconds": ("histogram", "Time spent in every stage of every operation, while instrumentation is enabled"),
+    "service_requests_total": ("counter", "Requests received by the calculation service, by what happened to them"),
+    "service_request_seconds": ("histogram", "Time the calculation service took to answer a request, by operation "
+                                             "and HTTP status"),
+    "service_pending": ("gauge", "Requests being calculated by the calculation service"),
+}
+
+
+def _labelKey(labels: dict | None) -> tuple:
+    return tuple(sorted((str(name), str(value)) for name, value in (labels or {}).items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _formatLabels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}" if pairs else ""
+
+
+def _formatValue(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """
+    Counters, gauges and histograms (see instrumentation.Histogram) identified by their name and labels, plus the
+    collectors that report the ones that are read when they are exported.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}        # (name, labels) -> value of a counter or a gauge
+        self.histograms = {}    # (name, labels) -> Histogram
+        self.collectors = []    # functions (or weak references to methods) that return samples, see addCollector
+        self.local = threading.local()  # trace: list where the counters and histograms recorded are copied to
+
+    def inc(self, name: str, labels: dict = None, amount: float = 1) -> None:
+        key = (name, _labelKey(labels))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        trace = getattr(self.local, "trace", None)
+        if trace is not None:
+            trace.append(("inc", name, labels, amount))
+
+    def set(self, name: str, value: float, labels: dict = None) -> None:
+        with self.lock:
+            self.values[(name, _labelKey(labels))] = value
+
+    def observe(self, name: str, seconds: float, labels: dict = None) -> None:
+        key = (name, _labelKey(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = instrumentation.Histogram()
+            histogram.observe(seconds)
+        trace = getattr(self.local, "trace", None)
+        if trace is not None:
+            trace.append(("observe", name, labels, seconds))
+
+    def startTrace(self) -> None:
+        """
+        Starts keeping a copy of the counters and histograms recorded by this thread (i.e. for a single job), until
+        stopTrace is called. Gauges are not copied, they only describe the process where they are set.
+        """
+        self.local.trace = []
+
+    def stopTrace(self) -> list:
+        """
+        :return: the (method, name, labels, amount) tuples recorded since startTrace
+        """
+        trace = getattr(self.local, "trace", None) or []
+        self.local.trace = None
+        return trace
+
+    def merge(self, trace: list) -> None:
+        """
+        Records again what was recorded somewhere else (i.e. by a worker process, see stopTrace)
+        """
+        for method, name, labels, amount in trace or ():
+            if method == "observe":
+                self.observe(name, amount, labels)
+            else:
+                self.inc(name, labels, amount)
+
+    def addCollector(self, collector) -> None:
+        """
+        Adds a function that is called every time the metrics are exported, and that returns (name, labels, value)
+        tuples (value being a number, or a Histogram). Bound methods are only weakly referenced, so registering one
+        doesn't keep its object alive: it stops being collected once the object is gone.
+        """
+        with self.lock:
+            self.collectors.append(weakref.WeakMethod(collector) if hasattr(collector, "__self__") else collector)
+
+    def _collect(self) -> dict:
+        """
+        :return: dictionary of name -> list of (labels, value)
+        """
+        with self.lock:
+            samples = [(name, labels, value) for (name, labels), value in self.values.items()]
+            samples += [(name, labels, histogram) for (name, labels), histogram in self.histograms.items()]
+            collectors = list(self.collectors)
+
+        for collector in collectors:
+            function = collector() if isinstance(collector, weakref.WeakMethod) else collector
+            if function is None:    # Its object is gone
+                with self.lock:
+                    self.collectors.remove(collector)
+                continue
+            samples += [(name, _labelKey(labels), value) for name, labels, value in function()]
+
+        for (operationName, stageName), histogram in instrumentation.histograms().items():
+            samples.append(("stage_seconds", _labelKey({"operation": operationName, "stage": stageName}), histogram))
+
+        byName = {}
+        for name, labels, value in samples:
+            byName.setdefault(name, []).append((labels, value))
+        return dict(sorted(byName.items()))
+
+    def snapshot(self) -> dict:
+        """
+        :return: dictionary of metric name -> its 'type', 'help' and 'samples' (each of them with its 'labels' and its
+        'value', or the 'count', 'sum' and percentiles of a histogram)
+        """
+        result = {}
+        for name, samples in self._collect().items():
+            kind, text = DESCRIPTIONS.get(name, ("gauge", ""))
+            entries = []
+            for labels, value in samples:
+                entry = {"labels": dict(labels)}
+                if isinstance(value, instrumentation.Histogram):
+                    stats = value.snapshot()
+                    entry.update(count=stats["count"], sum=stats["total"], p50=stats["p50"], p90=stats["p90"],
+                                 p99=stats["p99"], max=stats["max"])
+                else:
+                    entry["value"] = value
+                entries.append(entry)
+            result[PREFIX + name] = {"type": kind, "help": text, "samples": entries}
+        return result
+
+    def prometheus(self) -> str:
+        """
+        :return: every metric in the Prometheus text exposition format
+        """
+        lines = []
+        for name, samples in self._collect().items():
+            kind, text = DESCRIPTIONS.get(name, ("gauge", ""))
+            fullName = PREFIX + name
+            lines.append(f"# HELP {fullName} {text}")
+            lines.append(f"# TYPE {fullName} {kind}")
+            for labels, value in samples:
+                if not isinstance(value, instrumentation.Histogram):
+                    lines.append(f"{fullName}{_formatLabels(labels)} {_formatValue(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(instrumentation.BUCKETS_MS, value.counts):
+                    cumulative += count
+                    le = _formatValue(bound / 1000 if bound != float("inf") else bound)
+                    lines.append(f"{fullName}_bucket{_formatLabels(labels, (('le', le),))} {cumulative}")
+                lines.append(f"{fullName}_sum{_formatLabels(labels)} {_formatValue(float(value.total))}")
+                lines.append(f"{fullName}_count{_formatLabels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+    def writePrometheus(self, path: str) -> None:
+        """
+        Writes the metrics to a file in the Prometheus text format. The file is replaced at once, so readers never
+        see it half-written.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(suffix=".prom", dir=directory)
+        try:
+            with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+                file.write(self.prometheus())
+            os.chmod(temporary, 0o644)
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+    def serve(self, host: str = "127.0.0.1", port: int = 0) -> "http.server.ThreadingHTTPServer":
+        """
+        Serves the metrics over HTTP from a background thread, at /metrics (Prometheus) and /metrics.json.
+        :param port: port to listen on (0 for any free one, see server.server_address)
+        :return: the server, which can be stopped with its shutdown method
+        """
+        import http.server  # Only needed here, importing it slows down the start of the GUI
+        registry = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path == "/metrics":
+                    body, contentType = registry.prometheus().encode("utf-8"), CONTENT_TYPE_PROMETHEUS
+                elif path == "/metrics.json":
+                    body, contentType = json.dumps(registry.snapshot()).encode("utf-8"), "application/json"
+                else:
+                    self.send_error(404, "Use /metrics or /metrics.json")
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", contentType)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):     # Scrapes are not worth a line in the console each
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        return server
+
+
+CONTENT_TYPE_PROMETHEUS = "text/plain; version=0.0.4; charset=utf-8"
+
+# Registry of this process
+registry = MetricsRegistry()
+
+
+class Timer:
+    """
+    Context manager that observes how long the code inside it takes in a histogram of the registry
+    """
+
+    def __init__(self, name: str, labels: dict = None):
+        self.name = name
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        registry.observe(self.name, time.perf_counter() - self.start, self.labels)
+        return False
+
+
+_exporting = False
+
+
+def exportFromEnvironment() -> None:
+    """
+    Starts exporting the metrics of this process as configured by the environment: rewriting CALC_METRICS_FILE every
+    WRITE_SECONDS (and at exit), and serving them on the port CALC_METRICS_PORT. Does nothing if neither is set, or
+    if it was already called.
+    """
+    global _exporting
+    if _exporting:
+        return
+    _exporting = True
+
+    port = os.environ.get(PORT_ENV_VAR)
+    if port:
+        registry.serve(port=int(port))
+
+    path = os.environ.get(FILE_ENV_VAR)
+    if path:
+        def writePeriodically():
+            while True:
+                time.sleep(WRITE_SECONDS)
+                registry.writePrometheus(path)
+
+        threading.Thread(target=writePeriodically, name="metrics-file", daemon=True).start()
+        atexit.register(registry.writePrometheus, path)
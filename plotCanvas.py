@@ -0,0 +1,177 @@
+"""
+Window with a matplotlib canvas embedded in tkinter, shared by every graph drawn from the GUI. It is created once and
+kept while it is open: drawing a new graph replaces the data of the line (or the surface) already on it instead of
+creating a new figure and a new window every time.
+"""
+import tkinter as tk
+
+import numpy as np
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+from matplotlib.figure import Figure
+
+import graphing
+import uiElements as ui
+
+FIGURE_SIZE = (6.4, 4.8)    # Inches
+FIGURE_DPI = 100
+SURFACE_COLORMAP = "viridis"
+
+
+class PlotWindow:
+    """
+    Toplevel window with a single matplotlib Figure drawn by a FigureCanvasTkAgg. Its axes are only recreated when
+    changing between 2D and 3D graphs, and redrawing only updates the data of the artists already on them.
+    """
+
+    _shared = None
+
+    @classmethod
+    def shared(cls) -> "PlotWindow":
+        """
+        :return: the plot window of the application, which is created again if it has been closed
+        """
+        if cls._shared is None or not cls._shared.isOpen():
+            cls._shared = cls()
+        return cls._shared
+
+    def __init__(self, title: str = "Graph"):
+        self.window = ui.newWindow()
+        self.window.title(title)
+        self.window.configure(bg=ui.WINDOW_BG)
+
+        self.figure = Figure(figsize=FIGURE_SIZE, dpi=FIGURE_DPI)
+        self.canvas = FigureCanvasTkAgg(self.figure, master=self.window)
+        self.toolbar = NavigationToolbar2Tk(self.canvas, self.window, pack_toolbar=False)
+        self.toolbar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+
+        self.axes = None
+        self.kind = None        # "2d" or "3d", the kind of graph the axes were made for
+        self.artist = None      # Line or surface currently drawn
+        self.resample = None    # Function (low, high) -> (xs, ys) for the line, called when the toolbar pans or zooms
+        self.pendingRange = None
+        self.drawing = False
+        self.stats = {"draws": 0, "inPlace": 0, "resamples": 0}
+
+        self.window.bind("<Escape>", lambda event: self.close())
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+    def isOpen(self) -> bool:
+        try:
+            return bool(self.window.winfo_exists())
+        except tk.TclError:
+            return False
+
+    def close(self) -> None:
+        self.figure.clear()
+        self.window.destroy()
+
+    def _axesFor(self, kind: str):
+        if self.kind != kind:
+            self.figure.clear()
+            self.axes = self.figure.add_subplot(projection="3d" if kind == "3d" else None)
+            self.kind = kind
+            self.artist = None
+            if kind == "2d":    # Axes crossing at the origin, like sympy draws them
+                self.axes.spines["left"].set_position("zero")
+                self.axes.spines["bottom"].set_position("zero")
+                self.axes.spines["right"].set_visible(False)
+                self.axes.spines["top"].set_visible(False)
+                self.axes.callbacks.connect("xlim_changed", self._onRangeChanged)
+        return self.axes
+
+    def _onRangeChanged(self, axes) -> None:
+        # Panning fires this for every mouse movement, so the line is only sampled again once the events stop
+        if self.drawing or self.resample is None:
+            return
+        if self.pendingRange is None:
+            self.window.after_idle(self._resampleRange)
+        self.pendingRange = axes.get_xlim()
+
+    def _resampleRange(self) -> None:
+        visibleRange, self.pendingRange = self.pendingRange, None
+        if self.kind != "2d" or self.resample is None or not self.isOpen():
+            return
+        self.artist.set_data(*self.resample(*visibleRange))
+        self.stats["resamples"] += 1
+        self.canvas.draw_idle()
+
+    def _refresh(self, title: str) -> None:
+        self.axes.set_title(title)
+        self.stats["draws"] += 1
+        self.canvas.draw_idle()
+        self.window.deiconify()
+        self.window.lift()
+
+    def drawLine(self, xs: np.ndarray, ys: np.ndarray, color: str, title: str = "", xlabel: str = "",
+                 ylabel: str = "", ylim: tuple = None, resample=None) -> None:
+        """
+        Draws a 2D function, reusing the line already drawn if there is one.
+        :param xs: coordinates of the samples (see graphing.sampleAdaptive2d)
+        :param ys: values of the samples, NaN where the line is broken
+        :param color: color of the line
+        :param ylim: range (min, max) of the vertical axis, or None to fit it to the values
+        :param resample: optional function (low, high) -> (xs, ys) that samples the function over another range, used
+        to follow the pans and zooms made with the toolbar
+        """
+        axes = self._axesFor("2d")
+        self.resample = resample
+        self.drawing = True     # The range changes below are not pans or zooms
+        if self.artist is None:
+            self.artist, = axes.plot(xs, ys, color=color)
+        else:
+            self.artist.set_data(xs, ys)
+            self.artist.set_color(color)
+            self.stats["inPlace"] += 1
+
+        axes.set_xlabel(xlabel, loc="right")
+        axes.set_ylabel(ylabel, loc="top")
+        axes.set_autoscale_on(True)     # Zooming with the toolbar turns it off
+        axes.relim()
+        axes.autoscale_view()
+        if ylim is not None:
+            axes.set_ylim(ylim)
+        self.drawing = False
+        self._refresh(title)
+
+    def drawSurface(self, xMesh: np.ndarray, yMesh: np.ndarray, zMesh: np.ndarray, title: str = "",
+                    xlabel: str = "x", ylabel: str = "y") -> None:
+        """
+        Draws a function of two variables from its meshes (see graphing.sampleFunction3d). A matplotlib surface
+        can't change its data, so the previous one is removed from the axes, which are kept.
+        """
+        axes = self._axesFor("3d")
+        if self.artist is not None:
+            self.artist.remove()
+            self.stats["inPlace"] += 1
+        self.artist = axes.plot_surface(xMesh, yMesh, zMesh, cmap=SURFACE_COLORMAP)
+
+        axes.set_xlim(float(np.min(xMesh)), float(np.max(xMesh)))
+        axes.set_ylim(float(np.min(yMesh)), float(np.max(yMesh)))
+        if not np.isnan(zMesh).all():
+            low, high = float(np.nanmin(zMesh)), float(np.nanmax(zMesh))
+            axes.set_zlim(low, high if high > low else low + 1)
+        axes.set_xlabel(xlabel)
+        axes.set_ylabel(ylabel)
+        self._refresh(title)
+
+
+def showPlot(plot, xlabel: str = "x", ylabel: str = "y") -> PlotWindow:
+    """
+    Draws a graph made by graphing.makeGraph2d or graphing.makeGraph3d in the shared plot window, instead of opening a
+    new figure for it as plot.show() does. 2D graphs with a graphing.Graph2dSession are sampled again through it when
+    they are panned or zoomed, which only samples the part of the range that wasn't visible before.
+    :param xlabel: name of the first variable of a 3D graph (2D graphs already have it)
+    :param ylabel: name of the second variable of a 3D graph
+    :return: the plot window
+    """
+    window = PlotWindow.shared()
+    series = plot[0]
+    if isinstance(series, graphing.MeshSurfaceSeries):
+        window.drawSurface(*series.get_meshes(), title=series.label, xlabel=xlabel, ylabel=ylabel)
+    else:
+        session = getattr(plot, "session", None)
+        resample = None if session is None else lambda low, high: session.sample((low, high))[:2]
+        window.drawLine(*series.get_points(), color=series.line_color, title=series.label, xlabel=plot.xlabel,
+                        ylabel=plot.ylabel, ylim=plot.ylim, resample=resample)
+    return window
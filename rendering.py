@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import graphing
+import metrics
+import tokenizer
+
+FORMATS = ("png", "svg")
+DEFAULT_DPI = 100
+
+# Changing how graphs are drawn has to change this too, so that the images rendered before are not served anymore
+RENDER_VERSION = 1
+
+# Environment variable with the directory of the render cache, and the directory used when it isn't set
+RENDER_CACHE_ENV_VAR = "CALC_RENDER_CACHE"
+DEFAULT_RENDER_CACHE = os.path.join(os.path.expanduser("~"), ".advanced-calculator", "renders")
+DEFAULT_MAX_FILES = 500
+
+CACHE_LABELS = {"cache": "renders"}     # Of the metrics of the render cache
+
+
+class RenderCache:
+    """
+    Directory of rendered graphs, named after the hash of everything that changes how they look (function, variables,
+    ranges, color, resolution, format...), so identical graphs are rendered only once. The least recently used files
+    are deleted once there are too many of them.
+    """
+
+    def __init__(self, directory: str = DEFAULT_RENDER_CACHE, maxFiles: int = DEFAULT_MAX_FILES):
+        """
+        :param directory: directory where the images are stored (created if it doesn't exist)
+        :param maxFiles: maximum number of images kept
+        """
+        self.directory = directory
+        self.maxFiles = maxFiles
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(**params) -> str:
+        """
+        :return: the hash identifying a graph with the given parameters
+        """
+        params["version"] = RENDER_VERSION
+        return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def path(self, key: str, fmt: str) -> str:
+        return os.path.join(self.directory, f"{key}.{fmt}")
+
+    def get(self, key: str, fmt: str) -> str | None:
+        """
+        :return: the path of the image stored for the key, or None if there is none
+        """
+        path = self.path(key, fmt)
+        try:
+            os.utime(path)      # Marks it as recently used
+        except OSError:
+            with self.lock:
+                self.stats["misses"] += 1
+            metrics.registry.inc("cache_misses_total", CACHE_LABELS)
+            return None
+        with self.lock:
+            self.stats["hits"] += 1
+        metrics.registry.inc("cache_hits_total", CACHE_LABELS)
+        return path
+
+    def put(self, key: str, fmt: str, write) -> str:
+        """
+        Stores an image, which is only visible once it has been completely written (so other processes never see
+        half-written files).
+        :param write: function that receives a path and writes the image there
+        :return: the path of the stored image
+        """
+        descriptor, temporary = tempfile.mkstemp(suffix=f".{fmt}", dir=self.directory)
+        os.close(descriptor)
+        try:
+            write(temporary)
+            os.chmod(temporary, 0o644)     # mkstemp creates it readable only by its owner
+            os.replace(temporary, self.path(key, fmt))
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        self._prune()
+        return self.path(key, fmt)
+
+    def clear(self) -> None:
+        for name in os.listdir(self.directory):
+            if name.endswith(tuple(f".{fmt}" for fmt in FORMATS)):
+                os.remove(os.path.join(self.directory, name))
+
+    def _prune(self) -> None:
+        files = [entry for entry in os.scandir(self.directory)
+                 if entry.is_file() and entry.name.endswith(tuple(f".{fmt}" for fmt in FORMATS))]
+        if len(files) <= self.maxFiles:
+            return
+        files.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in files[:len(files) - self.maxFiles]:
+            try:
+                os.remove(entry.path)
+            except OSError:     # Already removed by another process
+                continue
+            with self.lock:
+                self.stats["evictions"] += 1
+            metrics.registry.inc("cache_evictions_total", CACHE_LABELS)
+
+
+_sharedCache = None
+
+
+def getRenderCache() -> RenderCache:
+    """
+    :return: the render cache shared by the whole process, stored in the directory given by CALC_RENDER_CACHE (or
+    DEFAULT_RENDER_CACHE)
+    """
+    global _sharedCache
+    if _sharedCache is None:
+        _sharedCache = RenderCache(os.environ.get(RENDER_CACHE_ENV_VAR) or DEFAULT_RENDER_CACHE)
+    return _sharedCache
+
+
+def savePlot(plot, path: str, dpi: int = DEFAULT_DPI) -> None:
+    """
+    Writes a sympy Plot (i.e. made by graphing.makeGraph2d) to an image file, without showing it. The format is chosen
+    from the extension of the path. The figure is closed afterwards, so rendering many graphs doesn't leak them.
+    """
+    kind = "3d" if isinstance(plot[0], graphing.MeshSurfaceSeries) else "2d"
+    fmt = os.path.splitext(path)[1].lstrip(".").lower()
+    backend = plot.backend(plot)
+    try:
+        with metrics.Timer("render_seconds", {"kind": kind, "format": fmt}):
+            backend.process_series()
+            backend.fig.savefig(path, dpi=dpi)
+    finally:
+        backend.close()
+
+
+def _normalized(text) -> str:
+    try:
+        normalized = tokenizer.normalize(str(text))
+    except SyntaxError:     # It can't be drawn (see tokenizer.normalize), which makeGraph reports
+        normalized = str(text)
+    return "".join(normalized.split())
+
+
+def _render(key: str, fmt: str, output: str, cache: RenderCache, makeGraph, dpi: int) -> (dict, str):
+    if fmt not in FORMATS:
+        return None, f"An error occurred | Unknown image format '{fmt}', expected one of {FORMATS}"
+
+    cache = getRenderCache() if cache is None else cache
+    path = cache.get(key, fmt)
+    stats = None
+    if path is None:
+        plot, message = makeGraph()
+        if plot is None:
+            return None, message
+        stats = plot.samplingStats
+        path = cache.put(key, fmt, lambda temporary: savePlot(plot, temporary, dpi))
+
+    if output:
+        shutil.copyfile(path, output)
+    return {"path": output or path, "cached": stats is None, "samplingStats": stats}, "Graph rendered successfully"
+
+
+def renderGraph2d(func: str, inTermsOf: str, visionRange: tuple, funcHue: str, fmt: str = "png", output: str = None,
+                  adaptive: bool = True, dpi: int = DEFAULT_DPI, cache: RenderCache = None) -> (dict, str):
+    """
+    Renders a 2D graph (see graphing.makeGraph2d) to an image, or takes it from the render cache if the same graph was
+    rendered before.
+    :param fmt: format of the image, one of FORMATS
+    :param output: path where the image is copied to (if None, the path of the image in the cache is returned)
+    :param dpi: resolution of the image (only for png)
+    :param cache: RenderCache used, the one shared by the process by default
+    :return: A dictionary with the 'path' of the image, whether it came from the cache ('cached') and, if it was
+    rendered, the 'samplingStats' of the graph, along with a message, which will be the error message produced if the
+    graph could not be created.
+    """
+    key = RenderCache.key(kind="2d", func=_normalized(func), variables=[inTermsOf.strip()],
+                          ranges=[[_normalized(bound) for bound in visionRange]], color=funcHue.lower(),
+                          adaptive=adaptive, fmt=fmt, dpi=dpi)
+    return _render(key, fmt, output, cache,
+                   lambda: graphing.makeGraph2d(func, inTermsOf, visionRange, funcHue, adaptive=adaptive), dpi)
+
+
+def renderGraph3d(func: str, inTermsOfX: str, inTermsOfY: str, visionRangeX: tuple, visionRangeY: tuple,
+                  resolution: int = graphing.DEFAULT_RESOLUTION_3D, fmt: str = "png", output: str = None,
+                  dpi: int = DEFAULT_DPI, cache: RenderCache = None) -> (dict, str):
+    """
+    Renders a 3D graph (see graphing.makeGraph3d) to an image, or takes it from the render cache if the same graph was
+    rendered before. The parameters and the result are the same as the ones of renderGraph2d.
+    """
+    key = RenderCache.key(kind="3d", func=_normalized(func), variables=[inTermsOfX.strip(), inTermsOfY.strip()],
+                          ranges=[[_normalized(bound) for bound in visionRange]
+                                  for visionRange in (visionRangeX, visionRangeY)],
+                          resolution=resolution, fmt=fmt, dpi=dpi)
+    return _render(key, fmt, output, cache,
+                   lambda: graphing.makeGraph3d(func, inTermsOfX, inTermsOfY, visionRangeX, visionRangeY,
+                                                resolution=resolution), dpi)
@@ -0,0 +1,432 @@
+"""
+Local HTTP service that runs the jobs of batch.py (differentiate, integrate, plot, plot3d) for other programs.
+
+Every operation is an endpoint that receives the job's parameters as a JSON object and answers with the JSON result of
+batch.runJob (plus whether it came from the cache):
+    POST /differentiate   {"func": "x**2*sin(x)", "var": "x", "order": 2}
+    POST /integrate       {"func": "exp(-x**2)", "lower": "-∞", "upper": "+∞"}
+    POST /plot            {"func": "1/x", "lower": "-5", "upper": "5", "output": "graph.svg"}
+    POST /plot3d          {"func": "x*y", "resolution": 80}
+    GET  /health          state of the queue, the workers and the cache
+    GET  /metrics         metrics of the service in the Prometheus text format (see metrics.py)
+    GET  /metrics.json    the same metrics as JSON
+A job may also have a 'timeout' (in seconds, limited to the one of the service).
+
+Only requests with a JSON body ('Content-Type: application/json') are accepted, and requests with an 'Origin' header
+are rejected, so web pages open in a browser can't use the service. The functions are parsed with
+expression.parse, which never runs them as python code. Images are only written when the service is started with an
+output directory (--output-dir), and their 'output' is a file name inside it.
+
+The calculations run in a pool of worker processes (see evaluation.WorkerPool), so the event loop only parses
+requests and dispatches them. The pool itself is only used from a thread of its own, so killing and starting workers
+never stalls the event loop. When every worker is busy and the queue is full, requests are rejected with 429 instead
+of piling up, and requests that run out of time are answered with 504 (and their worker is killed). Identical
+requests that arrive while one of them is being calculated share its result, and the results are kept in a cache
+shared with the other processes (and the GUI) through CALC_CACHE_PATH.
+
+Usage:
+    python -m service --port 8765 --workers 4 --queue 32 --timeout 10 --output-dir images
+"""
+import argparse
+import asyncio
+import functools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import batch
+import cache
+import evaluation
+import metrics
+import rendering
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_MAX_QUEUE = 32          # Requests that can wait for a worker, beyond the ones being calculated
+DEFAULT_TIMEOUT = 10.0          # Seconds a request may take, including the time it waits for a worker
+POLL_SECONDS = 0.005            # How often the worker pool is polled while there are jobs in it
+IDLE_SECONDS = 30.0             # Time a kept-alive connection may stay without sending a request
+MAX_BODY_BYTES = 64 * 1024
+
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 415: "Unsupported Media Type", 422: "Unprocessable Entity",
+           429: "Too Many Requests", 500: "Internal Server Error", 503: "Service Unavailable", 504: "Gateway Timeout"}
+
+# Status of the requests whose job didn't finish, by the status of their evaluation.EvaluationResult
+FAILURE_STATUS = {"timeout": 504, "memory": 503, "error": 500}
+
+GET_ENDPOINTS = ("/health", "/metrics", "/metrics.json")
+
+# Parameters of a job that don't change its result
+UNCACHED_FIELDS = ("id", "op", "timeout")
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str, headers: dict = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class CalculationService:
+    """
+    Dispatches jobs to a worker pool from an asyncio event loop. It has to be started (from the loop) before it is
+    used, and shut down at the end.
+    """
+
+    def __init__(self, workers: int = None, maxQueue: int = DEFAULT_MAX_QUEUE, timeout: float = DEFAULT_TIMEOUT,
+                 memoryMb: float = None, resultCache: cache.ResultCache = None, outputDir: str = None):
+        """
+        :param workers: number of worker processes (one per core by default)
+        :param maxQueue: number of requests that can wait for a worker before new ones are rejected with 429
+        :param timeout: maximum seconds a request may take
+        :param memoryMb: memory each calculation may use (see evaluation.Budget)
+        :param resultCache: cache of the results, by default one that persists to CALC_CACHE_PATH if it is set
+        :param outputDir: directory where the images of the jobs with an 'output' are written (jobs with an 'output'
+        are rejected if None)
+        """
+        self.pool = evaluation.WorkerPool(size=workers or os.cpu_count() or 1, preload=("batch",), name="service")
+        self.maxQueue = maxQueue
+        self.timeout = timeout
+        self.memoryMb = memoryMb
+        self.outputDir = None if outputDir is None else os.path.realpath(outputDir)
+        self.cache = resultCache if resultCache is not None else \
+            cache.ResultCache(persistPath=os.environ.get(cache.PERSIST_ENV_VAR), name="service")
+
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="service-pool")   # The pool's thread
+        self.futures = {}       # pool job id -> future with its EvaluationResult
+        self.running = {}       # cache key -> future of the job calculating it, shared by identical requests
+        self.jobsAdded = None
+        self.poller = None
+        self.stats = {"requests": 0, "completed": 0, "rejected": 0, "timeouts": 0, "cacheHits": 0, "coalesced": 0}
+        metrics.registry.addCollector(self.collectMetrics)
+
+    @property
+    def capacity(self) -> int:
+        """
+        Number of jobs that can be in the service at the same time (being calculated or waiting for a worker)
+        """
+        return len(self.pool.workers) + self.maxQueue
+
+    def start(self) -> None:
+        self.jobsAdded = asyncio.Event()
+        self.poller = asyncio.get_running_loop().create_task(self._pollResults())
+
+    def shutdown(self) -> None:
+        if self.poller is not None:
+            self.poller.cancel()
+        self.executor.shutdown(wait=True)
+        self.pool.shutdown()
+
+    async def _inPool(self, function, *args, **kwargs):
+        """
+        Runs a method of the pool in its thread: polling it may kill and start workers (when a job runs out of time),
+        which takes long enough to stall every other request if it was done in the event loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor,
+                                                                functools.partial(function, *args, **kwargs))
+
+    async def _pollResults(self) -> None:
+        while True:
+            if not self.futures and not self.pool.stale:    # The workers of stale jobs still have to be killed
+                self.jobsAdded.clear()
+                await self.jobsAdded.wait()
+            await self._inPool(self.pool.poll)     # The results are handed to their futures (see _submit)
+            await asyncio.sleep(POLL_SECONDS)
+
+    def _resolve(self, jobId: int, future: asyncio.Future, result: evaluation.EvaluationResult) -> None:
+        self.futures.pop(jobId, None)
+        if not future.done():
+            future.set_result(result)
+
+    @staticmethod
+    def cacheKey(job: dict) -> tuple | None:
+        """
+        :return: the key of the job's result in the cache, or None if it can't be cached (plots written to a file,
+        which are cached by rendering.py instead)
+        """
+        if job.get("output"):
+            return None
+        params = {name: value for name, value in job.items() if name not in UNCACHED_FIELDS}
+        return "service", job["op"], json.dumps(params, sort_keys=True, default=str)
+
+    async def calculate(self, job: dict) -> (int, dict):
+        """
+        Calculates a job in the worker pool (or takes its result from the cache).
+        :param job: dictionary with the 'op' and its parameters (see batch.py)
+        :return: the HTTP status and the result of the job (see batch.runJob)
+        :raises HttpError: with status 429 if the service is saturated
+        """
+        self.stats["requests"] += 1
+        key = self.cacheKey(job)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.stats["cacheHits"] += 1
+                return 200, dict(cached, id=job.get("id"), cached=True)
+
+        try:
+            timeout = min(float(job.get("timeout") or self.timeout), self.timeout)
+        except (TypeError, ValueError):
+            raise HttpError(400, f"Invalid timeout '{job.get('timeout')}'")
+
+        future = self.running.get(key) if key is not None else None
+        if future is not None:
+            self.stats["coalesced"] += 1
+        else:
+            if len(self.futures) >= self.capacity:
+                self.stats["rejected"] += 1
+                raise HttpError(429, f"The service is busy ({len(self.futures)} calculations pending), try again "
+                                     f"later", headers={"Retry-After": "1"})
+            future = await self._submit(job, key, timeout)
+
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if not future.done():   # Tells the requests sharing it, and frees its worker
+                jobId = next((jobId for jobId, pending in self.futures.items() if pending is future), None)
+                future.set_result(evaluation.EvaluationResult(jobId, "timeout",
+                                                              message=f"The request took longer than {timeout:g} s"))
+                if jobId is not None:
+                    del self.futures[jobId]
+                    await self._inPool(self.pool.cancel, jobId)
+            result = future.result()
+
+        self.stats["completed"] += 1
+        self.stats["timeouts"] += result.status == "timeout"
+        if not result.ok:
+            return FAILURE_STATUS.get(result.status, 500), \
+                {"id": job.get("id"), "op": job["op"], "ok": False, "result": None, "message": "",
+                 "error": result.message, "elapsed": result.elapsed, "cached": False}
+
+        outcome = result.value
+        if outcome["ok"] and key is not None:
+            self.cache.put(key, dict(outcome, id=None))
+        return (200 if outcome["ok"] else 422), dict(outcome, id=job.get("id"), cached=False)
+
+    async def _submit(self, job: dict, key: tuple | None, timeout: float) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        budget = evaluation.Budget(seconds=timeout, memoryMb=self.memoryMb)
+        # The result reaches the future even if it is polled before submit returns here
+        jobId = await self._inPool(self.pool.submit, batch.runJob, (job,), budget=budget, operation=job["op"],
+                                   onResult=lambda result: loop.call_soon_threadsafe(self._resolve, result.jobId,
+                                                                                     future, result))
+        if not future.done():
+            self.futures[jobId] = future
+        self.jobsAdded.set()
+
+        if key is not None:
+            self.running[key] = future
+            future.add_done_callback(lambda done: self.running.pop(key, None))
+        return future
+
+    def outputPath(self, output) -> str:
+        """
+        :param output: 'output' of a job, the name of an image in the output directory
+        :return: the absolute path where the image is written
+        :raises HttpError: with status 400 if images can't be written, or the output is not a file in the directory
+        """
+        if self.outputDir is None:
+            raise HttpError(400, "This service doesn't write images ('output'), it has no output directory")
+        path = os.path.realpath(os.path.join(self.outputDir, str(output)))
+        if os.path.dirname(path) != self.outputDir:
+            raise HttpError(400, f"The output '{output}' has to be a file name, without directories")
+        if os.path.splitext(path)[1].lstrip(".").lower() not in rendering.FORMATS:
+            raise HttpError(400, f"The output '{output}' has to be one of {', '.join(rendering.FORMATS)}")
+        return path
+
+    def health(self) -> dict:
+        return {"status": "ok", "workers": len(self.pool.workers), "pending": len(self.futures),
+                "capacity": self.capacity, "timeout": self.timeout, "stats": dict(self.stats),
+                "pool": dict(self.pool.stats), "cache": self.cache.snapshot()}
+
+    def collectMetrics(self) -> list:
+        """
+        :return: the statistics of the service as (name, labels, value) samples (see
+        metrics.MetricsRegistry.addCollector)
+        """
+        samples = [("service_requests_total", {"event": event}, count) for event, count in self.stats.items()]
+        return samples + [("service_pending", {}, len(self.futures))]
+
+    async def route(self, method: str, path: str, body: bytes, headers: dict = None) -> (int, dict | str):
+        """
+        :param headers: headers of the request, with their names in lower case
+        :return: the HTTP status and the payload of the response to a request (a dictionary sent as JSON, or the
+        Prometheus metrics as text)
+        :raises HttpError: if the request is not valid
+        """
+        headers = headers or {}
+        if "origin" in headers:     # Sent by browsers, the service is only for the programs of this machine
+            raise HttpError(403, "Requests from web pages are not accepted")
+        path = path.split("?", 1)[0].rstrip("/") or "/"
+        if path in GET_ENDPOINTS:
+            if method != "GET":
+                raise HttpError(405, f"Use GET for {path}", headers={"Allow": "GET"})
+            if path == "/metrics":
+                return 200, metrics.registry.prometheus()
+            return 200, self.health() if path == "/health" else metrics.registry.snapshot()
+
+        op = path.lstrip("/")
+        if op not in batch.OPERATIONS:
+            raise HttpError(404, f"Unknown endpoint '{path}', expected one of {', '.join(GET_ENDPOINTS)} or "
+                                 f"{', '.join('/' + name for name in batch.OPERATIONS)}")
+        if method != "POST":
+            raise HttpError(405, f"Use POST for {path}", headers={"Allow": "POST"})
+        if headers.get("content-type", "").split(";", 1)[0].strip().lower() != "application/json":
+            raise HttpError(415, "The body has to be sent as application/json")
+
+        try:
+            job = json.loads(body or b"{}")
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise HttpError(400, f"The body is not valid JSON: {e}")
+        if not isinstance(job, dict):
+            raise HttpError(400, "The body has to be a JSON object")
+        if not job.get("func"):
+            raise HttpError(400, "Missing 'func'")
+        invalid = batch.invalidVariable(job)
+        if invalid is not None:
+            raise HttpError(400, f"'{invalid}' can't be used as the name of a variable")
+        if job.get("output"):
+            job["output"] = self.outputPath(job["output"])
+        job["op"] = op
+        start = time.perf_counter()
+        status, payload = await self.calculate(job)
+        metrics.registry.observe("service_request_seconds", time.perf_counter() - start,
+                                 {"operation": op, "status": status})
+        return status, payload
+
+    async def handleConnection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Serves the requests of a connection, which is kept alive between them unless the client asks otherwise.
+        """
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(_readRequest(reader), IDLE_SECONDS)
+                except HttpError as e:
+                    writer.write(_response(e.status, {"ok": False, "error": e.message}, False, e.headers))
+                    break
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if request is None:
+                    break
+
+                method, path, version, headers, body = request
+                keepAlive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                extraHeaders = {}
+                try:
+                    status, payload = await self.route(method, path, body, headers)
+                except HttpError as e:
+                    status, payload, extraHeaders = e.status, {"ok": False, "error": e.message}, e.headers
+
+                writer.write(_response(status, payload, keepAlive, extraHeaders))
+                await writer.drain()
+                if not keepAlive:
+                    break
+        except ConnectionError:     # The client went away
+            pass
+        finally:
+            writer.close()
+
+
+async def _readRequest(reader: asyncio.StreamReader) -> tuple | None:
+    """
+    :return: a tuple (method, path, version, headers, body) with the next request of the connection, or None if the
+    client closed it
+    :raises HttpError: if the request is malformed or too big
+    """
+    requestLine = await reader.readline()
+    if not requestLine.strip():
+        return None
+    try:
+        method, path, version = requestLine.decode("latin-1").split()
+    except ValueError:
+        raise HttpError(400, "Malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HttpError(400, "Invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413, f"The body can't be bigger than {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length > 0 else b""
+    return method.upper(), path, version.upper(), headers, body
+
+
+def _response(status: int, payload: dict | str, keepAlive: bool, headers: dict = None) -> bytes:
+    if isinstance(payload, str):
+        body, contentType = payload.encode("utf-8"), metrics.CONTENT_TYPE_PROMETHEUS
+    else:
+        body, contentType = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8"), \
+            "application/json; charset=utf-8"
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+             f"Content-Type: {contentType}",
+             f"Content-Length: {len(body)}",
+             f"Connection: {'keep-alive' if keepAlive else 'close'}"]
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+async def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, onReady=None, **options) -> None:
+    """
+    Runs the service until it is cancelled.
+    :param onReady: optional function called with the service and the asyncio server once it is listening
+    :param options: parameters of the CalculationService
+    """
+    service = CalculationService(**options)
+    service.start()
+    server = await asyncio.start_server(service.handleConnection, host, port)
+    try:
+        if onReady is not None:
+            onReady(service, server)
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.shutdown()
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m service",
+                                     description="Serves the differentiate/integrate/plot jobs of batch.py as JSON "
+                                                 "endpoints over HTTP.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="address to listen on (only this machine by default)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port to listen on")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (one per core)")
+    parser.add_argument("--queue", type=int, default=DEFAULT_MAX_QUEUE,
+                        help="requests that can wait for a worker before new ones are rejected with 429")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="seconds each request may take")
+    parser.add_argument("--memory", type=float, default=None, help="MB of memory each calculation may use")
+    parser.add_argument("--output-dir", default=None,
+                        help="directory where the images of the plots with an 'output' are written (none by default, "
+                             "so they are rejected)")
+    args = parser.parse_args(argv)
+
+    # The workers and the service share the persistent tier of the result cache
+    os.environ.setdefault(cache.PERSIST_ENV_VAR, cache.DEFAULT_PERSIST_PATH)
+    metrics.exportFromEnvironment()
+
+    def announce(service, server):
+        print(f"Serving on http://{args.host}:{args.port} with {len(service.pool.workers)} workers", flush=True)
+
+    try:
+        asyncio.run(serve(args.host, args.port, onReady=announce, workers=args.workers, maxQueue=args.queue,
+                          timeout=args.timeout, memoryMb=args.memory, outputDir=args.output_dir))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+import contextlib
+import signal
+import threading
+import time
+
+from sympy import Expr, cancel, cse, expand, factor, factor_terms, fraction, simplify
+
+import expression
+
+# Seconds that the "full" strategy may spend in sympy's simplify before falling back to the "cheap" one
+FULL_SIMPLIFY_SECONDS = 1.0
+
+# Expressions bigger than this (in nodes) are never given to simplify, which can take minutes with them. It is the only
+# limit where the time can't be enforced (Windows has no SIGALRM, and signals only work in the main thread).
+FULL_MAX_NODES = 1500
+
+STRATEGY_NAMES = ("none", "cheap", "full", "cse")
+
+# Strategy used for every kind of operation, they can be modified with setStrategy. "differential-step" is applied to
+# every order of a derivative as it is built (see expression.DerivativeTower), the others to the final results.
+STRATEGIES = {
+    "differential": "cheap",
+    "differential-step": "none",
+    "integral": "none",
+}
+
+# Totals of every simplification made in this process, by strategy
+stats = {name: {"calls": 0, "nodesBefore": 0, "nodesAfter": 0, "seconds": 0.0, "timeouts": 0}
+         for name in STRATEGY_NAMES}
+_statsLock = threading.Lock()
+
+
+class SimplifyTimeout(Exception):
+    pass
+
+
+def setStrategy(operation: str, strategy: str) -> None:
+    """
+    Changes the simplification strategy of an operation (i.e. "integral"), creating it if it didn't exist.
+    :param strategy: one of STRATEGY_NAMES
+    """
+    if strategy not in STRATEGY_NAMES:
+        raise ValueError(f"Unknown simplification strategy '{strategy}', expected one of {STRATEGY_NAMES}")
+    STRATEGIES[operation] = strategy
+
+
+def strategyFor(operation: str) -> str:
+    """
+    :return: the strategy used for the operation ("none" for the operations without one)
+    """
+    return STRATEGIES.get(operation, "none")
+
+
+def _cheap(expr: Expr) -> Expr:
+    expanded = expand(expr)
+    # cancel is only fast for rational functions, with anything else (exp, sin...) it can take seconds
+    if expanded.is_rational_function():
+        # The denominator is kept factored, expanded powers like (x - 1)**3 are much harder to read
+        numerator, denominator = fraction(cancel(expanded))
+        return numerator / factor(denominator)
+    return factor_terms(expanded)
+
+
+@contextlib.contextmanager
+def timeLimit(seconds: float):
+    """
+    Interrupts the code run within it with SimplifyTimeout after the given seconds. That is only possible with SIGALRM
+    in the main thread of a process (which is where the workers of evaluation.WorkerPool run their jobs), anywhere
+    else the code is not limited.
+    """
+    if seconds is None or not hasattr(signal, "SIGALRM") or \
+            threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def onAlarm(signum, frame):
+        raise SimplifyTimeout()
+
+    previous = signal.signal(signal.SIGALRM, onAlarm)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _full(expr: Expr, seconds: float) -> Expr:
+    """
+    Runs sympy's simplify, interrupting it after the given seconds where that is possible (see timeLimit).
+    :raises SimplifyTimeout: if it took longer than that
+    """
+    with timeLimit(seconds):
+        return simplify(expr)
+
+
+def simplifyExpression(expr: Expr, strategy: str, seconds: float = FULL_SIMPLIFY_SECONDS) -> (Expr, dict):
+    """
+    Simplifies an expression with one of the strategies:
+        none:  leaves it as it is
+        cheap: expands it and cancels the common factors of the resulting fraction, leaving its denominator factored
+               (or, if it is not a rational function, only takes out the common factors of its terms), fast even for
+               big expressions
+        full:  sympy's simplify, within the given seconds (the cheap strategy is used instead if it takes longer, or if
+               the expression is too big for it)
+        cse:   finds its common subexpressions, the expression is returned as it is but the metrics measure the size
+               it has once they are extracted (which is what evaluating it costs when compiled, see sympy's cse)
+    Whichever the strategy, the result is never bigger than the original expression (it is returned otherwise).
+    :param expr: expression to simplify
+    :param strategy: one of STRATEGY_NAMES
+    :param seconds: time limit of the full strategy
+    :return: the simplified expression, along with a dictionary with the 'strategy' used in the end, the size of the
+    expression (in nodes) before and after ('nodesBefore' and 'nodesAfter'), the 'seconds' spent and whether the full
+    strategy ran out of time ('timedOut')
+    """
+    if strategy not in STRATEGY_NAMES:
+        raise ValueError(f"Unknown simplification strategy '{strategy}', expected one of {STRATEGY_NAMES}")
+
+    start = time.perf_counter()
+    nodesBefore = expression.treeSize(expr)
+    metrics = {"strategy": strategy, "nodesBefore": nodesBefore, "nodesAfter": nodesBefore, "seconds": 0.0,
+               "timedOut": False}
+    result = expr
+
+    if strategy == "full":
+        if nodesBefore > FULL_MAX_NODES:
+            strategy = metrics["strategy"] = "cheap"
+        else:
+            try:
+                result = _full(expr, seconds)
+            except SimplifyTimeout:
+                metrics["timedOut"] = True
+                strategy = metrics["strategy"] = "cheap"
+    if strategy == "cheap":
+        result = _cheap(expr)
+
+    if strategy == "cse":
+        replacements, reduced = cse(expr)
+        metrics["nodesAfter"] = sum(expression.treeSize(sub) for _, sub in replacements) + \
+            sum(expression.treeSize(r) for r in reduced)
+    elif strategy != "none":
+        metrics["nodesAfter"] = expression.treeSize(result)
+        if metrics["nodesAfter"] > nodesBefore:
+            result = expr
+            metrics["nodesAfter"] = nodesBefore
+
+    metrics["seconds"] = time.perf_counter() - start
+    with _statsLock:
+        totals = stats[metrics["strategy"]]
+        totals["calls"] += 1
+        totals["nodesBefore"] += metrics["nodesBefore"]
+        totals["nodesAfter"] += metrics["nodesAfter"]
+        totals["seconds"] += metrics["seconds"]
+        totals["timeouts"] += metrics["timedOut"]
+    return result, metrics
+
+
+def _simplifyWithCheap(expr: Expr) -> Expr:
+    return simplifyExpression(expr, "cheap")[0]
+
+
+def _simplifyWithFull(expr: Expr) -> Expr:
+    return simplifyExpression(expr, "full")[0]
+
+
+# Functions that only return the expression, as expected by expression.DerivativeTower. They are always the same
+# objects, so the towers built with the same strategy are shared. CSE doesn't change the expression, so it has none.
+SIMPLIFIERS = {"none": None, "cheap": _simplifyWithCheap, "full": _simplifyWithFull, "cse": None}
+
+
+def simplifier(strategy: str):
+    """
+    :return: a function that simplifies an expression with the strategy (None if the strategy doesn't change it)
+    """
+    if strategy not in STRATEGY_NAMES:
+        raise ValueError(f"Unknown simplification strategy '{strategy}', expected one of {STRATEGY_NAMES}")
+    return SIMPLIFIERS[strategy]
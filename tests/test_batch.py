@@ -0,0 +1,25 @@
+import io
+
+import batch
+
+
+def test_invalid_lines_are_failed_jobs():
+    lines = '{"op": "differentiate", "func": "x**2"}\nnot json\n\n[1]\n3\n{"op": "differentiate", "func": "x**3"}\n'
+    results = [batch.runJob(job) for job in batch.readJobs(io.StringIO(lines))]
+
+    assert [result["id"] for result in results] == [1, 2, 3, 4, 5]
+    assert [result["ok"] for result in results] == [True, False, False, False, True]
+    assert results[1]["error"].startswith("Invalid JSON")
+    assert results[2]["error"] == "Expected a JSON object, got list"
+    assert results[4]["result"] == "3*x**2"
+
+
+def test_csv_jobs():
+    rows = "op,func,var,order\ndifferentiate,sin(t),t,2\nintegrate,x**2,,\n"
+    results = [batch.runJob(job) for job in batch.readJobs(io.StringIO(rows), "csv")]
+    assert [result["result"] for result in results] == ["-sin(t)", "x**3/3"]
+
+
+def test_unknown_op():
+    result = batch.runJob({"id": 1, "op": "solve", "func": "x"})
+    assert not result["ok"] and result["error"].startswith("Unknown op 'solve'")
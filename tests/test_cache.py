@@ -0,0 +1,67 @@
+import pickle
+import time
+
+from cache import ResultCache
+
+
+def test_least_recently_used_is_evicted():
+    cache = ResultCache(maxEntries=2)
+    cache.put(("a",), 1)
+    cache.put(("b",), 2)
+    assert cache.get(("a",)) == 1     # b is now the least recently used
+    cache.put(("c",), 3)
+
+    assert ("b",) not in cache
+    assert cache.get(("a",)) == 1 and cache.get(("c",)) == 3
+    assert cache.stats["evictions"] == 1
+
+
+def test_evicted_by_size():
+    value = "x" * 1000
+    size = len(pickle.dumps(value))
+    cache = ResultCache(maxBytes=2 * size + size // 2)
+    for name in "abc":
+        cache.put((name,), value)
+
+    assert len(cache) == 2 and ("a",) not in cache
+    assert cache.bytes <= cache.maxBytes
+
+
+def test_value_bigger_than_the_cache_is_not_stored():
+    cache = ResultCache(maxBytes=100)
+    cache.put(("a",), "x" * 1000)
+    assert ("a",) not in cache and cache.bytes == 0
+
+
+def test_hits_and_misses():
+    cache = ResultCache()
+    cache.put(("a",), 1)
+    assert cache.get(("a",)) == 1
+    assert cache.get(("b",), "default") == "default"
+    assert cache.peek(("a",)) == 1 and cache.peek(("b",)) is None    # Not counted
+    assert (cache.stats["hits"], cache.stats["misses"]) == (1, 1)
+
+
+def test_persisted_between_instances(tmp_path):
+    path = str(tmp_path / "results.sqlite3")
+    ResultCache(persistPath=path).put(("a",), {"value": 1})
+
+    cache = ResultCache(persistPath=path)
+    assert cache.get(("a",)) == {"value": 1}
+    assert cache.stats["diskHits"] == 1 and ("a",) in cache
+
+
+def test_disk_tier_evicts_the_least_recently_used(tmp_path):
+    path = str(tmp_path / "results.sqlite3")
+    writer = ResultCache(persistPath=path, maxDiskEntries=10)
+    for index in range(10):
+        writer.put((str(index),), index)
+        time.sleep(0.002)
+
+    reader = ResultCache(persistPath=path, maxDiskEntries=10)
+    assert reader.get(("0",)) == 0     # Read from disk, so it is now the most recently used there
+    time.sleep(0.002)
+    reader.put(("new",), 10)   # Over the limit, the two least recently used are dropped
+
+    onDisk = ResultCache(persistPath=path)
+    assert [onDisk.peek((str(index),)) for index in range(4)] == [0, None, None, 3]
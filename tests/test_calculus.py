@@ -0,0 +1,58 @@
+import pytest
+from sympy import Matrix, Symbol, hessian, simplify, sympify, zeros
+
+import calculus
+
+
+def test_integral_sympy_closes_is_symbolic():
+    outcome, message = calculus.calculateIntegralWithFallback("x**2", "x", "2", "0")
+    assert outcome["tier"] == "symbolic" and str(outcome["result"]) == "8/3"
+
+
+def test_integral_sympy_cannot_close_falls_back_to_quadrature():
+    outcome, message = calculus.calculateIntegralWithFallback("exp(-x**2)*log(1 + sin(x)**2)*cos(x**3)", "x", "2", "0",
+                                                              symbolicSeconds=0.5)
+    assert outcome["tier"] == "numeric" and set(outcome["timings"]) == {"symbolic", "numeric"}
+    assert abs(float(outcome["result"]["value"]) - 0.105144005467795) < 1e-9
+
+
+def test_integral_without_numeric_bounds_never_falls_back():
+    outcome, message = calculus.calculateIntegralWithFallback("exp(x**3)", "x", "a", "0", symbolicSeconds=0.5)
+    assert outcome["tier"] == "symbolic" and "numeric" not in outcome["timings"]
+
+
+def test_invalid_integral():
+    outcome, message = calculus.calculateIntegralWithFallback("x**", "x", "2", "0")
+    assert outcome is None and message.startswith("An error occurred")
+
+
+@pytest.mark.parametrize("kind, funcs", [
+    ("gradient", ["x**2*y + sin(x*y)"]),
+    ("jacobian", ["x*y", "exp(x)*z", "x + y + z"]),
+    ("hessian", ["x**2*y + sin(x*y)*z"]),
+])
+def test_derivative_matrix_matches_sympy(kind, funcs):
+    outcome, message = calculus.calculateDerivativeMatrix(", ".join(funcs), "", kind)
+    symbols = [Symbol(v) for v in outcome["variables"]]
+    exprs = [sympify(func) for func in funcs]
+    expected = hessian(exprs[0], symbols) if kind == "hessian" else Matrix(exprs).jacobian(symbols)
+    assert outcome["matrix"].shape == expected.shape
+    assert simplify(outcome["matrix"] - expected) == zeros(*expected.shape)
+
+
+def test_derivative_matrix_in_parallel():
+    serial, message = calculus.calculateDerivativeMatrix("x*y*z + exp(x*y)", "x, y, z", "hessian", simplify="none")
+    parallel, message = calculus.calculateDerivativeMatrix("x*y*z + exp(x*y)", "x, y, z", "hessian", simplify="cheap",
+                                                           workers=2)
+    assert simplify(serial["matrix"] - parallel["matrix"]) == zeros(3, 3)
+
+
+@pytest.mark.parametrize("funcs, kind", [
+    ("x, y", "gradient"),
+    ("x*y", "laplacian"),
+    ("x**", "gradient"),
+    ("2", "gradient"),
+])
+def test_invalid_derivative_matrix(funcs, kind):
+    outcome, message = calculus.calculateDerivativeMatrix(funcs, "", kind)
+    assert outcome is None and message.startswith("An error occurred")
@@ -0,0 +1,64 @@
+import shutil
+
+import numpy as np
+import pytest
+from sympy import Integral, Symbol, exp, lambdify, sin
+
+import codeExport
+
+x = Symbol("x")
+y = Symbol("y")
+POINTS = np.linspace(0.1, 2.0, 7)
+
+
+def test_numpy_matches_sympy():
+    expr = -x ** 2 * sin(x) * exp(x * y) + sin(x) * exp(x * y)
+    f = codeExport.compileNumpy(expr, ["x", "y"])
+    np.testing.assert_allclose(f(POINTS, 0.5), lambdify((x, y), expr)(POINTS, 0.5))
+
+
+def test_subexpressions_calculated_once():
+    eliminated = codeExport.eliminateSubexpressions(sin(x) * exp(x * y) + exp(x * y) ** 2, ["x", "y"])
+    assert len(eliminated["subexpressions"]) == 1
+    assert eliminated["after"] < eliminated["before"]
+
+
+def test_constant_keeps_the_shape():
+    assert codeExport.compileNumpy("3", ["x"])(POINTS).shape == POINTS.shape
+
+
+def test_write_module(tmp_path):
+    path = codeExport.writeModule(x * sin(x), ["x"], str(tmp_path / "exported.py"), name="g")
+    namespace = {}
+    with open(path, encoding="utf-8") as file:
+        exec(file.read(), namespace)
+    np.testing.assert_allclose(namespace["g"](POINTS), POINTS * np.sin(POINTS))
+
+
+@pytest.mark.parametrize("variable", ["x.y", "class", "a b", "x)"])
+def test_rejects_invalid_variables(variable):
+    with pytest.raises(ValueError, match="name of a variable"):
+        codeExport.numpySource("x", [variable])
+
+
+@pytest.mark.parametrize("name", ["f(x)", "def", "__import__('os')"])
+def test_rejects_invalid_names(name):
+    with pytest.raises(ValueError, match="name of a function"):
+        codeExport.numpySource("x", ["x"], name=name)
+
+
+def test_rejects_unknown_variables():
+    with pytest.raises(ValueError, match="unknown variables y"):
+        codeExport.numpySource(x * y, ["x"])
+
+
+def test_rejects_integrals():
+    with pytest.raises(ValueError, match="integrals"):
+        codeExport.numpySource(Integral(exp(x ** 2) / x, x), ["x"])
+
+
+@pytest.mark.skipif(shutil.which("cc") is None and shutil.which("gcc") is None, reason="needs a C compiler")
+def test_extension_matches_numpy():
+    expr = -x ** 2 * sin(x) + 6 * x * sin(x)
+    ufunc = codeExport.compileExtension(expr, ["x"])
+    np.testing.assert_allclose(ufunc(POINTS), codeExport.compileNumpy(expr, ["x"])(POINTS))
@@ -0,0 +1,34 @@
+import calculus
+import expression
+import simplification
+
+
+def towerOrders(func: str) -> list:
+    tower = expression.compileExpression(func).tower("x", simplification.simplifier("none"))
+    return [order is not None for order in tower.orders]
+
+
+def test_tower_is_seeded_from_the_persistent_cache(tmp_path):
+    func = "(x**2 + 1)/(x - 1)"
+    path = str(tmp_path / "results.sqlite3")
+    cache = calculus.resultCache
+    try:
+        calculus.resultCache = type(cache)(persistPath=path)
+        calculus.calculateDifferential(func, "x", 3)
+
+        # Another session: the 3rd order is read from disk, and only the 4th is calculated from it
+        calculus.resultCache = type(cache)(persistPath=path)
+        expression.clearExpressions()
+        fourth, _ = calculus.calculateDifferential(func, "x", 4)
+        assert towerOrders(func) == [True, False, False, True, True]
+        assert calculus.resultCache.stats["misses"] == 1    # The lookup of the tower is not counted
+
+        # Yet another one, with another final simplification: the 4th order is taken as it was stored
+        calculus.resultCache = type(cache)(persistPath=path)
+        expression.clearExpressions()
+        unsimplified, _ = calculus.calculateDifferential(func, "x", 4, simplify="none")
+        assert towerOrders(func) == [True, False, False, False, True]
+        assert (fourth - unsimplified).equals(0)
+    finally:
+        calculus.resultCache = cache
+        expression.clearExpressions()
@@ -0,0 +1,108 @@
+import time
+
+import pytest
+
+from evaluation import Budget, EvaluationEngine, WorkerPool
+
+
+@pytest.fixture
+def pool():
+    pool = WorkerPool(size=1, preload=(), killGrace=0.2)
+    yield pool
+    pool.shutdown()
+
+
+def waitFor(pool: WorkerPool, condition, timeout: float = 30.0) -> list:
+    results = []
+    deadline = time.perf_counter() + timeout
+    while not condition(results):
+        assert time.perf_counter() < deadline, "the pool took too long"
+        pool.waitForResults()
+        results += pool.poll()
+    return results
+
+
+def test_result(pool):
+    jobId = pool.submit(divmod, (7, 2))
+    results = waitFor(pool, lambda results: results)
+    assert [(result.jobId, result.status, result.value) for result in results] == [(jobId, "ok", (3, 1))]
+
+
+def test_error(pool):
+    pool.submit(divmod, (1, 0))
+    result = waitFor(pool, lambda results: results)[0]
+    assert result.status == "error" and not result.ok
+
+
+def test_superseded_job_is_not_returned(pool):
+    pool.submit(time.sleep, (0.5,), channel="input")
+    latest = pool.submit(divmod, (7, 2), channel="input")
+    results = waitFor(pool, lambda results: results)
+    assert [result.jobId for result in results] == [latest]
+    assert pool.stats["superseded"] == 1
+
+
+def test_superseded_job_is_killed_after_the_grace(pool):
+    first = pool.submit(time.sleep, (60,), channel="input")
+    waitFor(pool, lambda _: pool.workers[0].jobId == first)
+    time.sleep(0.5)     # Longer than the grace, which counts from when it is superseded and not from when it started
+    pool.cancelChannel("input")
+    superseded = time.perf_counter()
+
+    waitFor(pool, lambda _: pool.stats["killed"] == 1, timeout=5.0)
+    assert time.perf_counter() - superseded >= pool.killGrace
+    assert not pool.stale and pool.pending == 0
+
+
+def test_over_budget(pool):
+    pool.submit(time.sleep, (60,), budget=Budget(seconds=0.2))
+    result = waitFor(pool, lambda results: results, timeout=10.0)[0]
+    assert result.status == "timeout"
+    assert pool.stats["overBudget"] == 1
+
+
+class FakeMaster:
+    """
+    Stands for the tkinter widget of an EvaluationEngine, the calls it schedules are run by runPending
+    """
+
+    def __init__(self):
+        self.pending = {}
+        self.ids = iter(range(1, 1 << 30))
+
+    def after(self, ms: int, function) -> int:
+        afterId = next(self.ids)
+        self.pending[afterId] = function
+        return afterId
+
+    def after_cancel(self, afterId: int) -> None:
+        self.pending.pop(afterId, None)
+
+    def runPending(self) -> None:
+        pending, self.pending = self.pending, {}
+        for function in pending.values():
+            function()
+
+
+def test_engines_sharing_a_pool_get_their_own_results():
+    pool = WorkerPool(size=2, preload=())
+    first, second = EvaluationEngine(FakeMaster(), pool), EvaluationEngine(FakeMaster(), pool)
+    received = {"first": [], "second": []}
+    try:
+        # The first engine is still polling for its slow job when the result of the second one arrives
+        first.submit(time.sleep, (1,), onResult=lambda result: received["first"].append(result.status))
+        second.submit(divmod, (9, 2), onResult=lambda result: received["second"].append(result.value))
+
+        deadline = time.perf_counter() + 30
+        while not (received["first"] and received["second"]):
+            assert time.perf_counter() < deadline, "the results were not delivered"
+            pool.waitForResults()
+            first.master.runPending()
+            second.master.runPending()
+        first.master.runPending()
+        second.master.runPending()
+    finally:
+        pool.shutdown()
+
+    assert received == {"first": ["ok"], "second": [(4, 1)]}
+    assert not first.master.pending and not second.master.pending     # Neither of them keeps polling
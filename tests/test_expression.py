@@ -0,0 +1,36 @@
+import pytest
+from sympy import Abs, Symbol, sin
+from sympy.core.function import AppliedUndef
+from sympy.core.sympify import SympifyError
+
+import expression
+
+x = Symbol("x")
+
+
+@pytest.mark.parametrize("source, expected", [
+    ("sin(x)+x^2", sin(x) + x ** 2),
+    ("2x", 2 * x),
+    ("abs(x)", Abs(x)),
+])
+def test_parse(source, expected):
+    assert expression.parse(source) == expected
+
+
+@pytest.mark.parametrize("source", [
+    "__import__(os)",
+    "x.__class__",
+    "Symbol.__subclasses__()",
+    "'x'",
+    "[c for c in ()]",
+    "x if x else y",
+])
+def test_parse_rejects_python(source):
+    with pytest.raises(SympifyError):
+        expression.parse(source)
+
+
+@pytest.mark.parametrize("source", ["open(x)", "eval(x)", "getattr(x, y)", "globals()"])
+def test_parse_leaves_builtins_unevaluated(source):
+    # None of python's builtins can be reached, so their names are only undefined functions
+    assert isinstance(expression.parse(source), AppliedUndef)
@@ -0,0 +1,30 @@
+import numpy as np
+
+import graphing
+
+
+def test_tan_breaks_at_its_poles():
+    xs, ys, stats = graphing.sampleAdaptive2d("tan(x)", "x", ("-5", "5"))
+    assert stats["breaks"] == 4
+    assert np.allclose(xs[np.isnan(ys)], [-3 * np.pi / 2, -np.pi / 2, np.pi / 2, 3 * np.pi / 2], atol=1e-3)
+
+
+def test_pole_is_never_joined():
+    xs, ys, stats = graphing.sampleAdaptive2d("1/x", "x", ("-5", "5"))
+    finite = np.isfinite(ys)
+    assert not finite.all()
+    # No segment goes from one side of the pole to the other
+    joined = finite[:-1] & finite[1:]
+    assert not np.any(joined & (np.sign(ys[:-1]) != np.sign(ys[1:])))
+
+
+def test_smooth_function_has_no_breaks():
+    xs, ys, stats = graphing.sampleAdaptive2d("sin(x)", "x", ("-5", "5"))
+    assert stats["breaks"] == 0 and np.isfinite(ys).all()
+    assert not stats["capped"] and len(xs) <= stats["budget"]
+
+
+def test_jumps_are_breaks():
+    xs, ys, stats = graphing.sampleAdaptive2d("floor(x)", "x", ("0", "3.5"))
+    assert stats["breaks"] == 3
+    assert np.allclose(xs[np.isnan(ys)], [1, 2, 3], atol=1e-3)
@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+import rendering
+
+
+def touch(path):
+    open(path, "wb").close()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return rendering.RenderCache(str(tmp_path / "renders"), maxFiles=2)
+
+
+def test_key_depends_on_every_parameter():
+    key = rendering.RenderCache.key(func="sin(x)", color="blue", dpi=100)
+    assert key == rendering.RenderCache.key(dpi=100, color="blue", func="sin(x)")
+    assert key != rendering.RenderCache.key(func="sin(x)", color="blue", dpi=200)
+
+
+def test_put_and_get(cache):
+    assert cache.get("graph", "png") is None
+    path = cache.put("graph", "png", touch)
+    assert cache.get("graph", "png") == path and os.path.exists(path)
+    assert cache.stats["hits"] == 1 and cache.stats["misses"] == 1
+
+
+def test_failed_write_leaves_nothing(cache):
+    def fail(temporary):
+        raise RuntimeError("could not render")
+
+    with pytest.raises(RuntimeError):
+        cache.put("graph", "png", fail)
+    assert os.listdir(cache.directory) == []
+
+
+def test_prune_drops_the_least_recently_used(cache):
+    for key, mtime in (("a", 1), ("b", 2)):
+        os.utime(cache.put(key, "png", touch), (mtime, mtime))
+    cache.get("a", "png")   # b is now the least recently used
+    cache.put("c", "png", touch)
+    assert sorted(os.listdir(cache.directory)) == ["a.png", "c.png"]
+    assert cache.stats["evictions"] == 1
+
+
+def test_render_2d(cache, tmp_path):
+    output = str(tmp_path / "sin.png")
+    result, message = rendering.renderGraph2d("sin(x)", "x", ("-5", "5"), "blue", output=output, cache=cache)
+    assert not result["cached"] and result["path"] == output
+    with open(output, "rb") as file:
+        assert file.read(8) == b"\x89PNG\r\n\x1a\n"
+
+    # The same graph, written differently
+    result, message = rendering.renderGraph2d("sin( x )", "x", ("-5", "5"), "Blue", cache=cache)
+    assert result["cached"]
+
+
+def test_render_3d_svg(cache):
+    result, message = rendering.renderGraph3d("x*y", "x", "y", ("-1", "1"), ("-1", "1"), resolution=10, fmt="svg",
+                                              cache=cache)
+    with open(result["path"], encoding="utf-8") as file:
+        assert "<svg" in file.read()
+
+
+@pytest.mark.parametrize("func, fmt", [("sin(x)", "gif"), ("x**", "png")])
+def test_render_errors(cache, func, fmt):
+    result, message = rendering.renderGraph2d(func, "x", ("-5", "5"), "blue", fmt=fmt, cache=cache)
+    assert result is None and message.startswith("An error occurred")
+    assert os.listdir(cache.directory) == []
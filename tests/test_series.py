@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from sympy import E, O, Symbol, exp, oo, sympify
+
+import calculus
+import expression
+
+x = Symbol("x")
+POINTS = np.linspace(-1.0, 1.0, 9)
+
+
+@pytest.mark.parametrize("func, point, order, expected", [
+    ("sin(x)", "0", 6, x - x ** 3 / 6 + x ** 5 / 120 + O(x ** 6)),
+    ("exp(x)", "1", 3, E + E * (x - 1) + E * (x - 1) ** 2 / 2 + O((x - 1) ** 3, (x, 1))),
+    ("1/(x*(1 - x))", "0", 3, 1 / x + 1 + x + x ** 2 + O(x ** 3)),
+    ("x/(x + 1)", "oo", 3, 1 - 1 / x + x ** -2 + O(x ** -3, (x, oo))),
+    ("x**3 + x", "0", 8, x ** 3 + x),
+])
+def test_series(func, point, order, expected):
+    s, message = calculus.calculateSeries(func, "x", point, order)
+    assert s == expected
+
+
+def test_more_terms_only_derive_the_missing_ones():
+    expansion = expression.SeriesExpansion(exp(x), x)
+    expansion.series(4)
+    assert expansion.tower.highest == 3
+    assert expansion.series(6) == sympify("1 + x + x**2/2 + x**3/6 + x**4/24 + x**5/120") + O(x ** 6)
+    assert expansion.tower.highest == 5
+
+
+def test_horner_matches_the_polynomial():
+    evaluator = expression.SeriesExpansion(exp(x), x, 1).horner(6)
+    polynomial = expression.SeriesExpansion(exp(x), x, 1).polynomial(6)
+    np.testing.assert_allclose(evaluator(POINTS), [float(polynomial.subs(x, p)) for p in POINTS])
+
+
+def test_horner_of_laurent_series():
+    evaluator = expression.SeriesExpansion(1 / x + x, x).horner(3)
+    assert evaluator.lowest == -1
+    np.testing.assert_allclose(evaluator(np.array([2.0, 4.0])), [2.5, 4.25])
+
+
+def test_evaluator_source_and_bounds():
+    outcome, message = calculus.seriesEvaluator("cos(x)", "x", "0", 10, interval=("-1", "1"))
+    namespace = {}
+    exec(outcome["source"], namespace)
+    np.testing.assert_allclose(namespace["series"](POINTS), outcome["evaluator"](POINTS))
+    observed = np.abs(outcome["evaluator"](POINTS) - np.cos(POINTS)).max()
+    assert observed <= outcome["bounds"]["observed"] <= outcome["bounds"]["lagrange"] < 1e-6
+
+
+@pytest.mark.parametrize("func, point", [("sqrt(x)", "0"), ("exp(x)", "oo")])
+def test_evaluator_needs_a_power_series(func, point):
+    outcome, message = calculus.seriesEvaluator(func, "x", point, 3)
+    assert outcome is None and message.startswith("An error occurred")
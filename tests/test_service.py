@@ -0,0 +1,108 @@
+import asyncio
+import json
+import os
+import time
+
+import pytest
+
+import cache
+import evaluation
+import service
+
+JSON = {"content-type": "application/json"}
+
+
+def request(path: str, job: dict, headers: dict = None, **options) -> (int, dict):
+    async def run():
+        calculation = service.CalculationService(workers=1, resultCache=cache.ResultCache(), **options)
+        calculation.start()
+        try:
+            return await calculation.route("POST", path, json.dumps(job).encode("utf-8"), headers)
+        finally:
+            calculation.shutdown()
+
+    try:
+        return asyncio.run(run())
+    except service.HttpError as e:
+        return e.status, {"error": e.message}
+
+
+def test_differentiate():
+    status, result = request("/differentiate", {"func": "x**2*sin(x)", "order": 1}, JSON)
+    assert status == 200 and result["ok"] and result["result"] == "x*(x*cos(x) + 2*sin(x))"
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({}, 415),
+    ({"content-type": "text/plain"}, 415),
+    (dict(JSON, origin="http://example.com"), 403),
+])
+def test_only_json_requests_from_programs(headers, expected):
+    assert request("/differentiate", {"func": "x**2"}, headers)[0] == expected
+
+
+@pytest.mark.parametrize("job", [
+    {"func": "x**2", "var": "__import__('os')"},
+    {"func": "x**2", "var": "x.real"},
+    {"func": "x**2", "var": "lambda"},
+])
+def test_invalid_variables_are_rejected(job):
+    status, result = request("/differentiate", job, JSON)
+    assert status == 400 and "name of a variable" in result["error"]
+
+
+def test_functions_are_never_run(tmp_path):
+    marker = tmp_path / "ran"
+    status, result = request("/differentiate", {"func": f"__import__('os').system('touch {marker}')"}, JSON)
+    assert status == 422 and not result["ok"]
+    assert not marker.exists()
+
+
+@pytest.mark.parametrize("output, expected", [("graph.png", 200), ("../graph.png", 400), ("graph.py", 400)])
+def test_images_only_in_the_output_directory(tmp_path, output, expected):
+    status, result = request("/plot", {"func": "x**2", "output": output}, JSON, outputDir=str(tmp_path))
+    assert status == expected
+    if expected == 200:
+        assert os.path.exists(tmp_path / output)
+
+
+def test_output_needs_an_output_directory():
+    assert request("/plot", {"func": "x**2", "output": "graph.png"}, JSON)[0] == 400
+
+
+def test_timeouts_dont_stall_the_event_loop(monkeypatch):
+    restart = evaluation.Worker.restart
+
+    def slowRestart(worker):
+        time.sleep(0.5)     # Like a process that takes long to die, or to start
+        restart(worker)
+
+    monkeypatch.setattr(evaluation.Worker, "restart", slowRestart)
+
+    async def run():
+        calculation = service.CalculationService(workers=1, resultCache=cache.ResultCache(), timeout=30)
+        calculation.start()
+        longest = 0.0
+
+        async def tick():
+            nonlocal longest
+            while True:
+                start = time.perf_counter()
+                await asyncio.sleep(0.01)
+                longest = max(longest, time.perf_counter() - start)
+
+        await calculation.route("POST", "/differentiate", b'{"func": "x"}', JSON)     # Once the worker has started
+        ticker = asyncio.get_running_loop().create_task(tick())
+        try:
+            # The worker is killed and started again when it runs out of time
+            body = b'{"func": "exp(sin(x**3))*tan(x)", "timeout": 0.5}'
+            status, _ = await calculation.route("POST", "/integrate", body, JSON)
+            await asyncio.sleep(1)
+            return status, longest, calculation.pool.stats["killed"]
+        finally:
+            ticker.cancel()
+            calculation.shutdown()
+
+    status, longest, killed = asyncio.run(run())
+    assert status == 504 and killed == 1
+    assert longest < 0.25
@@ -0,0 +1,58 @@
+import time
+
+import pytest
+from sympy import Symbol, cos, sin
+
+import simplification
+
+x = Symbol("x")
+
+
+def test_cheap_keeps_the_denominator_factored():
+    result, metrics = simplification.simplifyExpression((x ** 2 - 1) / (x ** 3 - 3 * x ** 2 + 3 * x - 1), "cheap")
+    assert result == (x + 1) / (x - 1) ** 2
+    assert metrics["nodesAfter"] < metrics["nodesBefore"]
+
+
+@pytest.mark.parametrize("strategy", simplification.STRATEGY_NAMES)
+def test_never_bigger(strategy):
+    # Expanding it gives 11 terms, so every strategy must leave it as it is
+    result, metrics = simplification.simplifyExpression((x + 1) ** 10, strategy)
+    assert result == (x + 1) ** 10
+    assert metrics["nodesAfter"] <= metrics["nodesBefore"]
+
+
+def test_full():
+    result, metrics = simplification.simplifyExpression(sin(x) ** 2 + cos(x) ** 2, "full")
+    assert result == 1 and metrics["strategy"] == "full" and not metrics["timedOut"]
+
+
+def test_full_falls_back_to_cheap_when_out_of_time(monkeypatch):
+    def slowSimplify(expr):
+        time.sleep(5)
+        return expr
+
+    monkeypatch.setattr(simplification, "simplify", slowSimplify)
+    start = time.perf_counter()
+    result, metrics = simplification.simplifyExpression((x ** 2 - 1) / (x - 1), "full", seconds=0.2)
+    assert time.perf_counter() - start < 2
+    assert result == x + 1 and metrics["strategy"] == "cheap" and metrics["timedOut"]
+
+
+def test_full_skips_big_expressions(monkeypatch):
+    monkeypatch.setattr(simplification, "FULL_MAX_NODES", 3)
+    result, metrics = simplification.simplifyExpression((x ** 2 - 1) / (x - 1), "full")
+    assert result == x + 1 and metrics["strategy"] == "cheap" and not metrics["timedOut"]
+
+
+def test_cse_only_measures():
+    expr = sin(x) * cos(x) + sin(x) * cos(x) ** 2
+    result, metrics = simplification.simplifyExpression(expr, "cse")
+    assert result == expr
+
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        simplification.simplifyExpression(x, "fastest")
+    with pytest.raises(ValueError):
+        simplification.setStrategy("integral", "fastest")
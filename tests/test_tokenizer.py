@@ -0,0 +1,34 @@
+import pytest
+
+import tokenizer
+
+
+@pytest.mark.parametrize("source, expected", [
+    ("arcsen(x)", "asin(x)"),
+    ("sen(x)cos(x)", "sin(x)*cos(x)"),
+    ("5x", "5*x"),
+    ("2.5x", "2.5*x"),
+    ("(x+1)(x-1)", "(x+1)*(x-1)"),
+    ("x⁻¹", "x**(-1)"),
+    ("2x²", "2*x**2"),
+    ("x^3", "x**3"),
+])
+def test_normalize(source, expected):
+    assert tokenizer.normalize(source) == expected
+
+
+@pytest.mark.parametrize("source", ["x.__class__", "x.real", "__import__(os)", "'x'", "\"x\""])
+def test_normalize_rejects_python(source):
+    with pytest.raises(SyntaxError):
+        tokenizer.normalize(source)
+
+
+@pytest.mark.parametrize("source, expected", [
+    ("x**2", "x²"),
+    ("2**3*x", "2³·x"),
+    ("x**(-1)", "x^(-1)"),
+    ("cos(x)**10", "cos(x)^10"),
+    ("x**12", "x^12"),
+])
+def test_prettify(source, expected):
+    assert tokenizer.prettify(source) == expected
@@ -0,0 +1,184 @@
+import re
+
+# Every token is a (kind, text) tuple, the kinds being the names of the groups of this pattern. Superscript digits
+# are excluded from names explicitly because python considers them alphanumeric (so 'x²' would be a single name).
+TOKEN_PATTERN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<name>[^\W\d⁰¹²³⁴⁵⁶⁷⁸⁹][^\W⁰¹²³⁴⁵⁶⁷⁸⁹]*)
+  | (?P<superscript>[⁺⁻]?[⁰¹²³⁴⁵⁶⁷⁸⁹]+)
+  | (?P<infinity>∞)
+  | (?P<operator>\*\*|.)
+""", re.VERBOSE)
+
+SUPERSCRIPTS = str.maketrans("⁰¹²³⁴⁵⁶⁷⁸⁹⁺⁻", "0123456789+-")
+
+# Only these 3 are in latin-1, the other superscript digits aren't displayed properly by every font
+TO_SUPERSCRIPT = {"1": "¹", "2": "²", "3": "³"}
+
+# Operators that are written in other ways (i.e. by cleanExpr) and their python equivalent
+OPERATORS = {"^": "**", "·": "*", "×": "*", "÷": "/", "−": "-"}
+
+# Characters that only make sense in python code (attribute access and strings), never in a mathematical expression.
+# Together with names containing '__' they are rejected by normalize, so an expression can't reach python's internals.
+FORBIDDEN_OPERATORS = {".": "attribute access", "'": "strings", "\"": "strings", "\\": "escapes"}
+
+# Names of functions: they are never multiplied implicitly by what comes after them ('sin x' is left as it is)
+FUNCTION_NAMES = frozenset({
+    "sin", "cos", "tan", "cot", "sec", "csc", "asin", "acos", "atan", "acot", "asec", "acsc", "atan2",
+    "sinh", "cosh", "tanh", "coth", "asinh", "acosh", "atanh", "acoth",
+    "exp", "log", "ln", "sqrt", "cbrt", "root", "Abs", "abs", "sign", "floor", "ceiling", "factorial", "gamma",
+    "erf", "re", "im", "Min", "Max", "diff", "integrate", "Integral", "Derivative", "limit", "Sum", "Product",
+})
+
+# Spellings of functions in every language (the keys are whole names, so 'sen' is never replaced inside 'arcsen')
+SYNONYMS = {
+    "en": {"arcsin": "asin", "arccos": "acos", "arctan": "atan", "arccot": "acot",
+           "arcsinh": "asinh", "arccosh": "acosh", "arctanh": "atanh", "ln": "log"},
+    "es": {"sen": "sin", "arcsen": "asin", "arcos": "acos", "tg": "tan", "arctg": "atan", "cotg": "cot",
+           "senh": "sinh", "tgh": "tanh", "arcsenh": "asinh", "arctgh": "atanh"},
+}
+
+# Locales whose synonyms are understood when none are specified
+DEFAULT_LOCALES = ("en", "es")
+
+_mergedSynonyms = {}    # tuple of locales -> their synonyms merged in a single dictionary
+
+
+def registerSynonyms(locale: str, synonyms: dict) -> None:
+    """
+    Adds spellings of functions for a locale (creating it if it didn't exist),
+    i.e. registerSynonyms("fr", {"sh": "sinh"})
+    :param locale: name of the locale
+    :param synonyms: dictionary of name -> name that sympy understands
+    """
+    SYNONYMS.setdefault(locale, {}).update(synonyms)
+    _mergedSynonyms.clear()
+
+
+def _synonymsFor(locales: tuple) -> dict:
+    if locales not in _mergedSynonyms:
+        merged = {}
+        for locale in locales:
+            merged.update(SYNONYMS.get(locale, {}))
+        _mergedSynonyms[locales] = merged
+    return _mergedSynonyms[locales]
+
+
+def tokenize(expr: str):
+    """
+    Splits an expression into tokens, in a single pass.
+    :param expr: expression to split
+    :return: a generator of (kind, text) tuples, kind being one of "space", "number", "name", "superscript",
+    "infinity" or "operator"
+    """
+    for match in TOKEN_PATTERN.finditer(expr):
+        yield match.lastgroup, match.group()
+
+
+def _endsOperand(kind: str, text: str) -> bool:
+    # True if a token can be the left side of an implicit multiplication
+    return kind in ("number", "superscript", "infinity") or (kind == "name" and text not in FUNCTION_NAMES) \
+        or text == ")"
+
+
+def normalize(expr: str, locales: tuple = DEFAULT_LOCALES) -> str:
+    """
+    Rewrites an expression, written the way a person would, into one that sympy understands. In a single pass over
+    its tokens it:
+        - replaces the spellings of functions of the locales (i.e. sen(x) -> sin(x))
+        - replaces ∞ by oo, and ^, ·, ×, ÷ by their python operators
+        - turns superscripts into exponents (x² -> x**2, x⁻¹ -> x**(-1))
+        - makes implicit multiplications explicit (5x -> 5*x, 2(x+1) -> 2*(x+1), (x+1)(x-1) -> (x+1)*(x-1)). A name
+        followed by a parenthesis is always a function call, so x(x+1) is not considered a multiplication.
+    :param expr: expression to normalize
+    :param locales: locales whose spellings are understood
+    :return: normalized expression
+    :raises SyntaxError: if the expression uses names with '__', attribute access or strings (see FORBIDDEN_OPERATORS)
+    """
+    synonyms = _synonymsFor(tuple(locales))
+    parts = []
+    previous = ("operator", "(")    # Last token that wasn't a space
+
+    for kind, text in tokenize(expr):
+        if kind == "space":
+            parts.append(text)
+            continue
+
+        if kind == "name" and "__" in text:
+            raise SyntaxError(f"names with '__' are not allowed in expressions ({text})")
+        if kind == "operator" and text in FORBIDDEN_OPERATORS:
+            raise SyntaxError(f"{FORBIDDEN_OPERATORS[text]} ('{text}') is not allowed in expressions")
+
+        if kind == "name":
+            text = synonyms.get(text, text)
+        elif kind == "infinity":
+            text = "oo"
+        elif kind == "operator":
+            text = OPERATORS.get(text, text)
+
+        startsOperand = kind in ("name", "infinity") or text == "(" or \
+            (kind == "number" and previous[0] != "number")
+        if startsOperand and _endsOperand(*previous) and not (previous[0] == "name" and text == "("):
+            parts.append("*")
+
+        if kind == "superscript":
+            exponent = text.translate(SUPERSCRIPTS)
+            parts.append(f"**({exponent})" if exponent[0] in "+-" else f"**{exponent}")
+        else:
+            parts.append(text)
+        previous = (kind, text)
+
+    return "".join(parts)
+
+
+def prettify(expr: str) -> str:
+    """
+    Rewrites an expression printed by sympy to make it easier to read, in a single pass over its tokens: '**' becomes
+    '^' (or a superscript for the exponents 1, 2 and 3) and '*' becomes '·'.
+    :param expr: expression to rewrite
+    :return: rewritten expression
+    """
+    tokens = list(tokenize(str(expr)))
+    parts = []
+    index = 0
+
+    while index < len(tokens):
+        kind, text = tokens[index]
+        if text == "**":
+            exponent = tokens[index + 1][1] if index + 1 < len(tokens) else ""
+            # Only the exponents 1, 2 and 3 themselves, so that x**12 is written x^12 like x**10 (and not x¹²)
+            if exponent in TO_SUPERSCRIPT:
+                parts.append(TO_SUPERSCRIPT[exponent])
+                index += 2
+                continue
+            text = "^"
+        elif text == "*":
+            text = "·"
+        parts.append(text)
+        index += 1
+
+    return "".join(parts).strip()
+
+
+def splitTopLevel(expr: str, separator: str = ",") -> list:
+    """
+    Splits an expression at the separators that are not inside parentheses or brackets, so that the arguments of
+    functions are kept together (i.e. "atan2(y, x), x*y" gives ["atan2(y, x)", "x*y"]).
+    :param expr: expression to split
+    :param separator: single character at which it is split
+    :return: the non-empty parts, without surrounding spaces
+    """
+    parts, current, depth = [], [], 0
+    for kind, text in tokenize(expr):
+        if text in "([{" and kind == "operator":
+            depth += 1
+        elif text in ")]}" and kind == "operator":
+            depth = max(depth - 1, 0)
+        elif text == separator and depth == 0:
+            parts.append("".join(current).strip())
+            current = []
+            continue
+        current.append(text)
+    parts.append("".join(current).strip())
+    return [part for part in parts if part]
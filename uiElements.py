@@ -53,6 +53,58 @@ def calculateForegroundColor(masterButton: tk.Button, hue: str) -> str:
     return fg
 
 
+_root = None    # First window created, the only tk.Tk of the application
+
+
+def newWindow() -> tk.Tk | tk.Toplevel:
+    """
+    Creates a window of the application. The first one is the root (the only tk.Tk, whose mainloop serves every
+    window) and the rest are Toplevel children of it, so every window shares a single tcl interpreter instead of
+    starting one each.
+    :return: the window created
+    """
+    global _root
+    try:
+        alive = _root is not None and bool(_root.winfo_exists())
+    except tk.TclError:     # The root has been destroyed
+        alive = False
+
+    if not alive:
+        _root = tk.Tk()
+        return _root
+    return tk.Toplevel(_root)
+
+
+def runMainloop(window: tk.Tk | tk.Toplevel) -> None:
+    """
+    Runs the event loop if the window is the root of the application (i.e. a window opened on its own). The rest of
+    the windows are served by the loop that is already running, so no loop is nested inside another.
+    """
+    if window is _root:
+        window.mainloop()
+
+
+def showDebounceStats(label: tk.Label, debouncer) -> None:
+    """
+    Shows in a label how many of the events received by an evaluation.DebounceScheduler were actually evaluated.
+    :param label: label where the counters will be shown
+    :param debouncer: scheduler whose counters are shown
+    """
+    label.configure(text=f"{debouncer.stats['evaluations']} evaluated · {debouncer.skipped} skipped "
+                         f"({debouncer.stats['events']} key events)")
+
+
+def showStageTimings(label: tk.Label, stages: list) -> None:
+    """
+    Shows in a label how long each stage of a calculation took (see instrumentation.py), if they were timed.
+    :param label: label where the timings will be shown
+    :param stages: (operation, stage, seconds) tuples, as found in an evaluation.EvaluationResult
+    """
+    if stages:
+        label.configure(text=" · ".join(f"{stage} {seconds * 1000:.1f} ms" for _, stage, seconds in stages
+                                        if stage != "total"))
+
+
 class DefaultButton(tk.Button):
     """
     Custom button class that only uses some of the attributes from the original tk.Button class.
@@ -60,7 +112,7 @@ class DefaultButton(tk.Button):
     """
 
     def __init__(self,
-                 master: tk.Tk | tk.Frame | tk.Canvas,
+                 master: tk.Tk | tk.Toplevel | tk.Frame | tk.Canvas,
                  text: str,
                  width=20,
                  height=1,
@@ -133,7 +185,7 @@ class CodeInfoWindow:
                  dimensions: str = "300x200"):
         self.title = title
 
-        self.win = tk.Tk()
+        self.win = newWindow()
         self.win.focus_force()
         self.win.geometry(dimensions)
         self.win.title(self.title)
@@ -158,7 +210,7 @@ class CodeInfoWindow:
         self.btOk.configure(command=lambda: self.destroyWin())
 
         self.win.bind("<Escape>", lambda e: self.destroyWin())
-        self.win.mainloop()
+        runMainloop(self.win)
 
     def destroyWin(self) -> None:
         self.win.destroy()
@@ -170,7 +222,7 @@ class ColorButton(tk.Button):
     """
 
     def __init__(self,
-                 master: tk.Tk | tk.Frame | tk.Canvas,
+                 master: tk.Tk | tk.Toplevel | tk.Frame | tk.Canvas,
                  text: str,
                  width=20,
                  height=1,
@@ -205,7 +257,7 @@ class TitleLabel(tk.Label):
     """
 
     def __init__(self,
-                 master: tk.Tk | tk.Frame | tk.Canvas,
+                 master: tk.Tk | tk.Toplevel | tk.Frame | tk.Canvas,
                  text: str,
                  relx: float,
                  rely: float,
@@ -229,7 +281,7 @@ class UnderlinedEntry(tk.Entry):
     """
 
     def __init__(self,
-                 master: tk.Tk | tk.Frame | tk.Canvas,
+                 master: tk.Tk | tk.Toplevel | tk.Frame | tk.Canvas,
                  width: int,
                  sticky,
                  placeholder=""):
@@ -316,7 +368,8 @@ class OperationTypeGroup:
     similar contexts together in a visual block.
     """
 
-    def __init__(self, master: tk.Tk | tk.Frame | tk.Canvas, relx: float, rely: float, anchor=None, name=""):
+    def __init__(self, master: tk.Tk | tk.Toplevel | tk.Frame | tk.Canvas, relx: float, rely: float, anchor=None,
+                 name=""):
 
         self.groupButtons = []
         self.groupLabels = []